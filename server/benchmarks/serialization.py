@@ -0,0 +1,168 @@
+"""
+Serialization benchmark: FastAPI's response_model path against FastJSONResponse.
+
+Builds the /api/plan-trip route options and a /api/plan-trip-agent response for synthetic
+routes of increasing length, then times building them and turning them into a response body
+both ways:
+
+    pydantic   RouteOption validated on construction with coordinates as nested lists, then
+               validated again against the endpoint's response_model and serialized by
+               FastAPI into a JSONResponse, as the endpoints did before FastJSONResponse
+    fast       what the endpoints do now: RouteOption.model_construct with coordinates left
+               as a numpy view, serialized by FastJSONResponse (orjson)
+
+Run from the server directory:
+
+    python -m benchmarks.serialization --vertices 1000 10000 50000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+# main builds the agent at import time, which needs a key; the benchmark never calls the LLM
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import main  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from src.travel_agent.fast_json import FastJSONResponse  # noqa: E402
+from src.travel_agent.geometry import encode_polyline, route_geometry  # noqa: E402
+
+
+def synthetic_route(vertices: int, seed: int = 0) -> Dict[str, Any]:
+    """An OpenRoute Service-shaped route of the given number of vertices, winding west from Toronto."""
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0, 1, vertices)
+    lon = -79.38 - 40 * t + 0.3 * np.sin(t * 60) + rng.normal(0, 5e-5, vertices)
+    lat = 43.65 - 8 * t + 0.5 * np.sin(t * 23) + rng.normal(0, 5e-5, vertices)
+    return {
+        'geometry': encode_polyline(np.column_stack([lon, lat])),
+        'summary': {'distance': 2.2e6, 'duration': 80000.0},
+        'segments': [],
+    }
+
+
+def weather_samples(route: Dict[str, Any], departure_time: datetime, count: int = 12) -> List[Dict[str, Any]]:
+    """Weather samples along the route, shaped like get_weather_along_route's."""
+    lonlat = route_geometry(route).lonlat
+    samples = []
+    for i, index in enumerate(np.linspace(0, len(lonlat) - 1, count).astype(int)):
+        time = departure_time + timedelta(hours=2 * i)
+        samples.append({
+            'dt': int(time.timestamp()),
+            'weather': [{'id': 800, 'main': 'Clear', 'description': 'clear sky'}],
+            'main': {'temp': 12.5},
+            'wind': {'speed': 4.2},
+            'location': {'latitude': float(lonlat[index, 1]), 'longitude': float(lonlat[index, 0]), 'name': f"Place {i}"},
+            'time': time.isoformat(),
+        })
+    return samples
+
+
+def option_fields(route: Dict[str, Any], weather_data: List[Dict[str, Any]], departure_time: datetime, option_id: int) -> Dict[str, Any]:
+    return dict(
+        id=option_id,
+        departure_time=departure_time.isoformat(),
+        estimated_duration=str(route['summary']['duration']),
+        weather_risk="Low",
+        stops=main.create_weather_stops(weather_data),
+        score=85,
+        plan_id=f"plan-{option_id:08x}",
+    )
+
+
+def response_field(path: str):
+    return next(route.response_field for route in main.app.routes if getattr(route, 'path', None) == path)
+
+
+def pydantic_body(response_content: Any, path: str) -> bytes:
+    content = asyncio.run(serialize_response(field=response_field(path), response_content=response_content))
+    return JSONResponse(content).body
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Tuple[float, Any]:
+    """Median seconds of repeat calls, and the last result."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def benchmark_plan_trip(route: Dict[str, Any], weather_data: List[Dict[str, Any]], departure_time: datetime,
+                        options: int, repeat: int) -> Dict[str, Tuple[float, float, int]]:
+    """(build seconds, serialize seconds, body bytes) of /api/plan-trip's response for each path."""
+    geometry = route_geometry(route)
+
+    def build_pydantic():
+        return [
+            main.RouteOption(**option_fields(route, weather_data, departure_time, i), coordinates=geometry.latlon.tolist())
+            for i in range(options)
+        ]
+
+    def build_fast():
+        return [
+            main.RouteOption.model_construct(**option_fields(route, weather_data, departure_time, i), coordinates=geometry.latlon)
+            for i in range(options)
+        ]
+
+    build_p, built_p = measure(build_pydantic, repeat)
+    serialize_p, body_p = measure(lambda: pydantic_body(built_p, "/api/plan-trip"), repeat)
+    build_f, built_f = measure(build_fast, repeat)
+    serialize_f, body_f = measure(lambda: FastJSONResponse(built_f).body, repeat)
+    return {"pydantic": (build_p, serialize_p, len(body_p)), "fast": (build_f, serialize_f, len(body_f))}
+
+
+def benchmark_agent(route: Dict[str, Any], weather_data: List[Dict[str, Any]], repeat: int) -> Dict[str, Tuple[float, float, int]]:
+    """(build seconds, serialize seconds, body bytes) of /api/plan-trip-agent's response for each path."""
+    geometry = route_geometry(route)
+
+    def response(geometry_decoded: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "response": [],
+            "ai_messages_content": ["Here is your trip plan."],
+            "route_info": {"route": dict(route, geometry_decoded=geometry_decoded), "total_duration": route['summary']['duration']},
+            "weather_data": weather_data,
+            "optimal_departure_time": "2025-04-14 09:00:00",
+        }
+
+    # Plain-list coordinates, as openrouteservice.convert.decode_polyline returned them
+    build_p, built_p = measure(lambda: response({"type": "LineString", "coordinates": geometry.lonlat.tolist()}), repeat)
+    serialize_p, body_p = measure(lambda: pydantic_body(built_p, "/api/plan-trip-agent"), repeat)
+    build_f, built_f = measure(lambda: response(geometry.geojson), repeat)
+    serialize_f, body_f = measure(lambda: FastJSONResponse(built_f).body, repeat)
+    return {"pydantic": (build_p, serialize_p, len(body_p)), "fast": (build_f, serialize_f, len(body_f))}
+
+
+def report(endpoint: str, vertices: int, results: Dict[str, Tuple[float, float, int]]):
+    totals = {path: build + serialize for path, (build, serialize, _) in results.items()}
+    for path, (build, serialize, size) in results.items():
+        speedup = f"{totals['pydantic'] / totals[path]:6.1f}x" if path == "fast" else ""
+        print(f"{endpoint:20} {vertices:>8} {path:9} {build * 1000:9.2f} {serialize * 1000:11.2f} {totals[path] * 1000:9.2f} {size:>11} {speedup}")
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vertices", type=int, nargs="+", default=[1000, 10000, 50000], help="route lengths to measure")
+    parser.add_argument("--options", type=int, default=2, help="route options per /api/plan-trip response")
+    parser.add_argument("--repeat", type=int, default=7, help="runs per measurement; the median is reported")
+    args = parser.parse_args()
+
+    departure_time = datetime(2025, 4, 14, 9)
+    print(f"{'endpoint':20} {'vertices':>8} {'path':9} {'build ms':>9} {'serialize ms':>11} {'total ms':>9} {'bytes':>11} speedup")
+    for vertices in args.vertices:
+        route = synthetic_route(vertices)
+        weather_data = weather_samples(route, departure_time)
+        report("/api/plan-trip", vertices, benchmark_plan_trip(route, weather_data, departure_time, args.options, args.repeat))
+        report("/api/plan-trip-agent", vertices, benchmark_agent(route, weather_data, args.repeat))
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,185 @@
+"""
+Offline load test of the trip planning API.
+
+Starts the stand-in upstream services from loadtest.stubs, starts main.py under uvicorn with
+its upstream URLs pointed at them and a fresh cache directory, then sends requests from a
+fixed pool of trips at the chosen concurrency and reports:
+
+    throughput            completed requests per second
+    latency p50/p90/p99   per request, in milliseconds
+    errors                non-2xx responses, streamed error events and failed connections
+    outbound per request  upstream calls per request, from the server's /metrics
+
+Run from the server directory:
+
+    python -m loadtest.run --endpoint /api/plan-trip --requests 200 --concurrency 20
+
+Use --server-url to drive a server that is already running (then upstream URLs and caches
+are whatever that server was started with).
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from .stubs import CITIES, stub_environment
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUTBOUND_METRIC = re.compile(r'^travel_agent_outbound_calls_total\{[^}]*\} ([0-9.e+]+)$', re.MULTILINE)
+
+
+def trip_pool(size: int, seed: int = 0) -> List[Dict[str, str]]:
+    """Trip requests between the stub's known cities, departing on the hour over the next two days."""
+    rng = np.random.default_rng(seed)
+    cities = [name.title() for name in CITIES]
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    trips = []
+    for _ in range(size):
+        start, end = rng.choice(len(cities), size=2, replace=False)
+        departure = now + timedelta(hours=int(rng.integers(1, 48)))
+        trips.append({"start": cities[start], "end": cities[end], "departure_time": departure.isoformat()})
+    return trips
+
+
+async def outbound_calls(client: httpx.AsyncClient, server_url: str) -> float:
+    response = await client.get(f"{server_url}/metrics")
+    return sum(float(value) for value in OUTBOUND_METRIC.findall(response.text))
+
+
+async def drive(server_url: str, endpoint: str, trips: List[Dict[str, str]], total: int,
+                concurrency: int, timeout: float) -> Tuple[List[float], int, float, float]:
+    """Sends total requests, concurrency at a time. Returns latencies, errors, elapsed seconds and outbound calls."""
+    latencies: List[float] = []
+    errors = 0
+    next_request = 0
+
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        outbound_before = await outbound_calls(client, server_url)
+
+        async def worker():
+            nonlocal next_request, errors
+            while next_request < total:
+                trip = trips[next_request % len(trips)]
+                next_request += 1
+                body = [trip] if endpoint == "/api/plan-trips" else trip
+                start = time.perf_counter()
+                try:
+                    response = await client.post(f"{server_url}{endpoint}", json=body)
+                    # Read streaming responses to the end; they report failures as error events
+                    content = await response.aread()
+                    if response.status_code >= 300 or reports_error(response.headers.get("content-type", ""), content):
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        outbound = await outbound_calls(client, server_url) - outbound_before
+    return latencies, errors, elapsed, outbound
+
+
+def reports_error(content_type: str, content: bytes) -> bool:
+    """Whether a streamed response reports a failure: an SSE error event or an NDJSON {"type": "error"} line."""
+    if content_type.startswith("text/event-stream"):
+        return any(line.strip() == b"event: error" for line in content.splitlines())
+    if content_type.startswith("application/x-ndjson"):
+        for line in content.splitlines():
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(event, dict) and event.get("type") == "error":
+                return True
+    return False
+
+
+def report(endpoint: str, latencies: List[float], errors: int, elapsed: float, outbound: float):
+    milliseconds = np.array(latencies) * 1000
+    p50, p90, p99 = np.percentile(milliseconds, [50, 90, 99])
+    print(f"endpoint              {endpoint}")
+    print(f"requests              {len(latencies)} in {elapsed:.2f} s")
+    print(f"throughput            {len(latencies) / elapsed:.1f} req/s")
+    print(f"latency p50/p90/p99   {p50:.0f} / {p90:.0f} / {p99:.0f} ms (max {milliseconds.max():.0f})")
+    print(f"errors                {errors}")
+    print(f"outbound per request  {outbound / len(latencies):.2f}")
+
+
+async def wait_until_up(url: str, process: Optional[subprocess.Popen], timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=1.0) as client:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not start within {timeout:.0f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", default="/api/plan-trip", help="POST endpoint taking a TripRequest")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--trips", type=int, default=20, help="distinct trips the requests cycle through")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+    parser.add_argument("--server-url", help="drive an already running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8100, help="port for the server this harness starts")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes for the server this harness starts")
+    parser.add_argument("--stub-port", type=int, default=9100, help="first of the four stub ports")
+    parser.add_argument("--latency-ms", type=float, default=80.0, help="mean stub latency per call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub calls that fail")
+    parser.add_argument("--token-delay-ms", type=float, default=5.0, help="delay between streamed LLM tokens")
+    args = parser.parse_args()
+
+    trips = trip_pool(args.trips)
+    processes: List[subprocess.Popen] = []
+    try:
+        server_url = args.server_url
+        if server_url is None:
+            host = "127.0.0.1"
+            processes.append(subprocess.Popen([
+                sys.executable, "-m", "loadtest.stubs", "--host", host, "--base-port", str(args.stub_port),
+                "--latency-ms", str(args.latency_ms), "--error-rate", str(args.error_rate),
+                "--token-delay-ms", str(args.token_delay_ms),
+            ], cwd=SERVER_DIR, stdout=subprocess.DEVNULL))
+            cache_dir = tempfile.mkdtemp(prefix="travel-agent-loadtest-")
+            env = dict(os.environ, **stub_environment(host, args.stub_port), TRAVEL_AGENT_CACHE_DIR=cache_dir)
+            if args.workers > 1:
+                # /metrics then adds up every worker's counters
+                env["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(cache_dir, "metrics")
+                os.makedirs(env["PROMETHEUS_MULTIPROC_DIR"])
+            processes.append(subprocess.Popen([
+                sys.executable, "-m", "uvicorn", "main:app", "--host", host, "--port", str(args.port),
+                "--log-level", "warning", "--workers", str(args.workers),
+            ], cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            server_url = f"http://{host}:{args.port}"
+            asyncio.run(wait_until_up(f"http://{host}:{args.stub_port}/stats", processes[0]))
+            asyncio.run(wait_until_up(f"{server_url}/metrics", processes[1]))
+
+        latencies, errors, elapsed, outbound = asyncio.run(
+            drive(server_url, args.endpoint, trips, args.requests, args.concurrency, args.timeout))
+        report(args.endpoint, latencies, errors, elapsed, outbound)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Local stand-ins for the upstream APIs the agent calls, for load testing without network access.
+
+Each service runs as its own small FastAPI app on its own port:
+
+    ors        GET  /geocode/search, POST /v2/directions/{profile}/json   (OpenRoute Service)
+    owm        GET  /data/2.5/forecast                                   (OpenWeatherMap 5-day forecast)
+    geotime    GET  /geocode/reverse                                     (geotime reverse geocoder)
+    openai     POST /v1/chat/completions, streaming or not               (OpenAI-compatible LLM)
+
+Responses are deterministic for the same inputs and shaped like the real ones: routes have
+a polyline with a vertex about every kilometre and named steps, forecasts have 40 3-hour
+entries with weather that varies by place and time. Every service adds a configurable
+latency and fails a configurable fraction of calls with HTTP 503. Like the real ORS, directions
+requests for alternative routes between waypoints more than 100 km apart are rejected with
+HTTP 400 (error 2004).
+
+Run all four with:
+
+    python -m loadtest.stubs --base-port 9100 --latency-ms 80 --error-rate 0.01
+
+and point the server at them with the environment printed on startup.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+from typing import Any, Dict, List, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+SERVICES = ("ors", "owm", "geotime", "openai")
+
+# Known places, [longitude, latitude]; other addresses hash to a point in the same region
+CITIES = {
+    "toronto": [-79.3832, 43.6532],
+    "chicago": [-87.6298, 41.8781],
+    "detroit": [-83.0458, 42.3314],
+    "montreal": [-73.5673, 45.5017],
+    "ottawa": [-75.6972, 45.4215],
+    "new york": [-74.0060, 40.7128],
+    "boston": [-71.0589, 42.3601],
+    "cleveland": [-81.6944, 41.4993],
+    "buffalo": [-78.8784, 42.8864],
+    "pittsburgh": [-79.9959, 40.4406],
+    "indianapolis": [-86.1581, 39.7684],
+    "columbus": [-82.9988, 39.9612],
+    "hamilton": [-79.8711, 43.2557],
+    "london, ontario": [-81.2453, 42.9849],
+    "fort wayne": [-85.1394, 41.0793],
+}
+ROADS = ["I-90", "I-94", "I-80", "Highway 401", "Highway 403", "I-75", "US-20", "I-69", "Highway 402", "-"]
+WEATHER = [
+    (800, "Clear", "clear sky"),
+    (801, "Clouds", "few clouds"),
+    (803, "Clouds", "broken clouds"),
+    (500, "Rain", "light rain"),
+    (502, "Rain", "heavy intensity rain"),
+    (600, "Snow", "light snow"),
+    (741, "Fog", "fog"),
+]
+# Chance of each WEATHER entry, in order
+WEATHER_WEIGHTS = [40, 20, 15, 12, 5, 5, 3]
+ITINERARY = (
+    "Day 1: Leave in the morning and drive west on the main highway. Stop for fuel after about "
+    "four hours and take a one-hour lunch break. The forecast is mostly clear with a chance of "
+    "light rain in the afternoon. Day 2: Continue to the destination, arriving mid-afternoon."
+)
+EARTH_RADIUS_METERS = 6371000
+SPEED_METERS_PER_SECOND = 25.0
+VERTEX_SPACING_METERS = 1000.0
+# ORS's limit on the great-circle distance between waypoints of an alternative routes request
+ALTERNATIVE_ROUTES_MAX_METERS = 100000.0
+
+
+def _seed(*parts: Any) -> int:
+    return int.from_bytes(hashlib.sha1(repr(parts).encode()).digest()[:8], "big")
+
+
+def _haversine(a: List[float], b: List[float]) -> float:
+    lon1, lat1, lon2, lat2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(h))
+
+
+def encode_polyline(coordinates: List[Tuple[float, float]]) -> str:
+    """Encodes [longitude, latitude] pairs as a 5-decimal polyline, the format ORS returns."""
+    result = []
+    previous = (0, 0)
+    for lon, lat in coordinates:
+        point = (round(lat * 1e5), round(lon * 1e5))
+        for value, last in zip(point, previous):
+            delta = value - last
+            delta = ~(delta << 1) if delta < 0 else delta << 1
+            while delta >= 0x20:
+                result.append(chr((0x20 | (delta & 0x1F)) + 63))
+                delta >>= 5
+            result.append(chr(delta + 63))
+        previous = point
+    return "".join(result)
+
+
+def geocode(text: str) -> List[float]:
+    key = text.lower().strip()
+    for name, coordinates in CITIES.items():
+        if key.startswith(name):
+            return coordinates
+    rng = random.Random(_seed("geocode", key))
+    return [round(rng.uniform(-90, -72), 4), round(rng.uniform(38, 46), 4)]
+
+
+def build_route(coordinates: List[List[float]], variant: int) -> Dict[str, Any]:
+    """A route through coordinates. Variants bow out to alternate sides, like alternative routes."""
+    vertices: List[Tuple[float, float]] = [tuple(coordinates[0])]
+    segments = []
+    way_points = [0]
+    for start, end in zip(coordinates, coordinates[1:]):
+        distance = _haversine(start, end)
+        count = max(int(distance / VERTEX_SPACING_METERS), 2)
+        bow = 0.15 * variant * (-1) ** variant
+        first = len(vertices) - 1
+        for i in range(1, count + 1):
+            t = i / count
+            offset = bow * math.sin(math.pi * t) + 0.01 * math.sin(t * 37)
+            vertices.append((start[0] + (end[0] - start[0]) * t - offset * (end[1] - start[1]),
+                             start[1] + (end[1] - start[1]) * t + offset * (end[0] - start[0])))
+        last = len(vertices) - 1
+        way_points.append(last)
+
+        rng = random.Random(_seed("steps", tuple(start), tuple(end), variant))
+        steps = []
+        index = first
+        while index < last:
+            step_end = min(index + rng.randint(2, 60), last)
+            step_distance = sum(_haversine(vertices[k], vertices[k + 1]) for k in range(index, step_end))
+            steps.append({
+                "distance": round(step_distance, 1),
+                "duration": round(step_distance / SPEED_METERS_PER_SECOND, 1),
+                "type": 6,
+                "instruction": "Continue",
+                "name": rng.choice(ROADS),
+                "way_points": [index, step_end],
+            })
+            index = step_end
+        steps.append({"distance": 0.0, "duration": 0.0, "type": 10, "instruction": "Arrive", "name": "-", "way_points": [last, last]})
+        segment_distance = sum(step["distance"] for step in steps)
+        segments.append({
+            "distance": round(segment_distance, 1),
+            "duration": round(segment_distance / SPEED_METERS_PER_SECOND, 1),
+            "steps": steps,
+        })
+    return {
+        "summary": {
+            "distance": round(sum(segment["distance"] for segment in segments), 1),
+            "duration": round(sum(segment["duration"] for segment in segments), 1),
+        },
+        "segments": segments,
+        "bbox": [min(v[0] for v in vertices), min(v[1] for v in vertices), max(v[0] for v in vertices), max(v[1] for v in vertices)],
+        "geometry": encode_polyline(vertices),
+        "way_points": way_points,
+    }
+
+
+def build_forecast(lat: float, lon: float) -> Dict[str, Any]:
+    """40 3-hourly entries from the current slot; weather persists per half-degree cell and 6 hours."""
+    start = int(time.time()) // 10800 * 10800
+    entries = []
+    for i in range(40):
+        dt = start + i * 10800
+        rng = random.Random(_seed("forecast", round(lat * 2), round(lon * 2), dt // 21600))
+        weather_id, main, description = rng.choices(WEATHER, WEATHER_WEIGHTS)[0]
+        hour = time.gmtime(dt).tm_hour
+        temperature = round(25 - 0.6 * (lat - 30) + 4 * math.sin((hour - 9) / 24 * 2 * math.pi) + rng.uniform(-3, 3), 2)
+        entries.append({
+            "dt": dt,
+            "main": {"temp": temperature, "feels_like": temperature - 2, "humidity": rng.randint(40, 95)},
+            "weather": [{"id": weather_id, "main": main, "description": description, "icon": "01d"}],
+            "wind": {"speed": round(rng.uniform(0, 18), 2), "deg": rng.randint(0, 359)},
+            "dt_txt": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(dt)),
+        })
+    return {"cod": "200", "cnt": len(entries), "list": entries, "city": {"coord": {"lat": lat, "lon": lon}}}
+
+
+def reverse_geocode(lat: float, lon: float) -> Dict[str, Any]:
+    # Names change every 0.1 degree, about the size of a town
+    return {"address3": f"Town {round(lat, 1)} {round(lon, 1)}", "address4": "ON" if lat > 42 else "OH"}
+
+
+def create_app(service: str, latency_ms: float, error_rate: float, token_delay_ms: float = 5.0) -> FastAPI:
+    """The app for one stand-in service. Latency is drawn uniformly from 0.5x to 1.5x latency_ms."""
+    app = FastAPI(title=f"{service} stub")
+    app.state.calls = 0
+    rng = random.Random(_seed("errors", service))
+
+    @app.middleware("http")
+    async def latency_and_errors(request: Request, call_next):
+        app.state.calls += 1
+        await asyncio.sleep(latency_ms * rng.uniform(0.5, 1.5) / 1000)
+        if rng.random() < error_rate:
+            return JSONResponse(status_code=503, content={"error": "stub failure"})
+        return await call_next(request)
+
+    @app.get("/stats")
+    async def stats():
+        return {"service": service, "calls": app.state.calls}
+
+    if service == "ors":
+        @app.get("/geocode/search")
+        async def geocode_search(text: str):
+            coordinates = geocode(text)
+            return {"features": [{"geometry": {"type": "Point", "coordinates": coordinates}, "properties": {"label": text}}]}
+
+        @app.post("/v2/directions/{profile}/json")
+        async def directions(profile: str, request: Request):
+            body = await request.json()
+            alternatives = body.get("alternative_routes", {}).get("target_count", 1)
+            if "alternative_routes" in body:
+                distance = sum(_haversine(a, b) for a, b in zip(body["coordinates"], body["coordinates"][1:]))
+                if distance > ALTERNATIVE_ROUTES_MAX_METERS:
+                    return JSONResponse(status_code=400, content={"error": {
+                        "code": 2004,
+                        "message": f"Request parameters exceed the server configuration limits. The approximated route "
+                                   f"distance must not be greater than {ALTERNATIVE_ROUTES_MAX_METERS:.1f} meters.",
+                    }})
+            routes = [build_route(body["coordinates"], variant) for variant in range(alternatives)]
+            return {"routes": routes, "metadata": {"query": {"profile": profile}}}
+
+    elif service == "owm":
+        @app.get("/data/2.5/forecast")
+        async def forecast(lat: float, lon: float):
+            return build_forecast(lat, lon)
+
+    elif service == "geotime":
+        @app.get("/geocode/reverse")
+        async def reverse(lat: float, lon: float):
+            return reverse_geocode(lat, lon)
+
+    elif service == "openai":
+        @app.post("/v1/chat/completions")
+        async def chat_completions(request: Request):
+            body = await request.json()
+            model = body.get("model", "gpt-4o-mini")
+            created = int(time.time())
+            words = ITINERARY.split(" ")
+            if not body.get("stream"):
+                return {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": ITINERARY}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 500, "completion_tokens": len(words), "total_tokens": 500 + len(words)},
+                }
+
+            async def chunks():
+                for i, word in enumerate(words):
+                    chunk = {
+                        "id": "chatcmpl-stub",
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(token_delay_ms / 1000)
+                done = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                yield f"data: {json.dumps(done)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    return app
+
+
+def stub_environment(host: str, base_port: int) -> Dict[str, str]:
+    """Environment variables that point the server at stubs started with the same host and base port."""
+    urls = {service: f"http://{host}:{base_port + offset}" for offset, service in enumerate(SERVICES)}
+    return {
+        "ORS_BASE_URL": urls["ors"],
+        "OWM_BASE_URL": urls["owm"],
+        "GEOTIME_BASE_URL": urls["geotime"],
+        "OPENAI_BASE_URL": f"{urls['openai']}/v1",
+        "OPENAI_API_KEY": "stub",
+        "OPENROUTE_SERVICE_API_KEY": "stub",
+        "OPENWEATHERMAP_API_KEY": "stub",
+    }
+
+
+async def serve(host: str, base_port: int, latency_ms: float, error_rate: float, token_delay_ms: float):
+    servers = [
+        uvicorn.Server(uvicorn.Config(
+            create_app(service, latency_ms, error_rate, token_delay_ms),
+            host=host, port=base_port + offset, log_level="warning", access_log=False,
+        ))
+        for offset, service in enumerate(SERVICES)
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--base-port", type=int, default=9100, help="ors, owm, geotime and openai use this port and the next three")
+    parser.add_argument("--latency-ms", type=float, default=80.0, help="mean added latency per call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with HTTP 503")
+    parser.add_argument("--token-delay-ms", type=float, default=5.0, help="delay between streamed LLM tokens")
+    args = parser.parse_args()
+    for name, value in stub_environment(args.host, args.base_port).items():
+        print(f"{name}={value}")
+    asyncio.run(serve(args.host, args.base_port, args.latency_ms, args.error_rate, args.token_delay_ms))
+
+
+if __name__ == "__main__":
+    main()
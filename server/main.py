@@ -1,15 +1,28 @@
+import asyncio
+import gzip
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Optional, Any
+from typing import List, Optional, Any, AsyncIterator, Tuple, Union
 import logging
+import os
+import tempfile
+import uuid
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, PrivateAttr
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest, multiprocess
 from langchain_core.messages import HumanMessage
 # from src.travel_agent import mock_agent as agent  # Use mock implementation
 from src.travel_agent import agent  # Use mock implementation
-import openrouteservice
+from src.travel_agent import cache_backend, fast_json, http_client, metrics, prefetch
+from src.travel_agent.fast_json import FastJSONResponse
+from src.travel_agent.artifacts import PLAN, ROUTE, WEATHER, get_artifact_store
+from src.travel_agent.geocode_cache import close_reverse_geocode_cache, get_reverse_geocode_cache, normalize_address
+from src.travel_agent.geometry import route_geometry, simplified_polyline
+from src.travel_agent.hazards import SEVERE, Hazard, describe as describe_hazard, hazards_in
+from src.travel_agent.singleflight import SingleFlight, SingleFlightStream
 import json
 
 # Configure logging
@@ -19,7 +32,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="AI Trip Planner API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Re-warm the forecasts of popular routes after each forecast update
+    tasks = [asyncio.create_task(purge_caches(float(os.getenv("CACHE_PURGE_INTERVAL_SECONDS", "3600"))))]
+    if os.getenv("PREFETCH_ENABLED", "true").lower() == "true":
+        tasks.append(asyncio.create_task(prefetch.create_prefetcher(agent.warm_forecast_cache).run()))
+    yield
+    for task in tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    # Release the pooled upstream connections and commit buffered cache writes
+    await http_client.aclose()
+    await cache_backend.close_cache_backend()
+    await asyncio.to_thread(close_reverse_geocode_cache)
+
+# Delete expired entries from the on-disk caches every interval_seconds, so they don't grow without bound
+async def purge_caches(interval_seconds: float):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        for cache in (cache_backend.get_cache_backend(), get_reverse_geocode_cache()):
+            try:
+                removed = await asyncio.to_thread(cache.purge_expired)
+            except Exception as e:
+                logger.warning(f"Error purging {type(cache).__name__}: {e}")
+            else:
+                logger.debug(f"Purged {removed} expired entries from {type(cache).__name__}")
+
+app = FastAPI(title="AI Trip Planner API", lifespan=lifespan)
 
 # Configure CORS for frontend
 app.add_middleware(
@@ -30,6 +73,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    # Streaming responses get the totals as of when their headers are sent
+    with metrics.track_request() as request_metrics:
+        response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.observe_request(route.path if route else "unmatched", request_metrics)
+    response.headers["Server-Timing"] = request_metrics.server_timing()
+    return response
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        # Aggregate the metrics every worker writes to the shared directory
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     logger.exception("An error occurred while processing the request")
@@ -78,6 +140,7 @@ class RouteOption(BaseModel):
         stops: List of WeatherStop objects representing waypoints along the route.
         score: Route quality score from 0-100, considering weather and timing.
         coordinates: List of [latitude, longitude] pairs defining the route geometry.
+        plan_id: Handle of the stored plan, for re-planning with another departure time via /api/re-plan.
     """
     id: int
     departure_time: str
@@ -86,6 +149,44 @@ class RouteOption(BaseModel):
     stops: List[WeatherStop]
     score: int
     coordinates: List[List[float]]
+    plan_id: Optional[str] = None
+    # What the option was planned from: the route info, whose OpenRoute Service route gives the
+    # compact form's polyline, and the weather along it, for an itinerary of this option
+    _route_info: Optional[dict] = PrivateAttr(default=None)
+    _weather_data: Optional[List[dict]] = PrivateAttr(default=None)
+
+class ReplanRequest(BaseModel):
+    """
+    Represents a request to re-plan a stored plan for another departure time.
+
+    Attributes:
+        plan_id: The plan_id of a route option returned by /api/plan-trip.
+        departure_time: ISO formatted new departure time string (e.g. "2025-04-14T11:00:00").
+    """
+    plan_id: str
+    departure_time: str
+
+class DepartureRiskRequest(BaseModel):
+    """
+    Represents a request for the weather risk of every departure time of a stored plan.
+
+    Attributes:
+        plan_id: The plan_id of a route option returned by /api/plan-trip.
+        resolution_minutes: Spacing between the candidate departure times.
+    """
+    plan_id: str
+    resolution_minutes: int = 60
+
+class DepartureRisk(BaseModel):
+    """
+    Represents the weather risk of departing at one candidate time.
+
+    Attributes:
+        departure_time: Candidate departure time in ISO format.
+        hazards: Number of hazardous forecasts along the route when departing then.
+    """
+    departure_time: str
+    hazards: int
 
 class PlanTripResponse(BaseModel):
     response: Any  # Adjust fields based on the actual response structure
@@ -94,6 +195,23 @@ class PlanTripResponse(BaseModel):
     weather_data: Any
     optimal_departure_time: str
 
+# Compact responses, requested with ?compact=true: route geometry as an encoded polyline
+# simplified for the map zoom level given by ?zoom=, no duplicated bodies, and gzip
+DEFAULT_ZOOM = 10
+
+def compact_route_option(option: RouteOption, zoom: int) -> dict:
+    payload = {name: value for name, value in option if name != 'coordinates'}
+    payload['polyline'] = simplified_polyline(option._route_info['route'], zoom)
+    return payload
+
+def compact_json_response(payload: Any, raw_request: Request) -> Response:
+    body = fast_json.dumps(payload)
+    headers = {"Vary": "Accept-Encoding"}
+    if "gzip" in raw_request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, media_type="application/json", headers=headers)
+
 @app.post("/api/trial", response_model=List[str])
 async def plan_trip(request: TripRequest):
     try:
@@ -105,7 +223,7 @@ async def plan_trip(request: TripRequest):
 
         # Generate full itinerary using LLM
         logger.debug("Generating itinerary")
-        itinerary = agent.passthrough_llm_function(
+        itinerary = await agent.passthrough_llm_function.coroutine(
             request.start,
             request.end,
             departure_time
@@ -117,172 +235,641 @@ async def plan_trip(request: TripRequest):
         logger.exception("Error processing trip request")
         raise HTTPException(status_code=500, detail=str(e))
 
+def agent_prompt(request: TripRequest) -> str:
+    return f"I want a detailed itinerary for a trip from {request.start} to {request.end}, departing at {request.departure_time}. Please provide major stops along the way and weather conditions at each stop at the time of arrival. Include estimated travel time and any potential weather risks. Please provide best time to leave to avoid bad weather."
+
+# Resolve the route and weather handles in generate_itinerary_with_llm's output. The route
+# gets its geometry decoded, or in compact form only simplified for the zoom level.
+def itinerary_result(itinerary_tool_output_data: dict, compact_zoom: Optional[int] = None) -> dict:
+    store = get_artifact_store()
+    route_artifact = store.get(itinerary_tool_output_data["route"], ROUTE)
+    weather_artifact = store.get(itinerary_tool_output_data["weather"], WEATHER)
+    route_info = None
+    if route_artifact:
+        route_info = dict(route_artifact["route_info"])
+        if compact_zoom is None:
+            route_info["route"] = dict(route_info["route"], geometry_decoded=route_geometry(route_info["route"]).geojson)
+        else:
+            route_info["route"] = dict(route_info["route"], geometry=simplified_polyline(route_info["route"], compact_zoom))
+    return {
+        "route_info": route_info,
+        "weather_data": weather_artifact["weather_data"] if weather_artifact else None,
+        "optimal_departure_time": itinerary_tool_output_data.get("optimal_departure_time"),
+    }
+
 @app.post("/api/plan-trip-agent", response_model=PlanTripResponse)
-async def ask_travel_agent(request: TripRequest):
-    prompt = f"I want a detailed itinerary for a trip from {request.start} to {request.end}, departing at {request.departure_time}. Please provide major stops along the way and weather conditions at each stop at the time of arrival. Include estimated travel time and any potential weather risks. Please provide best time to leave to avoid bad weather."
+async def ask_travel_agent(request: TripRequest, raw_request: Request, compact: bool = False, zoom: int = DEFAULT_ZOOM):
+    """
+    Plans a trip with the agent. With compact=true, "response" (every message of the
+    conversation) is left out, route_info's geometry is simplified for map zoom level zoom
+    and not also sent decoded, and the response is gzipped for clients that accept it.
+    """
+    # Identical concurrent requests share one agent run, the most LLM-expensive work there is
+    all_messages, ai_messages_content, itinerary_tool_output_data = await trip_plans.do(
+        trip_key("plan-trip-agent", request, request.departure_time),
+        lambda: run_agent(request),
+    )
+    weather_data = None
+    route_info = None
+    optimal_departure_time = None
+    if itinerary_tool_output_data:
+        result = itinerary_result(itinerary_tool_output_data, zoom if compact else None)
+        route_info = result["route_info"]
+        weather_data = result["weather_data"]
+        optimal_departure_time = result["optimal_departure_time"]
+
+    if compact:
+        return compact_json_response({
+            "ai_messages_content": ai_messages_content,
+            "route_info": route_info,
+            "weather_data": weather_data,
+            "optimal_departure_time": optimal_departure_time
+        }, raw_request)
+
+    return FastJSONResponse({
+        "response": all_messages,
+        "ai_messages_content": ai_messages_content,
+        "route_info": route_info,
+        "weather_data": weather_data,
+        "optimal_departure_time": optimal_departure_time
+    })
+
+# Run the agent on a trip request, returning every message, the AI messages' content and the
+# parsed output of generate_itinerary_with_llm, if it was called
+async def run_agent(request: TripRequest) -> Tuple[List[Any], List[Any], Optional[dict]]:
+    prompt = agent_prompt(request)
     # Use the agent
     # config = {"configurable": {"thread_id": "abc123"}}
     all_messages = []
     ai_messages_content = []
     itinerary_tool_output_data = None
-    weather_data = None
-    route_info = None
-    optimal_departure_time = None
-    agent_stream = agent.agent_executor.stream(
+    agent_stream = agent.agent_executor.astream(
         {"messages": [HumanMessage(content=prompt)]},
         # config,
         stream_mode="values",
     )
-    for step in agent_stream:
+    async for step in agent_stream:
         step["messages"][-1].pretty_print()
         msg = step["messages"][-1]
         all_messages.append(msg)
         if msg.type == "ai":
             ai_messages_content.append(msg.content)
         if msg.type == "tool" and msg.name == "generate_itinerary_with_llm":
-            itinerary_tool_output_data = json.loads(msg.content)
-    if itinerary_tool_output_data:
-        route_info = json.loads(itinerary_tool_output_data["route_info"])
-        route_info["route"]["geometry_decoded"] = openrouteservice.convert.decode_polyline(route_info["route"].get('geometry', ''))
-        weather_data = json.loads(itinerary_tool_output_data["weather_data"])
-        optimal_departure_time = itinerary_tool_output_data.get("optimal_departure_time")
+            itinerary_tool_output_data = itinerary_tool_output(msg.content) or itinerary_tool_output_data
+    return all_messages, ai_messages_content, itinerary_tool_output_data
+
+# The parsed output of generate_itinerary_with_llm, or None when the tool returned an error
+# message such as "Could not retrieve route information." instead of its JSON result
+def itinerary_tool_output(content: Any) -> Optional[dict]:
+    if not isinstance(content, str):
+        return None
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+# Calculate weather risk based on hazard types and count
+def calculate_weather_risk(hazards: List[Hazard]) -> str:
+    if not hazards:
+        return "Low"
+    severe_count = sum(1 for hazard in hazards if hazard.severity == SEVERE)
+    if severe_count > 1:
+        return "High"
+    elif severe_count == 1 or len(hazards) > 2:
+        return "Medium"
+    return "Low"
+
+# Score a route from its weather risk; base is the score of a low-risk route
+def calculate_route_score(weather_risk: str, base: int) -> int:
+    return base if weather_risk == "Low" else (base - 10 if weather_risk == "Medium" else base - 20)
+
+# Create a weather stop from a sampled weather point
+def create_weather_stop(data: dict) -> Optional[WeatherStop]:
+    if not data or 'location' not in data:
+        return None
+    lat = data['location']['latitude']
+    lon = data['location']['longitude']
+    return WeatherStop(
+        location=data['location'].get('name', 'Unknown'),
+        arrival_time=data['time'],
+        weather=f"{data['weather'][0]['description'].capitalize()}, {data['main']['temp']}°C",
+        coordinates=[lat, lon]  # WeatherStop expects [latitude, longitude]
+    )
 
-    return {
-        "response": all_messages,
-        "ai_messages_content": ai_messages_content,
+# Create weather stops from the sampled weather points
+def create_weather_stops(weather_data: List[dict]) -> List[WeatherStop]:
+    return [stop for stop in map(create_weather_stop, weather_data) if stop]
+
+def create_route_option(option_id: int, departure_time: datetime, route_info: dict,
+                        weather_data: List[dict], score_base: int, plan_id: Optional[str] = None) -> RouteOption:
+    hazards = hazards_in(weather_data)
+    weather_risk = calculate_weather_risk(hazards)
+    # Built without validation; coordinates stay a numpy view until FastJSONResponse serializes them
+    option = RouteOption.model_construct(
+        id=option_id,
+        departure_time=departure_time.isoformat(),
+        estimated_duration=str(route_info.get('total_duration', 0)),
+        weather_risk=weather_risk,
+        stops=create_weather_stops(weather_data),
+        score=calculate_route_score(weather_risk, score_base),
+        coordinates=route_geometry(route_info['route']).latlon,
+        plan_id=plan_id,
+    )
+    option._route_info = route_info
+    option._weather_data = weather_data
+    return option
+
+# Create route option with optimal departure time
+async def create_optimal_route_option(route_info: dict, optimal_time: datetime, plan_id: Optional[str] = None,
+                                      score_penalty: int = 0) -> RouteOption:
+    # The route doesn't depend on departure time; only its legs are re-timed, on a copy
+    optimal_route_info = dict(route_info, route=dict(route_info['route']))
+    agent.add_legs_to_route(optimal_route_info['route'], optimal_time)
+    optimal_weather = await agent.get_weather_along_route.coroutine(optimal_route_info['route'], optimal_time, sampling="adaptive")
+    return create_route_option(2, optimal_time, optimal_route_info, optimal_weather, score_base=90 - score_penalty, plan_id=plan_id)
+
+# Score penalty for a route slower than the fastest: a point per 2% of extra travel time, up to 20
+def calculate_detour_penalty(duration: float, fastest_duration: float) -> int:
+    if fastest_duration <= 0:
+        return 0
+    return min(20, round(50 * (duration / fastest_duration - 1)))
+
+# Count the trip towards its corridor's popularity, for the forecast prefetcher
+async def record_corridor(request: TripRequest, weather_data: List[dict]):
+    points = [(data['location']['latitude'], data['location']['longitude']) for data in weather_data if 'location' in data]
+    if points:
+        await prefetch.get_corridor_tracker().record(request.start, request.end, points)
+
+# Plan the route options for a trip: for the recommended route and each alternative, the
+# requested departure and, if better, the optimal one. The recommended route at the requested
+# departure comes first, as the trip asked for; the other options follow, ranked by score
+async def plan_route_options(request: TripRequest, departure_time: datetime) -> List[RouteOption]:
+    # Forecast series and place names are fetched once per point and shared by the routes,
+    # the departure sweeps and the optimal departures
+    with agent.batch_memo():
+        # Get route info from OpenRoute Service
+        logger.debug("Fetching route information")
+        route_info = await agent.get_driving_route.coroutine([request.start, request.end], departure_time, agent.ROUTE_ALTERNATIVES)
+        if not route_info:
+            logger.warning("No route found")
+            raise HTTPException(status_code=404, detail="Route not found")
+        route_infos = [route_info, *route_info.pop('alternatives', [])]
+        fastest_duration = min(info.get('total_duration', 0) for info in route_infos)
+
+        # Evaluate the routes concurrently
+        results = await asyncio.gather(*(
+            plan_single_route(info, departure_time, calculate_detour_penalty(info.get('total_duration', 0), fastest_duration))
+            for info in route_infos
+        ))
+        await record_corridor(request, [data for _, weather_data in results for data in weather_data])
+
+        requested, *others = (option for options, _ in results for option in options)
+        route_options = [requested, *sorted(others, key=lambda option: option.score, reverse=True)]
+        for option_id, option in enumerate(route_options, start=1):
+            option.id = option_id
+        return route_options
+
+# Plan the route options for one route, returning them with the weather along the route
+async def plan_single_route(route_info: dict, departure_time: datetime, score_penalty: int) -> Tuple[List[RouteOption], List[dict]]:
+    agent.add_legs_to_route(route_info['route'], departure_time)
+
+    # Get weather data along route
+    logger.debug("Fetching weather data")
+    weather_data = await agent.get_weather_along_route.coroutine(route_info['route'], departure_time, sampling="adaptive")
+    plan_id = await store_plan(departure_time, route_info, weather_data, score_penalty)
+
+    # Get optimal departure time
+    logger.debug("Calculating optimal departure time")
+    optimal_time = await agent.suggest_departure_time.coroutine(route_info['route'], weather_data, departure_time)
+
+    # Create route option with original departure time
+    logger.debug("Creating route options")
+    original_route = create_route_option(1, departure_time, route_info, weather_data, score_base=85 - score_penalty, plan_id=plan_id)
+
+    # Create route option with optimal departure time if different
+    if optimal_time != departure_time:
+        return [original_route, await create_optimal_route_option(route_info, optimal_time, plan_id, score_penalty)], weather_data
+    return [original_route], weather_data
+
+# Trip plans by plan ID, shared by all workers so /api/re-plan can be served by any of them
+plans = cache_backend.SharedCache(
+    PLAN,
+    float(os.getenv("PLAN_STORE_TTL_SECONDS", "3600")),
+    int(os.getenv("PLAN_STORE_SIZE", "256")),
+)
+
+# Keep what a plan was built from, so it can be re-timed for another departure
+async def store_plan(departure_time: datetime, route_info: dict, weather_data: List[dict], score_penalty: int = 0) -> str:
+    plan_id = f"{PLAN}-{uuid.uuid4().hex[:8]}"
+    await plans.set(plan_id, json.dumps({
+        "departure_time": departure_time.isoformat(),
         "route_info": route_info,
         "weather_data": weather_data,
-        "optimal_departure_time": optimal_departure_time
-    }
+        "score_penalty": score_penalty,
+    }))
+    return plan_id
+
+# The plan stored under plan_id, or None if it is unknown or expired
+async def load_plan(plan_id: str) -> Optional[dict]:
+    stored = await plans.get(plan_id)
+    if stored is None:
+        return None
+    plan = json.loads(stored)
+    plan['departure_time'] = datetime.fromisoformat(plan['departure_time'])
+    return plan
+
+@app.post("/api/re-plan", response_model=List[RouteOption])
+async def re_plan(request: ReplanRequest, raw_request: Request, compact: bool = False, zoom: int = DEFAULT_ZOOM):
+    """
+    Re-plans a trip planned by /api/plan-trip for another departure time. The route, sampled
+    points and place names of the stored plan are reused; only the arrival times, the forecast
+    slots picked for them and the optimal departure are recomputed, from cached forecasts.
 
-@app.post("/api/plan-trip", response_model=List[RouteOption])
-async def plan_trip(request: TripRequest):
+    Plans are kept in the shared cache backend for PLAN_STORE_TTL_SECONDS, so any worker can
+    re-plan them. Unknown or expired plan IDs get a 404, upon which the trip should be planned again.
+    Takes compact and zoom like /api/plan-trip.
+    """
+    plan = await load_plan(request.plan_id)
+    if plan is None:
+        raise HTTPException(status_code=404, detail="Plan not found or expired")
     try:
-        logger.info(f"Processing trip request from {request.start} to {request.end}")
-
-        # Convert string to datetime
         departure_time = datetime.fromisoformat(request.departure_time)
-        logger.debug(f"Parsed departure time: {departure_time}")
+        route_info = plan['route_info']
+        score_penalty = plan['score_penalty']
+        with agent.forecast_memo():
+            weather_data = await agent.retime_weather_along_route(plan['weather_data'], plan['departure_time'], departure_time)
+            optimal_time = await agent.suggest_departure_time.coroutine(route_info['route'], weather_data, departure_time)
+            route_options = [create_route_option(1, departure_time, route_info, weather_data, score_base=85 - score_penalty, plan_id=request.plan_id)]
+            if optimal_time != departure_time:
+                optimal_weather = await agent.retime_weather_along_route(plan['weather_data'], plan['departure_time'], optimal_time)
+                route_options.append(create_route_option(2, optimal_time, route_info, optimal_weather, score_base=90 - score_penalty, plan_id=request.plan_id))
+        if compact:
+            return compact_json_response([compact_route_option(option, zoom) for option in route_options], raw_request)
+        return FastJSONResponse(route_options)
 
-        # Get route info from OpenRoute Service
-        logger.debug("Fetching route information")
-        route_info = agent.get_driving_route.func([request.start, request.end], departure_time)
-        agent.add_legs_to_route(route_info['route'], departure_time)
-        route_info["route"]["geometry_decoded"] = openrouteservice.convert.decode_polyline(route_info["route"].get('geometry', ''))
+    except Exception as e:
+        logger.exception("Error re-planning trip")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        if not route_info:
-            logger.warning("No route found")
-            raise HTTPException(status_code=404, detail="Route not found")
+@app.post("/api/departure-risk", response_model=List[DepartureRisk])
+async def departure_risk(request: DepartureRiskRequest):
+    """
+    The weather risk curve of a trip planned by /api/plan-trip: the number of hazardous
+    forecasts along the route for every departure from the plan's departure time to the end
+    of the forecast horizon, resolution_minutes apart. The optimal departure of the plan's
+    route options is the earliest one with the fewest hazards.
 
-        # Get weather data along route
-        logger.debug("Fetching weather data")
-        weather_data = agent.get_weather_along_route.func(route_info['route'], departure_time)
+    Unknown or expired plan IDs get a 404, as for /api/re-plan.
+    """
+    if request.resolution_minutes < 1:
+        raise HTTPException(status_code=400, detail="resolution_minutes must be at least 1")
+    plan = await load_plan(request.plan_id)
+    if plan is None:
+        raise HTTPException(status_code=404, detail="Plan not found or expired")
+    try:
+        with agent.forecast_memo():
+            curve = await agent.get_departure_risk_curve(plan['weather_data'], plan['departure_time'], request.resolution_minutes)
+        return FastJSONResponse(curve.to_list())
 
-        # Get optimal departure time
-        logger.debug("Calculating optimal departure time")
-        optimal_time = agent.suggest_departure_time.func(route_info['route'], weather_data, departure_time)
+    except Exception as e:
+        logger.exception("Error computing departure risk")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Generate full itinerary using LLM
+# Trip plans in flight, keyed by endpoint and trip
+trip_plans = SingleFlight()
+# Agent event streams in flight, so identical concurrent streaming requests share one agent run
+agent_streams = SingleFlightStream()
+
+# departure_time is kept as given where an endpoint doesn't parse it, as the agent's
+def trip_key(endpoint: str, request: TripRequest, departure_time: Union[datetime, str]) -> tuple:
+    if isinstance(departure_time, datetime):
+        departure_time = departure_time.isoformat()
+    return (endpoint, normalize_address(request.start), normalize_address(request.end), departure_time)
+
+async def plan_trip_with_itinerary(request: TripRequest, departure_time: datetime) -> List[RouteOption]:
+    with agent.forecast_memo():
+        route_options = await plan_route_options(request, departure_time)
+
+        # Generate full itinerary using LLM for the best scoring option, from the route and
+        # weather already fetched for it
         logger.debug("Generating itinerary")
-        itinerary = agent.generate_itinerary_with_llm.func(
+        best = max(route_options, key=lambda option: option.score)
+        itinerary = await agent.prepare_itinerary(
             request.start,
             request.end,
-            optimal_time.isoformat()
+            datetime.fromisoformat(best.departure_time),
+            best._route_info,
+            best._weather_data,
         )
+        await agent.ainvoke_cached(agent.itinerary_chain(), itinerary["inputs"], itinerary["cache_key"])
+    return route_options
 
-        # Extract route coordinates for visualization
-        logger.debug("Extracting route coordinates")
-        geometry = route_info['route'].get('geometry', {})
-        coordinates = []
-        if geometry:
-            decoded = agent.openrouteservice.convert.decode_polyline(geometry)
-            coordinates = [[coord[1], coord[0]] for coord in decoded.get('coordinates', [])]
-
-        # Analyze weather hazards
-        hazards = agent.analyze_weather_conditions.func(weather_data)
-
-        # Calculate weather risk based on hazard types and count
-        def calculate_weather_risk(hazards):
-            if not hazards:
-                return "Low"
-            severe_conditions = ["Snow/Sleet", "Heavy Rain", "Strong Winds"]
-            severe_count = sum(1 for h in hazards if any(c in h for c in severe_conditions))
-            if severe_count > 1:
-                return "High"
-            elif severe_count == 1 or len(hazards) > 2:
-                return "Medium"
-            return "Low"
-
-        # Create weather stops from the sampled weather points
-        def create_weather_stops(weather_data):
-            stops = []
-            for data in weather_data:
-                if not data or 'location' not in data:
-                    continue
-                lat = data['location']['latitude']
-                lon = data['location']['longitude']
-                stops.append(WeatherStop(
-                    location=data['location'].get('name', 'Unknown'),
-                    arrival_time=data['time'],
-                    weather=f"{data['weather'][0]['description'].capitalize()}, {data['main']['temp']}°C",
-                    coordinates=[lat, lon]  # WeatherStop expects [latitude, longitude]
-                ))
-            return stops
-
-        # Create route option with original departure time
-        logger.debug("Creating route options")
-        weather_risk = calculate_weather_risk(hazards)
-        original_route = RouteOption(
-            id=1,
-            departure_time=departure_time.isoformat(),
-            estimated_duration=str(route_info.get('total_duration', 0)),
-            weather_risk=weather_risk,
-            stops=create_weather_stops(weather_data),
-            score=85 if weather_risk == "Low" else (75 if weather_risk == "Medium" else 65),
-            coordinates=coordinates
-        )
+@app.post("/api/plan-trip", response_model=List[RouteOption])
+async def plan_trip(request: TripRequest, raw_request: Request, compact: bool = False, zoom: int = DEFAULT_ZOOM):
+    """
+    Plans a trip, returning route options: first the recommended route at the requested
+    departure, then the other departures and alternative routes ranked by score. With compact=true each option's
+    coordinates are replaced by "polyline", the route encoded as a polyline (5 decimal places,
+    latitude first) and simplified for map zoom level zoom, and the response is gzipped for
+    clients that accept it.
+    """
+    try:
+        logger.info(f"Processing trip request from {request.start} to {request.end}")
+
+        # Convert string to datetime
+        departure_time = datetime.fromisoformat(request.departure_time)
+        logger.debug(f"Parsed departure time: {departure_time}")
 
-        # Create route option with optimal departure time if different
-        optimal_route = None
-        if optimal_time != departure_time:
-            optimal_route_info = agent.get_driving_route.func([request.start, request.end], optimal_time)
-            agent.add_legs_to_route(optimal_route_info['route'], optimal_time)
-            optimal_route_info["route"]["geometry_decoded"] = openrouteservice.convert.decode_polyline(optimal_route_info["route"].get('geometry', ''))
-            optimal_weather = agent.get_weather_along_route.func(optimal_route_info['route'], optimal_time)
-            optimal_hazards = agent.analyze_weather_conditions.func(optimal_weather)
-            optimal_risk = calculate_weather_risk(optimal_hazards)
-
-            # Extract coordinates from optimal route
-            optimal_geometry = optimal_route_info['route'].get('geometry', {})
-            optimal_coordinates = []
-            if optimal_geometry:
-                decoded = agent.openrouteservice.convert.decode_polyline(optimal_geometry)
-                optimal_coordinates = [[coord[1], coord[0]] for coord in decoded.get('coordinates', [])]
-
-            optimal_route = RouteOption(
-                id=2,
-                departure_time=optimal_time.isoformat(),
-                estimated_duration=str(optimal_route_info.get('total_duration', 0)),
-                weather_risk=optimal_risk,
-                stops=create_weather_stops(optimal_weather),
-                score=90 if optimal_risk == "Low" else (80 if optimal_risk == "Medium" else 70),
-                coordinates=optimal_coordinates
-            )
+        # Identical requests in flight at the same time share one plan
+        route_options = await trip_plans.do(
+            trip_key("plan-trip", request, departure_time),
+            lambda: plan_trip_with_itinerary(request, departure_time),
+        )
 
         logger.info("Successfully processed trip request")
-        return [original_route, optimal_route] if optimal_route else [original_route]
+        if compact:
+            return compact_json_response([compact_route_option(option, zoom) for option in route_options], raw_request)
+        return FastJSONResponse(route_options)
 
     except Exception as e:
         logger.exception("Error processing trip request")
         raise HTTPException(status_code=500, detail=str(e))
 
+class TripPlan(BaseModel):
+    """
+    The result for one trip of a /api/plan-trips batch.
+
+    Attributes:
+        request: The trip as it was requested.
+        options: The route options /api/plan-trip would return for it; empty on error.
+        error: Why the trip could not be planned, if it could not.
+    """
+    request: TripRequest
+    options: List[RouteOption] = []
+    error: Optional[str] = None
+
+@app.post("/api/plan-trips", response_model=List[TripPlan])
+async def plan_trips(requests: List[TripRequest], raw_request: Request, compact: bool = False, zoom: int = DEFAULT_ZOOM):
+    """
+    Plans many trips at once, e.g. a fleet leaving one depot, returning one TripPlan per
+    request in the same order. Every distinct address is geocoded once, every distinct
+    route fetched once, and forecast series and reverse geocodes are shared by all trips,
+    so trips with common endpoints cost little more than one. Itineraries are not generated.
+    Takes compact and zoom like /api/plan-trip.
+    """
+    logger.info(f"Processing batch of {len(requests)} trip requests")
+    with agent.batch_memo():
+        # Resolve each distinct address, then each distinct route, once up front;
+        # the trips below read them back from the geocode and directions caches
+        await agent.geocode_addresses([address for request in requests for address in (request.start, request.end)])
+        pairs = {}
+        for request in requests:
+            pairs.setdefault((normalize_address(request.start), normalize_address(request.end)), request)
+        await asyncio.gather(*map(prefetch_route, pairs.values()))
+
+        results = await asyncio.gather(*(plan_batch_trip(request) for request in requests))
+
+    logger.info("Successfully processed batch trip request")
+    if compact:
+        return compact_json_response([
+            dict(plan.model_dump(exclude={'options'}), options=[compact_route_option(option, zoom) for option in plan.options])
+            for plan in results
+        ], raw_request)
+    return FastJSONResponse(results)
+
+async def prefetch_route(request: TripRequest):
+    # Errors are left for plan_batch_trip to report against the trip
+    try:
+        await agent.get_driving_route.coroutine([request.start, request.end], datetime.fromisoformat(request.departure_time))
+    except Exception:
+        pass
+
+async def plan_batch_trip(request: TripRequest) -> TripPlan:
+    try:
+        departure_time = datetime.fromisoformat(request.departure_time)
+        options = await trip_plans.do(trip_key("plan-trips", request, departure_time), lambda: plan_route_options(request, departure_time))
+        return TripPlan(request=request, options=options)
+    except HTTPException as e:
+        return TripPlan(request=request, error=e.detail)
+    except Exception as e:
+        logger.exception(f"Error planning trip from {request.start} to {request.end}")
+        return TripPlan(request=request, error=str(e))
+
+@app.post("/api/plan-trip/stream")
+async def plan_trip_stream(request: TripRequest):
+    """
+    Streaming variant of /api/plan-trip. Responds with newline-delimited JSON events, each
+    sent as soon as its stage finishes:
+
+        {"type": "route", "departure_time", "estimated_duration", "route_summary", "coordinates"}
+        {"type": "stop", "index", "stop"}            one per WeatherStop, in completion order;
+                                                     index gives the stop's position along the route
+        {"type": "risk", "plan_id", "weather_risk", "score", "hazards"}
+        {"type": "option", "option"}                 RouteOption for the optimal departure, if it differs
+        {"type": "done"}
+
+    Errors after the response has started are sent as {"type": "error", "detail"}.
+    """
+    logger.info(f"Streaming trip request from {request.start} to {request.end}")
+    departure_time = datetime.fromisoformat(request.departure_time)
+    return StreamingResponse(plan_trip_events(request, departure_time), media_type="application/x-ndjson")
+
+async def plan_trip_events(request: TripRequest, departure_time: datetime) -> AsyncIterator[str]:
+    def event(payload: dict) -> str:
+        return fast_json.dumps(payload).decode() + "\n"
+
+    try:
+        with agent.forecast_memo():
+            route_info = await agent.get_driving_route.coroutine([request.start, request.end], departure_time)
+            if not route_info:
+                logger.warning("No route found")
+                yield event({"type": "error", "detail": "Route not found"})
+                return
+            agent.add_legs_to_route(route_info['route'], departure_time)
+            yield event({
+                "type": "route",
+                "departure_time": departure_time.isoformat(),
+                "estimated_duration": str(route_info.get('total_duration', 0)),
+                "route_summary": route_info.get('route_summary'),
+                "coordinates": route_geometry(route_info['route']).latlon.tolist(),
+            })
+
+            results = []
+            async for index, data in agent.iter_weather_along_route(route_info['route'], departure_time, sampling="adaptive"):
+                results.append((index, data))
+                stop = create_weather_stop(data)
+                if stop:
+                    yield event({"type": "stop", "index": index, "stop": stop})
+            weather_data = [data for _, data in sorted(results, key=lambda result: result[0])]
+            await record_corridor(request, weather_data)
+            plan_id = await store_plan(departure_time, route_info, weather_data)
+
+            hazards = hazards_in(weather_data)
+            weather_risk = calculate_weather_risk(hazards)
+            yield event({
+                "type": "risk",
+                "plan_id": plan_id,
+                "weather_risk": weather_risk,
+                "score": calculate_route_score(weather_risk, 85),
+                "hazards": [describe_hazard(hazard) for hazard in hazards],
+            })
+
+            optimal_time = await agent.suggest_departure_time.coroutine(route_info['route'], weather_data, departure_time)
+            if optimal_time != departure_time:
+                optimal_route = await create_optimal_route_option(route_info, optimal_time, plan_id)
+                yield event({"type": "option", "option": optimal_route})
+        yield event({"type": "done"})
+
+    except Exception as e:
+        logger.exception("Error streaming trip request")
+        yield event({"type": "error", "detail": str(e)})
+
+# Server-Sent Events
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {fast_json.dumps(data).decode()}\n\n"
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    # Tell proxies not to buffer, or the tokens arrive all at once
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/api/plan-trip-agent/stream")
+async def ask_travel_agent_stream(request: TripRequest):
+    """
+    Streaming variant of /api/plan-trip-agent. Responds with Server-Sent Events:
+
+        token        {"text", "node"}               LLM output as it is generated; node is the agent
+                                                     graph node ("agent", or "tools" for LLM calls made
+                                                     inside a tool)
+        tool_start   {"run_id", "name", "input"}
+        tool_end     {"run_id", "name", "output"}
+        result       {"route_info", "weather_data", "optimal_departure_time"}
+                                                     once generate_itinerary_with_llm has finished
+        done         {}
+
+    Errors after the response has started are sent as an error event {"detail"}.
+    """
+    logger.info(f"Streaming agent request from {request.start} to {request.end}")
+    return sse_response(agent_streams.stream(
+        trip_key("plan-trip-agent/stream", request, request.departure_time),
+        lambda: agent_stream_events(request),
+    ))
+
+async def agent_stream_events(request: TripRequest) -> AsyncIterator[str]:
+    try:
+        agent_events = agent.agent_executor.astream_events(
+            {"messages": [HumanMessage(content=agent_prompt(request))]},
+            version="v2",
+        )
+        async for agent_event in agent_events:
+            kind = agent_event["event"]
+            if kind == "on_chat_model_stream":
+                text = agent_event["data"]["chunk"].content
+                if text:
+                    yield sse_event("token", {"text": text, "node": agent_event["metadata"].get("langgraph_node")})
+            elif kind == "on_tool_start":
+                yield sse_event("tool_start", {
+                    "run_id": agent_event["run_id"],
+                    "name": agent_event["name"],
+                    "input": agent_event["data"].get("input"),
+                })
+            elif kind == "on_tool_end":
+                output = agent_event["data"].get("output")
+                content = getattr(output, "content", output)
+                yield sse_event("tool_end", {"run_id": agent_event["run_id"], "name": agent_event["name"], "output": content})
+                if agent_event["name"] == "generate_itinerary_with_llm":
+                    data = itinerary_tool_output(content)
+                    if data is not None:
+                        yield sse_event("result", itinerary_result(data))
+        yield sse_event("done", {})
+
+    except Exception as e:
+        logger.exception("Error streaming agent request")
+        yield sse_event("error", {"detail": str(e)})
+
+@app.post("/api/trial/stream")
+async def plan_trip_trial_stream(request: TripRequest):
+    """
+    Streaming variant of /api/trial. Responds with Server-Sent Events: token {"text"} as the
+    itinerary is generated, then done {}, or error {"detail"}.
+    """
+    departure_time = datetime.fromisoformat(request.departure_time)
+    inputs = agent.passthrough_inputs(request.start, request.end, departure_time)
+    return sse_response(chain_token_events(agent.passthrough_chain(), inputs, agent.passthrough_cache_key(inputs)))
+
+@app.post("/api/itinerary/stream")
+async def itinerary_stream(request: TripRequest):
+    """
+    Streams the generate_itinerary_with_llm itinerary. Responds with Server-Sent Events:
+
+        context      {"route_summary", "weather_summary", "optimal_departure_time"}
+                                                     once the route, weather and departure sweep are done
+        token        {"text"}                        itinerary text as it is generated
+        done         {}
+
+    Errors after the response has started are sent as an error event {"detail"}.
+    """
+    departure_time = datetime.fromisoformat(request.departure_time)
+    return sse_response(itinerary_events(request, departure_time))
+
+async def itinerary_events(request: TripRequest, departure_time: datetime) -> AsyncIterator[str]:
+    try:
+        itinerary = await agent.prepare_itinerary(request.start, request.end, departure_time)
+        if not itinerary:
+            yield sse_event("error", {"detail": "Route not found"})
+            return
+        yield sse_event("context", {
+            "route_summary": itinerary["route_info"].get("route_summary"),
+            "weather_summary": itinerary["weather_summary"],
+            "optimal_departure_time": itinerary["optimal_departure_time"].isoformat(),
+        })
+        async for event in chain_token_events(agent.itinerary_chain(), itinerary["inputs"], itinerary["cache_key"]):
+            yield event
+
+    except Exception as e:
+        logger.exception("Error streaming itinerary")
+        yield sse_event("error", {"detail": str(e)})
+
+async def chain_token_events(chain, inputs: dict, cache_key: tuple) -> AsyncIterator[str]:
+    try:
+        # A cached response is sent as a single token
+        cached = await agent.get_cached_llm_response(cache_key)
+        if cached is not None:
+            yield sse_event("token", {"text": cached})
+            yield sse_event("done", {})
+            return
+
+        chunks = []
+        with metrics.stage("llm"):
+            async for text in chain.astream(inputs):
+                if text:
+                    chunks.append(text)
+                    yield sse_event("token", {"text": text})
+        await agent.cache_llm_response(cache_key, "".join(chunks))
+        yield sse_event("done", {})
+
+    except Exception as e:
+        logger.exception("Error streaming LLM response")
+        yield sse_event("error", {"detail": str(e)})
+
 if __name__ == "__main__":
-    uvicorn_config = uvicorn.Config(
-        app,
-        host="0.0.0.0",
-        port=8000,
-        log_level="debug",
-        access_log=True
-    )
-    server = uvicorn.Server(uvicorn_config)
-    server.run()
+    # Workers share the geocode, directions, forecast and LLM caches through the cache backend
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        # Workers write their metrics to a shared directory, which /metrics adds up. It has to
+        # be set before the workers import prometheus_client, and start out empty
+        if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="travel-agent-metrics-")
+        # Each worker imports the app itself
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, log_level="debug", access_log=True, workers=workers)
+    else:
+        uvicorn_config = uvicorn.Config(
+            app,
+            host="0.0.0.0",
+            port=8000,
+            log_level="debug",
+            access_log=True
+        )
+        server = uvicorn.Server(uvicorn_config)
+        server.run()
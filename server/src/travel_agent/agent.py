@@ -1,6 +1,9 @@
-import requests
+import asyncio
+import hashlib
+import httpx
+import time
 from datetime import datetime, timedelta, timezone
-from typing import List, Tuple, Dict, Optional, Any
+from typing import List, Tuple, Dict, Optional, Any, AsyncIterator, Awaitable
 from langchain_openai import ChatOpenAI
 from langchain_core.tools import tool
 from langgraph.prebuilt import create_react_agent
@@ -11,13 +14,26 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from dotenv import load_dotenv  # Added import
 import json
+import logging
 import os  # Added import
-import openrouteservice
-import math
 
 from typing import Literal
-from functools import lru_cache
-
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from . import http_client
+from .artifacts import ROUTE, WEATHER, get_artifact_store
+from .cache_backend import SharedCache
+from .departure_sweep import FORECAST_SLOT_SECONDS, ForecastSeries, DepartureCurve, sweep_departures, to_timestamp
+from .geocode_cache import PointIndex, get_geocode_cache, get_reverse_geocode_cache, haversine_meters, normalize_address
+from .hazards import describe as describe_hazard, hazards_in
+from .metrics import record_cache_lookup, stage, timed
+from .route_digest import route_digest
+from .sampling import DEFAULT_SAMPLE_BUDGET, adaptive_sample_distances, fixed_sample_distances, forecast_cell
+from .singleflight import SingleFlight
+from .timeline import route_timeline
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables from .env file
 load_dotenv()  # Added line
@@ -27,39 +43,156 @@ OPENWEATHERMAP_API_KEY = os.getenv("OPENWEATHERMAP_API_KEY")  # Updated line
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")  # Updated line
 OPENROUTE_SERVICE_API_KEY = os.getenv("OPENROUTE_SERVICE_API_KEY")  # Updated line
 
+# Upstream API base URLs; overridden to point at local stand-ins for load testing
+ORS_BASE_URL = os.getenv("ORS_BASE_URL", "https://api.openrouteservice.org")
+OWM_BASE_URL = os.getenv("OWM_BASE_URL", "https://api.openweathermap.org")
+GEOTIME_BASE_URL = os.getenv("GEOTIME_BASE_URL", "https://geoservices.geotime.com")
+
+# Alternative routes fetched besides the recommended one, in the same directions call
+ROUTE_ALTERNATIVES = int(os.getenv("ROUTE_ALTERNATIVES", "2"))
+# ORS rejects alternative routes between stops farther apart than this (100 km on the public API)
+ROUTE_ALTERNATIVES_MAX_KM = float(os.getenv("ROUTE_ALTERNATIVES_MAX_KM", "100"))
+
+# ORS directions responses by (profile, coordinates, options), shared by all workers
+_directions_cache = SharedCache(
+    "directions",
+    float(os.getenv("DIRECTIONS_CACHE_TTL_SECONDS", str(24 * 3600))),
+    int(os.getenv("DIRECTIONS_CACHE_SIZE", "256")),
+)
+
+# 5-day forecast lists by forecast grid cell, shared by all workers until the next forecast slot
+_forecast_cache = SharedCache("forecast", FORECAST_SLOT_SECONDS)
+
+# Outbound calls in flight, so identical concurrent calls from different requests are made once
+_outbound = SingleFlight()
+
+# LLM responses by prompt and inputs, shared by all workers. Entries also expire at the next
+# forecast slot boundary, when the forecast they were written from may have been updated.
+_llm_cache = SharedCache(
+    "llm",
+    float(os.getenv("LLM_CACHE_TTL_SECONDS", str(FORECAST_SLOT_SECONDS))),
+    int(os.getenv("LLM_CACHE_SIZE", "128")),
+)
+
+def seconds_until_next_forecast_slot() -> float:
+    return FORECAST_SLOT_SECONDS - time.time() % FORECAST_SLOT_SECONDS
+
+# 5-day forecast series fetched during the current request, keyed by forecast grid cell.
+# The series doesn't depend on departure time, so the departure sweep only needs to pick slots from it.
+# Values are futures so concurrent lookups of the same point share one fetch.
+_forecast_memo: ContextVar[Optional[Dict[Tuple[int, int], "asyncio.Future[Optional[ForecastSeries]]"]]] = ContextVar("forecast_memo", default=None)
+
+@contextmanager
+def forecast_memo():
+    """
+    Memoizes 5-day forecast series by point for the duration of a request.
+    Re-entrant: nested uses share the outermost memo.
+    """
+    if _forecast_memo.get() is not None:
+        yield
+        return
+    token = _forecast_memo.set({})
+    try:
+        yield
+    finally:
+        _forecast_memo.reset(token)
+
+# Reverse geocode lookups in flight, shared by every trip of a batch so that trips passing
+# the same places wait on one lookup instead of each missing the cache.
+# Indexed by location, so finding a lookup near a point doesn't scan every lookup of the batch.
+_reverse_lookups: ContextVar[Optional[PointIndex["asyncio.Future[Optional[str]]"]]] = ContextVar("reverse_lookups", default=None)
+
+@contextmanager
+def batch_memo():
+    """
+    Shares forecast series and in-flight reverse geocode lookups between everything run
+    inside it, e.g. the trips of a batch planned concurrently. Re-entrant like forecast_memo().
+    """
+    with forecast_memo():
+        if _reverse_lookups.get() is not None:
+            yield
+            return
+        token = _reverse_lookups.set(PointIndex(get_reverse_geocode_cache().radius_meters))
+        try:
+            yield
+        finally:
+            _reverse_lookups.reset(token)
+
+async def get_forecast_series(latitude: float, longitude: float) -> Optional[ForecastSeries]:
+    """
+    Returns the 5-day forecast series for a point as columnar arrays, fetching it at most
+    once per forecast grid cell per request when called inside forecast_memo().
+    Returns None on error.
+    """
+    memo = _forecast_memo.get()
+    if memo is None:
+        return await _fetch_forecast_series(latitude, longitude)
+    key = forecast_cell(latitude, longitude)
+    record_cache_lookup("forecast", key in memo)
+    if key not in memo:
+        memo[key] = asyncio.ensure_future(_fetch_forecast_series(latitude, longitude))
+    return await asyncio.shield(memo[key])
+
+async def _fetch_forecast_series(latitude: float, longitude: float) -> Optional[ForecastSeries]:
+    key = json.dumps(forecast_cell(latitude, longitude))
+    cached = await _forecast_cache.get(key)
+    record_cache_lookup("forecast_shared", cached is not None)
+    if cached is not None:
+        return ForecastSeries(json.loads(cached))
+
+    forecasts = await _fetch_forecast_list(latitude, longitude, key)
+    return ForecastSeries(forecasts) if forecasts is not None else None
+
+async def _fetch_forecast_list(latitude: float, longitude: float, key: str) -> Optional[List[Dict[str, Any]]]:
+    """Fetches a point's 5-day forecast list and stores it in the shared cache under key."""
+    weather_data = await get_weather_forecast_for_next_5_days.coroutine(latitude, longitude)
+    if not weather_data or 'list' not in weather_data:
+        return None
+    await _forecast_cache.set(key, json.dumps(weather_data['list']), ttl_seconds=seconds_until_next_forecast_slot())
+    return weather_data['list']
+
+async def warm_forecast_cache(latitude: float, longitude: float) -> bool:
+    """
+    Fetches a point's 5-day forecast into the shared cache unless its grid cell is already
+    cached. Used by the background prefetcher. Returns whether an upstream call was made.
+    """
+    key = json.dumps(forecast_cell(latitude, longitude))
+    if await _forecast_cache.get(key) is not None:
+        return False
+    await _fetch_forecast_list(latitude, longitude, key)
+    return True
+
 # Add legs to the route for backward compatibility with existing frontend code
 def add_legs_to_route(route: Dict[str, Any], departure_time: datetime):
-    geometry = openrouteservice.convert.decode_polyline(route.get('geometry', ''))
-    coordinates = geometry.get('coordinates', [])
+    timeline = route_timeline(route)
+    coordinates = timeline.geometry.lonlat
     segments = route.get('segments', [])
     if not segments:
-        print("No segments found in route.")
+        logger.warning("No segments found in route.")
         return {}
     route['legs'] = []
 
-    arrival_time = departure_time
-
     # Add legs for backward compatibility with existing frontend code
     for i in range(len(segments)):
         for j in range(len(segments[i]['steps']) - 1):
             step = segments[i]['steps'][j]
             next_step = segments[i]['steps'][j + 1]
 
-            arrival_time = arrival_time + timedelta(seconds=step["duration"])
             way_points = step.get('way_points', [])
+            arrival_time = departure_time + timedelta(seconds=float(timeline.time_at_vertex(way_points[1])))
             leg = {
                 'distance': {'text': f'{step['distance'] / 1000} km'},
                 'duration': {'text': f'{step['duration'] / 1000} hours'},
                 'start_address': step['name'],
                 'end_address': next_step['name'],
                 'arrival_time': arrival_time.isoformat(),
-                'start_location': {'lat': coordinates[way_points[0]][1], 'lng': coordinates[way_points[0]][0]},
-                'end_location': {'lat': coordinates[way_points[1]][1], 'lng': coordinates[way_points[1]][0]}
+                'start_location': {'lat': float(coordinates[way_points[0], 1]), 'lng': float(coordinates[way_points[0], 0])},
+                'end_location': {'lat': float(coordinates[way_points[1], 1]), 'lng': float(coordinates[way_points[1], 0])}
             }
             route['legs'].append(leg)
 
 @tool
-def get_driving_route(stops: List[str], departure_time: datetime) -> Dict[str, Any]:
+async def get_driving_route(stops: List[str], departure_time: datetime, alternatives: int = 0) -> Dict[str, Any]:
     """
     Gets driving directions and route information from OpenRoute Service API for multiple stops.
 
@@ -67,6 +200,9 @@ def get_driving_route(stops: List[str], departure_time: datetime) -> Dict[str, A
         stops: A list of addresses representing the stops in the route.  The first address is the origin,
                and the last address is the destination, with any intermediate stops in between.
         departure_time: The departure time as a datetime object.
+        alternatives: Include up to this many alternative routes, at most ROUTE_ALTERNATIVES.
+            OpenRoute Service only finds alternatives between two stops no more than
+            ROUTE_ALTERNATIVES_MAX_KM apart; other trips get none.
 
     Returns:
         A dictionary containing:
@@ -76,73 +212,44 @@ def get_driving_route(stops: List[str], departure_time: datetime) -> Dict[str, A
             - 'route_summary': A human-readable summary of the route.
             - 'waypoints': A list of dictionaries, where each dictionary contains the geocoded
                           coordinates (longitude and latitude) for each stop.
+            - 'alternatives': Only when alternatives were requested, a list of dictionaries with the
+                          keys above for each alternative route found.
     """
     if not stops:
         return {}
 
-    # Geocode all stops
-    geocode_url = "https://api.openrouteservice.org/geocode/search"
-    headers = {"Accept": "application/json, application/geo+json; charset=utf-8"}
-    waypoints = []
-    coordinates = []
-
-    for stop in stops:
-        geocode_params = {
-            "api_key": OPENROUTE_SERVICE_API_KEY,
-            "text": stop,
-        }
-        try:
-            response = requests.get(geocode_url, headers=headers, params=geocode_params)
-            response.raise_for_status()
-            data = response.json()
-            if data and data['features']:
-                coordinates.append(data['features'][0]['geometry']['coordinates'])
-                waypoints.append({
-                    'address': stop,
-                    'coordinates': data['features'][0]['geometry']['coordinates']  # [longitude, latitude]
-                })
-            else:
-                print(f"Geocoding failed for stop: {stop}")
-                return {} # Return empty dict if any geocoding fails.  Consider alternative error handling.
-
-        except requests.exceptions.RequestException as e:
-            print(f"Error during geocoding for stop {stop}: {e}")
-            return {}
-        except KeyError as e:
-            print(f"Error parsing geocoding response for stop {stop}: {e}")
-            return {}
+    # Geocode all stops, concurrently for the ones not already cached
+    coordinates = await geocode_addresses(stops)
+    if any(coordinate is None for coordinate in coordinates):
+        return {} # Return empty dict if any geocoding fails.  Consider alternative error handling.
+    waypoints = [
+        {'address': stop, 'coordinates': coordinate}  # [longitude, latitude]
+        for stop, coordinate in zip(stops, coordinates)
+    ]
     # Construct routing request
-    url = "https://api.openrouteservice.org/v2/directions/driving-car/json"
-    headers = {
-        "Accept": "application/json, application/geo+json, application/gpx+xml, img/png; charset=utf-8",
-        "Authorization": "5b3ce3597851110001cf624844e6651e687a47c891d67364876ea355",
-        "Content-Type": "application/json; charset=utf-8",
-    }
-    body = {
-        "coordinates": coordinates,
-        "geometry_simplify": "true"
-        # "alternative_routes":{"target_count":2,"weight_factor":1.4,"share_factor":0.6},
-    }
-    try:
-        response = requests.post(url, headers=headers, json=body)
-        response.raise_for_status()
-        route_data = response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching route: {e}")
-        return {}
-    except KeyError as e:
-        print(f"Error parsing route data: {e}")
-        return {}
+    options = {"geometry_simplify": "true"}
+    alternatives = min(alternatives, ROUTE_ALTERNATIVES)
+    if (alternatives > 0 and len(stops) == 2
+            and haversine_meters(coordinates[0][1], coordinates[0][0], coordinates[1][1], coordinates[1][0]) <= ROUTE_ALTERNATIVES_MAX_KM * 1000):
+        # The target count includes the recommended route
+        options["alternative_routes"] = {"target_count": alternatives + 1, "weight_factor": 1.4, "share_factor": 0.6}
+    route_data = await fetch_directions(coordinates, options=options)
 
     if not route_data or not route_data.get('routes'):
-        print("No route found.")
+        logger.warning("No route found.")
         return {}
 
-    route = route_data['routes'][0]
-    segments = route.get('segments', [])
-    if not segments:
-        print("No segments found in route.")
+    routes = [route for route in route_data['routes'] if route.get('segments')]
+    if not routes:
+        logger.warning("No segments found in route.")
         return {}
+    route_info, *alternative_infos = [_route_info(route, stops, waypoints, departure_time) for route in routes]
+    if alternatives > 0:
+        route_info['alternatives'] = alternative_infos[:alternatives]
+    return route_info
+
+def _route_info(route: Dict[str, Any], stops: List[str], waypoints: List[Dict[str, Any]],
+                departure_time: datetime) -> Dict[str, Any]:
     duration = route['summary'].get('duration', 0) # seconds
     distance = route['summary'].get('distance', 0) # meters
     arrival_time = departure_time + timedelta(seconds=duration)
@@ -159,8 +266,125 @@ def get_driving_route(stops: List[str], departure_time: datetime) -> Dict[str, A
     }
 
 
+async def fetch_directions(coordinates: List[List[float]], profile: str = "driving-car",
+                           options: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Fetches directions from OpenRoute Service, reusing a cached response for the same
+    coordinate sequence, profile and options. Routes don't depend on departure time.
+
+    Args:
+        coordinates: [longitude, latitude] pairs to route through, in order.
+        profile: OpenRoute Service routing profile.
+        options: Extra directions request parameters.
+
+    Returns:
+        The parsed directions response, or None on error. Each call returns a fresh copy
+        that callers may modify.
+    """
+    options = options or {}
+    key = (
+        profile,
+        tuple((round(lon, 6), round(lat, 6)) for lon, lat in coordinates),
+        json.dumps(options, sort_keys=True),
+    )
+    key = json.dumps(key)
+    cached = await _directions_cache.get(key)
+    record_cache_lookup("directions", cached is not None)
+    if cached is not None:
+        return json.loads(cached)
+
+    # Concurrent requests for the same route share one call; each parses its own copy of the body
+    text = await _outbound.do(("directions", key), lambda: _fetch_directions_text(coordinates, profile, options))
+    if text is None:
+        return None
+    route_data = json.loads(text)
+    if route_data and route_data.get('routes'):
+        await _directions_cache.set(key, text)
+    return route_data
+
+@timed("directions")
+async def _fetch_directions_text(coordinates: List[List[float]], profile: str, options: Dict[str, Any]) -> Optional[str]:
+    url = f"{ORS_BASE_URL}/v2/directions/{profile}/json"
+    headers = {
+        "Accept": "application/json, application/geo+json, application/gpx+xml, img/png; charset=utf-8",
+        "Authorization": "5b3ce3597851110001cf624844e6651e687a47c891d67364876ea355",
+        "Content-Type": "application/json; charset=utf-8",
+    }
+    body = {"coordinates": coordinates, **options}
+    try:
+        response = await http_client.post(url, headers=headers, json=body)
+        response.raise_for_status()
+        response.json()
+    except httpx.HTTPStatusError as e:
+        if e.response.is_client_error and "alternative_routes" in options:
+            # ORS rejects alternatives for some trips, e.g. over its distance limit; fetch the route alone.
+            # The fallback is cached under the original key, so the trip isn't rejected again.
+            logger.warning(f"Alternative routes rejected ({e.response.status_code}), fetching the route without them")
+            return await _fetch_directions_text(coordinates, profile, {k: v for k, v in options.items() if k != "alternative_routes"})
+        logger.warning(f"Error fetching route: {e}")
+        return None
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning(f"Error fetching route: {e}")
+        return None
+    # Keep the raw body so every caller and cache hit parses into its own copy
+    return response.text
+
+async def geocode_addresses(addresses: List[str]) -> List[Optional[List[float]]]:
+    """
+    Geocodes addresses to [longitude, latitude] through the persistent geocode cache.
+    Misses are looked up concurrently, once per distinct normalized address.
+
+    Returns:
+        Coordinates in the same order as addresses, with None where geocoding failed.
+    """
+    cache = get_geocode_cache()
+    resolved = {}
+    misses = {}
+    for address in addresses:
+        key = normalize_address(address)
+        if key in resolved or key in misses:
+            continue
+        coordinates = await cache.get(address)
+        record_cache_lookup("geocode", coordinates is not None)
+        if coordinates is not None:
+            resolved[key] = coordinates
+        else:
+            misses[key] = address
+    results = await asyncio.gather(*(
+        _outbound.do(("geocode", key), lambda address=address: _fetch_geocode(address))
+        for key, address in misses.items()
+    ))
+    for (key, address), coordinates in zip(misses.items(), results):
+        resolved[key] = coordinates
+        if coordinates is not None:
+            await cache.set(address, coordinates)
+    return [resolved[normalize_address(address)] for address in addresses]
+
+@timed("geocode")
+async def _fetch_geocode(stop: str) -> Optional[List[float]]:
+    geocode_url = f"{ORS_BASE_URL}/geocode/search"
+    headers = {"Accept": "application/json, application/geo+json; charset=utf-8"}
+    geocode_params = {
+        "api_key": OPENROUTE_SERVICE_API_KEY,
+        "text": stop,
+    }
+    try:
+        response = await http_client.get(geocode_url, headers=headers, params=geocode_params)
+        response.raise_for_status()
+        data = response.json()
+        if data and data['features']:
+            return data['features'][0]['geometry']['coordinates']  # [longitude, latitude]
+        logger.warning(f"Geocoding failed for stop: {stop}")
+        return None
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning(f"Error during geocoding for stop {stop}: {e}")
+        return None
+    except KeyError as e:
+        logger.warning(f"Error parsing geocoding response for stop {stop}: {e}")
+        return None
+
 @tool
-def get_weather_forecast(latitude: float, longitude: float, time: datetime) -> Dict[str, Any]:
+async def get_weather_forecast(latitude: float, longitude: float, time: datetime) -> Dict[str, Any]:
     """
     Fetches weather forecast data for a specific location and time from OpenWeatherMap API.
 
@@ -175,30 +399,24 @@ def get_weather_forecast(latitude: float, longitude: float, time: datetime) -> D
     if time.tzinfo is None:
         time = time.replace(tzinfo=timezone.utc)
     try:
-        weather_data = get_weather_forecast_for_next_5_days.func(latitude, longitude)
+        series = await get_forecast_series(latitude, longitude)
+        if series is None:
+            return None
         # Find the forecast closest to the specified time
-        closest_forecast = None
-        min_time_diff = float('inf')
-
-        for forecast in weather_data['list']:
-            forecast_time = datetime.fromtimestamp(forecast['dt'], tz=timezone.utc)
-            time_diff = abs((forecast_time - time).total_seconds())
-
-            if time_diff < min_time_diff:
-                min_time_diff = time_diff
-                closest_forecast = forecast
+        closest_forecast = series.closest_entry(time)
 
-        return closest_forecast if closest_forecast else {}
+        # Copy since the series may be shared across departure times and callers annotate the result
+        return dict(closest_forecast) if closest_forecast else {}
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching weather data: {e}")
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning(f"Error fetching weather data: {e}")
         return None
     except KeyError as e:
-        print(f"Error parsing weather data: {e}")
+        logger.warning(f"Error parsing weather data: {e}")
         return None
 
 @tool
-def get_weather_forecast_for_next_5_days(latitude: float, longitude: float) -> Dict[str, Any]:
+async def get_weather_forecast_for_next_5_days(latitude: float, longitude: float) -> Dict[str, Any]:
     """
     Fetches weather forecast data for next 5 days from current time from OpenWeatherMap API.
     Return the forecast for the next 5 days starting from the given time.
@@ -211,18 +429,23 @@ def get_weather_forecast_for_next_5_days(latitude: float, longitude: float) -> D
     Returns:
         The weather forecast data as a dictionary, or None on error.
     """
-    url = f"https://api.openweathermap.org/data/2.5/forecast?lat={latitude}&lon={longitude}&appid={OPENWEATHERMAP_API_KEY}&units=metric"  # Use metric units
+    # Concurrent requests for the same point share one call and its (read-only) result
+    return await _outbound.do(("forecast", latitude, longitude), lambda: _fetch_5_day_forecast(latitude, longitude))
+
+@timed("forecast")
+async def _fetch_5_day_forecast(latitude: float, longitude: float) -> Optional[Dict[str, Any]]:
+    url = f"{OWM_BASE_URL}/data/2.5/forecast?lat={latitude}&lon={longitude}&appid={OPENWEATHERMAP_API_KEY}&units=metric"  # Use metric units
     try:
-        response = requests.get(url)
+        response = await http_client.get(url)
         response.raise_for_status()
         weather_data = response.json()
         return weather_data
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching weather data: {e}")
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning(f"Error fetching weather data: {e}")
         return None
     except KeyError as e:
-        print(f"Error parsing weather data: {e}")
+        logger.warning(f"Error parsing weather data: {e}")
         return None
 
 
@@ -237,33 +460,13 @@ def analyze_weather_conditions(weather_data: List[Dict[str, Any]]) -> List[str]:
     Returns:
         A list of strings describing any hazardous conditions.
     """
-    hazards = []
-    for data in weather_data:
-        weather = data.get('weather', [])
-        if not weather:
-            continue
-        description = weather[0].get('description', '').lower()
-        temperature = data.get('main', {}).get('temp', 0)
-        wind_speed = data.get('wind', {}).get('speed', 0)
-        time = datetime.fromtimestamp(data['dt'], tz=timezone.utc)  # added line
-
-        if "snow" in description or "sleet" in description:
-            hazards.append(f"Snow/Sleet at {time.strftime('%Y-%m-%d %H:%M')}")  # modified line
-        elif "heavy rain" in description:
-            hazards.append(f"Heavy Rain at {time.strftime('%Y-%m-%d %H:%M')}")  # modified line
-        elif "fog" in description:
-            hazards.append(f"Fog at {time.strftime('%Y-%m-%d %H:%M')}")  # modified line
-        elif temperature < 0:
-            hazards.append(f"Freezing Temperatures ({temperature}°C) at {time.strftime('%Y-%m-%d %H:%M')}")  # modified line
-        elif wind_speed > 15:  # Consider 15 m/s as a threshold for strong winds
-            hazards.append(f"Strong Winds ({wind_speed} m/s) at {time.strftime('%Y-%m-%d %H:%M')}")  # modified line
-
-    return hazards
+    # Classified from condition ids, temperature and wind; see hazards.py
+    return [describe_hazard(hazard) for hazard in hazards_in(weather_data)]
 
 
 @tool
-def suggest_departure_time(route: Dict[str, Any], weather_data: List[Dict[str, Any]],
-                          departure_time: datetime) -> datetime:
+async def suggest_departure_time(route: Dict[str, Any], weather_data: List[Dict[str, Any]],
+                          departure_time: datetime, resolution_minutes: int = 60) -> datetime:
     """
     Suggests an optimal departure time based on weather conditions along the route.
 
@@ -271,6 +474,7 @@ def suggest_departure_time(route: Dict[str, Any], weather_data: List[Dict[str, A
         route: The route data from OpenRoute Service.
         weather_data: The weather forecast data for the route.
         departure_time: the departure time the user wants to depart
+        resolution_minutes: Spacing between the candidate departure times that are compared.
 
     Returns:
         The suggested departure time as a datetime object.
@@ -281,41 +485,91 @@ def suggest_departure_time(route: Dict[str, Any], weather_data: List[Dict[str, A
         return departure_time
 
     # Analyze weather conditions
-    hazards = analyze_weather_conditions.func(weather_data)
-    print(hazards)
+    hazards = hazards_in(weather_data)
 
     if not hazards:
         return departure_time
 
-    print("Potential hazards detected:")
-    for hazard in hazards:
-        print(hazard)
-
-    # Calculate the time with the least hazards.
-    best_departure_time = departure_time
-    min_hazards = len(hazards)  # Start with the number of hazards at the original departure time
-
-    # Check a few departure times around the original time
-    # for i in [-48, -24, -15, -9, -3, 3, 6, 9, 12, 15, 21, 24, 36, 48, 72, 96]:  # Check 24 hours before and 727 hours after the original time for every 3 hours (weather forecast interval is 3 hours)
-    for i in [3, 6, 9, 12, 15, 21, 24, 36, 48, 72, 96]:  # Current weather forecast doesn't seem to give the previous data.
-        alternative_departure_time = departure_time + timedelta(hours=i)
-        # Get new weather data for the alternative departure time
-        alternative_weather_data = get_weather_along_route.func(route, alternative_departure_time)
-        alternative_hazards = analyze_weather_conditions.func(alternative_weather_data)
-        num_hazards = len(alternative_hazards)
-
-        if num_hazards < min_hazards:
-            min_hazards = num_hazards
-            best_departure_time = alternative_departure_time
-    return best_departure_time
-
-@lru_cache(maxsize=1000)
-def reverse_geocode(lat: float, lon: float) -> str:
-    """Get place name from coordinates using geoservices.geotime.com reverse geocoding.
-    Results are cached using LRU cache with a maximum size of 1000 entries."""
-    geocode_url = f"https://geoservices.geotime.com/geocode/reverse?lat={lat}&lon={lon}"
+    logger.debug("Potential hazards detected:\n" + "\n".join(describe_hazard(hazard) for hazard in hazards))
+
+    # Pick the earliest departure with the fewest hazards across the whole forecast horizon.
+    # Current weather forecast doesn't give the previous data, so only later departures are considered.
+    curve = await get_departure_risk_curve(weather_data, departure_time, resolution_minutes)
+    return curve.best()
+
+async def get_departure_risk_curve(weather_data: List[Dict[str, Any]], departure_time: datetime,
+                             resolution_minutes: int = 60) -> DepartureCurve:
+    """
+    Scores every departure time in the forecast horizon against the forecast series of the
+    points sampled by get_weather_along_route.
+
+    Args:
+        weather_data: The weather data returned by get_weather_along_route for departure_time.
+        departure_time: The departure time the weather data was sampled for.
+        resolution_minutes: Spacing between candidate departure times.
+
+    Returns:
+        A DepartureCurve holding the hazard count for each candidate departure.
+    """
+    points = [data for data in weather_data if 'location' in data and 'time' in data]
+    point_series = await asyncio.gather(*(
+        get_forecast_series(data['location']['latitude'], data['location']['longitude']) for data in points
+    ))
+    series = []
+    arrival_offsets = []
+    for data, s in zip(points, point_series):
+        if s is None:
+            continue
+        series.append(s)
+        arrival_offsets.append((datetime.fromisoformat(data['time']) - departure_time).total_seconds())
+    with stage("departure_sweep"):
+        return sweep_departures(series, arrival_offsets, departure_time, resolution_minutes * 60)
+
+async def reverse_geocode_lookups(points: List[Tuple[float, float]]) -> List["asyncio.Future[str]"]:
+    """
+    Starts place name lookups for a batch of (latitude, longitude) points, using
+    geoservices.geotime.com reverse geocoding, and returns one future per point, so callers
+    can use each name as soon as its own lookup finishes.
+
+    Points near a place already in the reverse geocode cache reuse its name. The remaining
+    misses are grouped so points within the cache radius of each other share one lookup,
+    and the lookups run concurrently.
+    """
+    cache = get_reverse_geocode_cache()
+    cached_names = await asyncio.to_thread(cache.nearest_many, points)
+    lookups = _reverse_lookups.get()
+    if lookups is None:
+        lookups = PointIndex(cache.radius_meters)
+    names = []
+    for (lat, lon), name in zip(points, cached_names):
+        record_cache_lookup("reverse_geocode", name is not None)
+        if name is None:
+            lookup = lookups.nearest(lat, lon)
+            if lookup is None:
+                lookup = asyncio.ensure_future(_outbound.do(("reverse", lat, lon), lambda lat=lat, lon=lon: _lookup_place_name(lat, lon)))
+                lookups.add(lat, lon, lookup)
+            names.append(asyncio.ensure_future(_place_name_or_fallback(lookup, lat, lon)))
+        else:
+            cached = asyncio.get_running_loop().create_future()
+            cached.set_result(name)
+            names.append(cached)
+    return names
+
+async def _lookup_place_name(lat: float, lon: float) -> Optional[str]:
+    name = await _fetch_place_name(lat, lon)
+    if name is not None:
+        get_reverse_geocode_cache().set(lat, lon, name)
+    return name
+
+async def _place_name_or_fallback(lookup: Awaitable[Optional[str]], lat: float, lon: float) -> str:
+    # Shielded because a batch shares the lookup with other trips. Fallback to coordinates
+    return (await asyncio.shield(lookup)) or f"Location at {lat:.2f}, {lon:.2f}"
+
+@timed("reverse_geocode")
+async def _fetch_place_name(lat: float, lon: float) -> Optional[str]:
+    geocode_url = f"{GEOTIME_BASE_URL}/geocode/reverse?lat={lat}&lon={lon}"
     try:
-        response = requests.get(geocode_url)
+        response = await http_client.get(geocode_url)
         response.raise_for_status()
         data = response.json()
         
@@ -333,19 +587,22 @@ def reverse_geocode(lat: float, lon: float) -> str:
         if components:
             return ", ".join(components)
         else:
-            return f"Location at {lat:.2f}, {lon:.2f}"
+            return None
     except Exception as e:
-        print(f"Error in reverse geocoding: {e}")
-        return f"Location at {lat:.2f}, {lon:.2f}"  # Fallback to coordinates
+        logger.warning(f"Error in reverse geocoding: {e}")
+        return None
 
 @tool
-def get_weather_along_route(route: Dict[str, Any], departure_time: datetime) -> List[Dict[str, Any]]:
+async def get_weather_along_route(route: Dict[str, Any], departure_time: datetime,
+                                  sampling: Literal["fixed", "adaptive"] = "fixed") -> List[Dict[str, Any]]:
     """
     Fetches weather forecast data along a driving route, handling multi-segment routes.
     This function must be called after get_driving_route and route must be passed to it.
     Args:
         route: The route data from OpenRoute Service.
         departure_time: The intended departure time.
+        sampling: "fixed" samples 5 evenly spaced points plus the endpoints. "adaptive" samples
+            wherever the route enters a new forecast grid cell or 3-hour slot, within a call budget.
     Returns:
         A list of weather data dictionaries, with each dictionary containing
         the weather at a point along the route at the estimated arrival time.
@@ -354,130 +611,287 @@ def get_weather_along_route(route: Dict[str, Any], departure_time: datetime) ->
     weather_data = []
 
     try:
-        geometry = openrouteservice.convert.decode_polyline(route.get('geometry', ''))
-        segments = route.get('segments', [])
-
-        coordinates = geometry.get('coordinates', [])  # OpenRouteService returns [longitude, latitude]
-        if not coordinates or len(coordinates) < 2:  # Need at least start and end points
-            print("No coordinates found in geometry.")
-            return []
-
-        total_duration = sum(segment.get('duration', 0) for segment in segments)
-        if total_duration == 0:
-            print("No route duration found.")
-            return []
-
-        # Calculate total route distance (in meters)
-        total_distance = 0
-        distances = []
-        for i in range(1, len(coordinates)):
-            lon1, lat1 = coordinates[i-1]  # OpenRouteService coordinates are [longitude, latitude]
-            lon2, lat2 = coordinates[i]
-            # Use Haversine formula to calculate distance between points
-            R = 6371000  # Earth radius in meters
-            phi1 = math.radians(lat1)
-            phi2 = math.radians(lat2)
-            delta_phi = math.radians(lat2 - lat1)
-            delta_lambda = math.radians(lon2 - lon1)
-            
-            a = math.sin(delta_phi/2) * math.sin(delta_phi/2) + \
-                math.cos(phi1) * math.cos(phi2) * \
-                math.sin(delta_lambda/2) * math.sin(delta_lambda/2)
-            c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-            distance = R * c
-            
-            total_distance += distance
-            distances.append(total_distance)
-
-        # Sample 5 points at equal distance intervals (excluding start and end points)
-        num_points = 5
-        interval_distance = total_distance / (num_points + 1)
-        target_distances = [interval_distance * i for i in range(1, num_points + 1)]
-        
-        # For each target distance, find the closest actual point
-        sampled_points = []
-        for target in target_distances:
-            # Find the first point that exceeds the target distance
-            idx = next((i for i, d in enumerate(distances) if d >= target), len(distances) - 1)
-            if idx > 0:
-                # Interpolate between points if needed
-                d1, d2 = distances[idx-1], distances[idx]
-                if d2 - d1 > 0:  # Avoid division by zero
-                    ratio = (target - d1) / (d2 - d1)
-                    lon1, lat1 = coordinates[idx-1]  # OpenRouteService coordinates are [longitude, latitude]
-                    lon2, lat2 = coordinates[idx]
-                    lat = lat1 + ratio * (lat2 - lat1)
-                    lon = lon1 + ratio * (lon2 - lon1)
-                    sampled_points.append((lon, lat))  # Keep same order as OpenRouteService
-                else:
-                    sampled_points.append(coordinates[idx])
-            else:
-                sampled_points.append(coordinates[idx])
-
-        # Add endpoints to our sampling points
-        start_point = coordinates[0]
-        end_point = coordinates[-1]
-        all_points = [start_point] + sampled_points + [end_point]
-
-        # Calculate arrival times proportionally based on distance
-        for i, point in enumerate(all_points):
-            # For start point, use departure time
-            # For other points, calculate proportional time based on position
-            if i == 0:
-                point_time = departure_time
-            else:
-                # For end point, use total duration, otherwise calculate proportionally
-                if i == len(all_points) - 1:
-                    point_time = departure_time + timedelta(seconds=total_duration)
-                else:
-                    point_time = departure_time + timedelta(seconds=(total_duration * i/(len(all_points) - 1)))
-            
-            lon, lat = point  # Unpack as longitude, latitude
-            weather = get_weather_forecast.func(lat, lon, point_time)  # Weather API expects latitude first
-            if weather:
-                weather['location'] = {
-                    'latitude': lat,
-                    'longitude': lon,
-                    'name': reverse_geocode(lat, lon)
-                }
-                weather['time'] = point_time.isoformat()
-                weather_data.append(weather)
-            else:
-                print(f"Failed to get weather for location: lat={lat}, lon={lon} at {point_time}")
-
+        results = [result async for result in iter_weather_along_route(route, departure_time, sampling)]
+        weather_data = [weather for _, weather in sorted(results, key=lambda result: result[0])]
     except Exception as e:
-        print(f"Error while processing route: {e}")
+        logger.warning(f"Error while processing route: {e}")
 
     return weather_data
 
+def sample_route_points(route: Dict[str, Any], departure_time: datetime,
+                        sampling: Literal["fixed", "adaptive"] = "fixed") -> List[Tuple[float, float, datetime]]:
+    """
+    Chooses the points along a route to fetch weather for, as (latitude, longitude, arrival time).
+    See get_weather_along_route for the sampling modes. Returns an empty list if the route
+    has no usable geometry or duration.
+    """
+    timeline = route_timeline(route)
+    if len(timeline.geometry) < 2:  # Need at least start and end points
+        logger.warning("No coordinates found in geometry.")
+        return []
+
+    if timeline.total_duration == 0:
+        logger.warning("No route duration found.")
+        return []
+
+    if sampling == "adaptive":
+        target_distances = adaptive_sample_distances(
+            timeline, to_timestamp(departure_time),
+            max_points=int(os.getenv("WEATHER_SAMPLE_BUDGET", DEFAULT_SAMPLE_BUDGET)),
+        )
+    else:
+        # Sample 5 points at equal distance intervals between the start and end points
+        target_distances = fixed_sample_distances(timeline, num_points=5)
+    all_points = timeline.position_at_distance(target_distances).tolist()  # [longitude, latitude]
+
+    # Arrival times follow the per-step durations of the route
+    return [
+        (lat, lon, departure_time + timedelta(seconds=seconds))
+        for (lon, lat), seconds in zip(all_points, timeline.time_at_distance(target_distances).tolist())
+    ]
+
+async def iter_weather_along_route(route: Dict[str, Any], departure_time: datetime,
+                                   sampling: Literal["fixed", "adaptive"] = "fixed") -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Fetches the same weather data as get_weather_along_route, yielding (index, weather) for each
+    sampled point as soon as its forecast and place name are in. Indexes follow route order;
+    points whose forecast failed are skipped.
+    """
+    points = sample_route_points(route, departure_time, sampling)
+    # Place names are looked up as one batch alongside the concurrent forecasts
+    names = await reverse_geocode_lookups([(lat, lon) for lat, lon, _ in points])
+    tasks = [
+        asyncio.ensure_future(_weather_at_point(i, lat, lon, point_time, name))
+        for i, ((lat, lon, point_time), name) in enumerate(zip(points, names))
+    ]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            i, weather = await next_result
+            if weather:
+                yield i, weather
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def _weather_at_point(index: int, lat: float, lon: float, point_time: datetime,
+                            name: Awaitable[str]) -> Tuple[int, Optional[Dict[str, Any]]]:
+    weather = await get_weather_forecast.coroutine(lat, lon, point_time)  # Weather API expects latitude first
+    location_name = await name
+    if not weather:
+        logger.warning(f"Failed to get weather for location: lat={lat}, lon={lon} at {point_time}")
+        return index, None
+    weather['location'] = {
+        'latitude': lat,
+        'longitude': lon,
+        'name': location_name
+    }
+    weather['time'] = point_time.isoformat()
+    return index, weather
+
+async def retime_weather_along_route(weather_data: List[Dict[str, Any]], departure_time: datetime,
+                                     new_departure_time: datetime) -> List[Dict[str, Any]]:
+    """
+    Re-times weather samples from get_weather_along_route for a new departure time. The
+    sampled points and their place names are kept; each arrival time moves by the change in
+    departure time and the forecast slot for it is picked again from the point's forecast
+    series, which is normally in the shared forecast cache. Points whose forecast failed are dropped.
+    """
+    shift = new_departure_time - departure_time
+
+    async def retime(sample: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        location = sample['location']
+        point_time = datetime.fromisoformat(sample['time']) + shift
+        weather = await get_weather_forecast.coroutine(location['latitude'], location['longitude'], point_time)
+        if not weather:
+            return None
+        weather['location'] = dict(location)
+        weather['time'] = point_time.isoformat()
+        return weather
+
+    results = await asyncio.gather(*(retime(sample) for sample in weather_data))
+    return [weather for weather in results if weather]
+
 @tool
-def generate_itinerary_with_llm(origin: str, destination: str, departure_time_str: str) -> Dict[str, Any]:
+async def get_route_digest(origin: str, destination: str, departure_time_str: str, token_budget: Optional[int] = None) -> str:
     """
-    Generates a travel itinerary with weather considerations using a Large Language Model (LLM).
+    Gets a compact description of the driving route between two places: the total distance and
+    travel time, then one line per major road with its length, travel time, end point and arrival time.
 
     Args:
         origin: The origin address.
         destination: The destination address.
-        departure_time_str: The departure time as a string.
+        departure_time_str: The departure time as a string in %Y-%m-%dT%H:%M:%S format.
+        token_budget: Optional limit on the length of the description, in tokens.
 
     Returns:
-        A dictionary containing the itinerary and weather recommendations generated by the LLM (itinerary_response) along with route and weather data.
+        The route description, or an error message if no route was found.
     """
     try:
         departure_time = datetime.fromisoformat(departure_time_str)
     except ValueError:
         return "Invalid departure time format. Please use %Y-%m-%dT%H:%M:%S format."
 
-    route_info = get_driving_route.func([origin, destination], departure_time)
-    add_legs_to_route(route_info['route'], departure_time)
+    route_info = await get_driving_route.coroutine([origin, destination], departure_time)
+    if not route_info:
+        return "Could not retrieve route information."
+    return route_digest(route_info['route'], departure_time, token_budget)
+
+@tool
+async def plan_route(origin: str, destination: str, departure_time_str: str) -> Dict[str, Any]:
+    """
+    Finds the driving route between two places.
+
+    Args:
+        origin: The origin address.
+        destination: The destination address.
+        departure_time_str: The departure time as a string in %Y-%m-%dT%H:%M:%S format.
+
+    Returns:
+        A dictionary with a handle to the route ('route') to pass to get_weather_for_route and
+        get_best_departure_time, a 'route_summary' and the 'estimated_arrival_time'.
+    """
+    try:
+        departure_time = datetime.fromisoformat(departure_time_str)
+    except ValueError:
+        return "Invalid departure time format. Please use %Y-%m-%dT%H:%M:%S format."
+
+    route_info = await get_driving_route.coroutine([origin, destination], departure_time)
     if not route_info:
         return "Could not retrieve route information."
+    add_legs_to_route(route_info['route'], departure_time)
+    return {
+        "route": get_artifact_store().put(ROUTE, {"route_info": route_info, "departure_time": departure_time}),
+        "route_summary": route_info['route_summary'],
+        "estimated_arrival_time": route_info['estimated_arrival_time'],
+    }
 
+@tool
+async def get_weather_for_route(route: str) -> Dict[str, Any]:
+    """
+    Gets the weather along a route at the times the car is expected to pass.
 
-    weather_data = get_weather_along_route.func(route_info['route'], departure_time)
-    optimal_departure_time = suggest_departure_time.func(route_info['route'], weather_data, departure_time)
+    Args:
+        route: A route handle from plan_route.
+
+    Returns:
+        A dictionary with a handle to the weather data ('weather') to pass to get_weather_hazards
+        and get_best_departure_time, and a readable 'weather_summary'.
+    """
+    store = get_artifact_store()
+    route_artifact = store.get(route, ROUTE)
+    if route_artifact is None:
+        return f"Unknown or expired route handle {route}. Call plan_route again."
+
+    departure_time = route_artifact["departure_time"]
+    with forecast_memo():
+        weather_data = await get_weather_along_route.coroutine(route_artifact["route_info"]['route'], departure_time, sampling="adaptive")
+    return {
+        "weather": store.put(WEATHER, {"weather_data": weather_data, "departure_time": departure_time}),
+        "weather_summary": summarize_weather(weather_data),
+    }
+
+@tool
+def get_weather_hazards(weather: str) -> List[str]:
+    """
+    Lists the driving hazards in the weather along a route.
+
+    Args:
+        weather: A weather handle from get_weather_for_route.
+
+    Returns:
+        A list of strings describing any hazardous conditions.
+    """
+    weather_artifact = get_artifact_store().get(weather, WEATHER)
+    if weather_artifact is None:
+        return [f"Unknown or expired weather handle {weather}. Call get_weather_for_route again."]
+    return analyze_weather_conditions.func(weather_artifact["weather_data"])
+
+@tool
+async def get_best_departure_time(route: str, weather: str) -> str:
+    """
+    Suggests the departure time, within the forecast period, with the least bad weather along a route.
 
-    # Format the weather data into a string that the LLM can understand
+    Args:
+        route: A route handle from plan_route.
+        weather: A weather handle from get_weather_for_route for the same route.
+
+    Returns:
+        The suggested departure time in %Y-%m-%d %H:%M:%S format.
+    """
+    store = get_artifact_store()
+    route_artifact = store.get(route, ROUTE)
+    weather_artifact = store.get(weather, WEATHER)
+    if route_artifact is None or weather_artifact is None:
+        return "Unknown or expired handle. Call plan_route and get_weather_for_route again."
+
+    optimal_departure_time = await suggest_departure_time.coroutine(
+        route_artifact["route_info"]['route'], weather_artifact["weather_data"], route_artifact["departure_time"])
+    return optimal_departure_time.strftime('%Y-%m-%d %H:%M:%S')
+
+# Use LLM to generate a more natural-language itinerary
+ITINERARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are a helpful travel assistant that provides detailed and friendly travel itineraries, including weather information and recommendations for optimal departure times."),
+    ("user", "I am planning a trip from {origin} to {destination}, departing at {departure_time}. Please provide a detailed itinerary, including information about the weather conditions along the route and the best time to depart to avoid bad weather. Consider route_info: {route_info}, weather_conditions: {weather_conditions}, and optimal_departure_time: {optimal_departure_time}."),
+])
+
+def _llm_cache_key(key: Tuple) -> str:
+    # Sets are written sorted so equal keys always serialize the same way
+    return hashlib.sha256(json.dumps(key, default=sorted).encode()).hexdigest()
+
+async def get_cached_llm_response(key: Tuple) -> Optional[str]:
+    """Returns the cached LLM response for a key from itinerary_cache_key or passthrough_cache_key."""
+    response = await _llm_cache.get(_llm_cache_key(key))
+    record_cache_lookup("llm", response is not None)
+    return response
+
+async def cache_llm_response(key: Tuple, response: str):
+    """Caches an LLM response until the cache TTL or the next forecast slot boundary, whichever is first."""
+    ttl = min(_llm_cache.ttl_seconds, seconds_until_next_forecast_slot())
+    await _llm_cache.set(_llm_cache_key(key), response, ttl_seconds=ttl)
+
+async def ainvoke_cached(chain, inputs: Dict[str, Any], key: Tuple) -> str:
+    """Runs chain on inputs unless a response for key is cached."""
+    response = await get_cached_llm_response(key)
+    if response is None:
+        # Identical prompts in flight at the same time share one LLM call
+        response = await _outbound.do(("llm", key), timed("llm")(lambda: chain.ainvoke(inputs)))
+        await cache_llm_response(key, response)
+    return response
+
+def itinerary_cache_key(inputs: Dict[str, Any], route: Dict[str, Any], weather_data: List[Dict[str, Any]]) -> Tuple:
+    """
+    LLM cache key for an itinerary prompt: the normalized trip inputs plus fingerprints of
+    the route and the set of weather hazards along it. Forecast values that don't change
+    the hazards, e.g. a degree of temperature, don't change the key.
+    """
+    summary = route.get('summary', {})
+    route_fingerprint = hashlib.sha1(route.get('geometry', '').encode()).hexdigest()
+    return (
+        "itinerary",
+        normalize_address(inputs["origin"]),
+        normalize_address(inputs["destination"]),
+        inputs["departure_time"],
+        inputs["optimal_departure_time"],
+        route_fingerprint,
+        round(summary.get('distance', 0)),
+        round(summary.get('duration', 0)),
+        frozenset((hazard.type, hazard.dt) for hazard in hazards_in(weather_data)),
+    )
+
+def passthrough_cache_key(inputs: Dict[str, str]) -> Tuple:
+    """LLM cache key for a passthrough prompt: its normalized inputs."""
+    return (
+        "passthrough",
+        normalize_address(inputs["origin"]),
+        normalize_address(inputs["destination"]),
+        inputs["departure_time"],
+    )
+
+def itinerary_chain():
+    return ITINERARY_PROMPT | ChatOpenAI() | StrOutputParser()
+
+# Format the weather data into a string that the LLM can understand
+def summarize_weather(weather_data: List[Dict[str, Any]]) -> str:
     weather_summary = ""
     if weather_data:
         weather_summary = "Here is the weather forecast for your trip:\n"
@@ -492,14 +906,40 @@ def generate_itinerary_with_llm(origin: str, destination: str, departure_time_st
             )
     else:
         weather_summary = "There is no weather data available for this route."
+    return weather_summary
 
-    # Use LLM to generate a more natural-language itinerary
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a helpful travel assistant that provides detailed and friendly travel itineraries, including weather information and recommendations for optimal departure times."),
-        ("user", "I am planning a trip from {origin} to {destination}, departing at {departure_time}. Please provide a detailed itinerary, including information about the weather conditions along the route and the best time to depart to avoid bad weather. Consider route_info: {route_info}, weather_conditions: {weather_conditions}, and optimal_departure_time: {optimal_departure_time}."),
-    ])
+async def prepare_itinerary(origin: str, destination: str, departure_time: datetime,
+                            route_info: Optional[Dict[str, Any]] = None,
+                            weather_data: Optional[List[Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Gathers everything generate_itinerary_with_llm needs before calling the LLM.
 
-    chain = prompt | ChatOpenAI() | StrOutputParser()
+    Args:
+        origin: The origin address.
+        destination: The destination address.
+        departure_time: The departure time.
+        route_info: A route already planned for this departure, as returned by get_driving_route
+            with its legs added; fetched if not given.
+        weather_data: The weather along route_info at this departure, as returned by
+            get_weather_along_route; fetched if not given.
+
+    Returns:
+        A dictionary with the LLM prompt inputs ('inputs') and their LLM cache key ('cache_key')
+        plus 'route_info', 'weather_data', 'weather_summary' and 'optimal_departure_time',
+        or None if no route was found.
+    """
+    if route_info is None:
+        route_info = await get_driving_route.coroutine([origin, destination], departure_time)
+        if not route_info:
+            return None
+        add_legs_to_route(route_info['route'], departure_time)
+
+    with forecast_memo():
+        if weather_data is None:
+            weather_data = await get_weather_along_route.coroutine(route_info['route'], departure_time, sampling="adaptive")
+        optimal_departure_time = await suggest_departure_time.coroutine(route_info['route'], weather_data, departure_time)
+
+    weather_summary = summarize_weather(weather_data)
 
     # Create the input for the LLM.
     inputs = {
@@ -507,55 +947,94 @@ def generate_itinerary_with_llm(origin: str, destination: str, departure_time_st
         "destination": destination,
         "departure_time": departure_time.strftime('%Y-%m-%d %H:%M:%S'),
         # "route_summary": json.dumps({ "legs": route_info['route']['legs'], "summary": route_info['route_summary'] }),
-        "route_info": { "legs": route_info['route']['legs'], "summary": route_info['route_summary'] },
+        # The digest stands in for the turn-by-turn legs, which make prompts for long trips huge
+        "route_info": { "digest": route_digest(route_info['route'], departure_time), "summary": route_info['route_summary'] },
         # "route_info": route_info,
         "weather_conditions": weather_summary,
         "optimal_departure_time": optimal_departure_time.strftime('%Y-%m-%d %H:%M:%S'),
     }
-
-    # Generate the itinerary using the LLM
-    itinerary_response = chain.invoke(inputs)
-
     return {
-        "itinerary_response": itinerary_response, 
-        "route_info": json.dumps(route_info),
-        "weather_data": json.dumps(weather_data),
+        "inputs": inputs,
+        "cache_key": itinerary_cache_key(inputs, route_info['route'], weather_data),
+        "route_info": route_info,
+        "weather_data": weather_data,
         "weather_summary": weather_summary,
-        "optimal_departure_time": optimal_departure_time.strftime('%Y-%m-%d %H:%M:%S'),
+        "optimal_departure_time": optimal_departure_time,
     }
 
 @tool
-def passthrough_llm_function(origin: str, destination: str, departure_time: str) -> str:
+async def generate_itinerary_with_llm(origin: str, destination: str, departure_time_str: str) -> Dict[str, Any]:
     """
-    A passthrough function for the LLM. This is a placeholder and can be replaced with actual LLM calls.
+    Generates a travel itinerary with weather considerations using a Large Language Model (LLM).
+
+    Args:
+        origin: The origin address.
+        destination: The destination address.
+        departure_time_str: The departure time as a string.
+
+    Returns:
+        A dictionary containing the itinerary and weather recommendations generated by the LLM (itinerary_response),
+        the weather summary and optimal departure time, and handles to the route ('route') and weather data ('weather').
     """
-    # Use LLM to generate a more natural-language itinerary
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a helpful travel assistant that provides detailed and friendly travel itineraries, including weather information and recommendations for optimal departure times"),
-        ("user", """I am planning a trip from {origin} to {destination}, departing at {departure_time}. Please provide a detailed itinerary. When creating this itinerary take the following into account:
-         - Choose optimal routes based on weather. Prefer routes that avoid inclement weather or adjust the driving schedule to minimize impact. Your life will be in danger if I drive in bad weather.
-         - No day should ever have more than 9h of driving time or else your life will be in danger due to fatigue.
-         - You are driving a car with an internal combustion engine that has a range of about 450km before requiring gas. Ideally you should fill up every 400km. I will only stop for gas if you tell me to, and if I run out of gas your life will be in peril. Give specific locations or store names to get gas.
-         - Driving time should be ideally 8h or less per day.
-         - There should be a break around 4 hours of driving, and never more than 5 hours of consecutive driving without a break. Breaks occurring between 11am and 2pm should be at least 1 hour long and include a specific restaurant in the area.
-         - Choose optimal driving times and times for breaks around historic traffic data, with no day starting before 6am and finished by 8pm
-         - If the trip is a multi day trip, the final stop of the day should be in a city or near a notable attraction.
-         - Suggest budget friendly accommodations at the final rest point of the day. Give specific examples of hotels or motels.
-         - Include the forecasted weather at each end point.
-         - Include the forecasted weather at each break point and gas station visit.
-        """),
-    ])
-    chain = prompt | ChatOpenAI() | StrOutputParser()
+    try:
+        departure_time = datetime.fromisoformat(departure_time_str)
+    except ValueError:
+        return "Invalid departure time format. Please use %Y-%m-%dT%H:%M:%S format."
+
+    itinerary = await prepare_itinerary(origin, destination, departure_time)
+    if not itinerary:
+        return "Could not retrieve route information."
+
+    # Generate the itinerary using the LLM
+    itinerary_response = await ainvoke_cached(itinerary_chain(), itinerary["inputs"], itinerary["cache_key"])
 
+    # Route and weather go into the artifact store, so only their handles pass through the agent's context
+    store = get_artifact_store()
+    route_handle = store.put(ROUTE, {"route_info": itinerary["route_info"], "departure_time": departure_time})
+    weather_handle = store.put(WEATHER, {"weather_data": itinerary["weather_data"], "departure_time": departure_time})
+    return {
+        "itinerary_response": itinerary_response, 
+        "route": route_handle,
+        "weather": weather_handle,
+        "weather_summary": itinerary["weather_summary"],
+        "optimal_departure_time": itinerary["optimal_departure_time"].strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+PASSTHROUGH_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are a helpful travel assistant that provides detailed and friendly travel itineraries, including weather information and recommendations for optimal departure times"),
+    ("user", """I am planning a trip from {origin} to {destination}, departing at {departure_time}. Please provide a detailed itinerary. When creating this itinerary take the following into account:
+     - Choose optimal routes based on weather. Prefer routes that avoid inclement weather or adjust the driving schedule to minimize impact. Your life will be in danger if I drive in bad weather.
+     - No day should ever have more than 9h of driving time or else your life will be in danger due to fatigue.
+     - You are driving a car with an internal combustion engine that has a range of about 450km before requiring gas. Ideally you should fill up every 400km. I will only stop for gas if you tell me to, and if I run out of gas your life will be in peril. Give specific locations or store names to get gas.
+     - Driving time should be ideally 8h or less per day.
+     - There should be a break around 4 hours of driving, and never more than 5 hours of consecutive driving without a break. Breaks occurring between 11am and 2pm should be at least 1 hour long and include a specific restaurant in the area.
+     - Choose optimal driving times and times for breaks around historic traffic data, with no day starting before 6am and finished by 8pm
+     - If the trip is a multi day trip, the final stop of the day should be in a city or near a notable attraction.
+     - Suggest budget friendly accommodations at the final rest point of the day. Give specific examples of hotels or motels.
+     - Include the forecasted weather at each end point.
+     - Include the forecasted weather at each break point and gas station visit.
+    """),
+])
+
+def passthrough_chain():
+    return PASSTHROUGH_PROMPT | ChatOpenAI() | StrOutputParser()
+
+def passthrough_inputs(origin: str, destination: str, departure_time: datetime) -> Dict[str, str]:
     # Create the input for the LLM.
-    inputs = {
+    return {
         "origin": origin,
         "destination": destination,
         "departure_time": departure_time.strftime('%Y-%m-%d %H:%M:%S'),
     }
 
+@tool
+async def passthrough_llm_function(origin: str, destination: str, departure_time: str) -> str:
+    """
+    A passthrough function for the LLM. This is a placeholder and can be replaced with actual LLM calls.
+    """
     # Generate the itinerary using the LLM
-    itinerary_response = chain.invoke(inputs)
+    inputs = passthrough_inputs(origin, destination, departure_time)
+    itinerary_response = await ainvoke_cached(passthrough_chain(), inputs, passthrough_cache_key(inputs))
     return itinerary_response
 
 # Available tools for the agent to use
@@ -563,16 +1042,22 @@ tools = [
     get_weather_forecast,
     get_weather_forecast_for_next_5_days,
     generate_itinerary_with_llm,
+    get_route_digest,
 
-    # get_driving_route, # it's common to encounter token limit issue with this function within the agent since the output is too long.
+    # get_driving_route, # it's common to encounter token limit issue with this function within the agent since the output is too long. get_route_digest gives the agent the route in a fixed token budget instead.
 
     #passthrough_llm_function
 
     # Note: It seems the agent is having hard time figuring out how to use and pass the complex data structures as input arguments to following functions.
-    # These functions are not usable in the agent yet.
+    # These functions are not usable in the agent directly.
     # get_weather_along_route,
     # analyze_weather_conditions,
     # suggest_departure_time,
+    # The handle-based versions below keep routes and weather data in the artifact store instead.
+    plan_route,
+    get_weather_for_route,
+    get_weather_hazards,
+    get_best_departure_time,
 ]
 
 # Initialize LLM for LangChain
@@ -593,12 +1078,17 @@ if __name__ == "__main__":
 
     # Use the agent
     config = {"configurable": {"thread_id": "abc123"}}
-    for step in agent_executor.stream(
-        {"messages": [HumanMessage(content=prompt)]},
-        config,
-        stream_mode="values",
-    ):
-        step["messages"][-1].pretty_print()
+
+    async def run_agent():
+        async for step in agent_executor.astream(
+            {"messages": [HumanMessage(content=prompt)]},
+            config,
+            stream_mode="values",
+        ):
+            step["messages"][-1].pretty_print()
+        await http_client.aclose()
+
+    asyncio.run(run_agent())
 
     # # Testing the functions directly
     # route_info = get_driving_route.func([origin, 'Fort Wayne, Indiana, USA', destination], datetime.fromisoformat(departure_time_str))
@@ -0,0 +1,59 @@
+"""
+In-process store for the large structures agent tools produce.
+
+Routes and weather samples are far too big to pass through the LLM context. Tools put
+them here and hand the agent a short handle such as "route-5f2c9a1e"; tools that take a
+route or weather samples accept the handle and look the structure up again.
+
+Trip plans get handles of the same form, "plan-<id>", but are kept in the shared cache
+backend so a plan can be re-timed by any worker; see store_plan in main.py.
+"""
+import os
+import uuid
+from typing import Any, Optional
+
+from .cache import LRUCache
+
+ROUTE = "route"
+WEATHER = "weather"
+PLAN = "plan"
+
+
+class ArtifactStore:
+    """
+    Size-bounded, expiring mapping from handles to artifacts.
+
+    Args:
+        maxsize: Maximum number of artifacts kept; the least recently used are dropped first.
+        ttl_seconds: How long an artifact stays available after it is stored.
+    """
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self._artifacts: LRUCache[Any] = LRUCache(maxsize=maxsize, ttl_seconds=ttl_seconds)
+
+    def put(self, kind: str, value: Any) -> str:
+        """Stores value and returns its handle, "<kind>-<id>"."""
+        handle = f"{kind}-{uuid.uuid4().hex[:8]}"
+        self._artifacts.set(handle, value)
+        return handle
+
+    def get(self, handle: str, kind: Optional[str] = None) -> Optional[Any]:
+        """Returns the artifact for handle, or None if it is unknown, expired or not of the given kind."""
+        if kind is not None and not handle.startswith(f"{kind}-"):
+            return None
+        return self._artifacts.get(handle)
+
+
+_artifact_store: Optional[ArtifactStore] = None
+
+
+def get_artifact_store() -> ArtifactStore:
+    """The process-wide artifact store, created on first use with settings from the environment."""
+    global _artifact_store
+    if _artifact_store is None:
+        _artifact_store = ArtifactStore(
+            maxsize=int(os.getenv("ARTIFACT_STORE_SIZE", "512")),
+            ttl_seconds=float(os.getenv("ARTIFACT_STORE_TTL_SECONDS", "3600")),
+        )
+    return _artifact_store
+
@@ -0,0 +1,482 @@
+"""
+Key-value cache shared by every worker process.
+
+Entries live in namespaces ("geocode", "directions", "forecast", "llm") so each kind of
+result has its own keys, lifetime and, optionally, a cap on its number of entries beyond which
+the least recently used are evicted. The backend is chosen with CACHE_BACKEND:
+
+    sqlite   one database file in TRAVEL_AGENT_CACHE_DIR, shared by all workers on the node (default)
+    redis    a Redis-compatible server at CACHE_REDIS_URL, shared across nodes; needs the redis package
+    memory   an LRU private to the process, for single-worker runs and tests
+
+Besides values, namespaces can hold scores to increment and rank, and add() stores a value
+only if its key is free, which serves as a lease held by one worker at a time.
+
+Backend calls are coroutines and never block the event loop on the network or on a commit.
+Cache failures never fail a request: a backend that can't be read counts as a miss.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL_SECONDS = 0.05
+# Reads of an entry record its access time for eviction at most this often
+ACCESS_RESOLUTION_SECONDS = 60.0
+
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+    """Opens a SQLite database for use by several threads and processes at once."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Wait rather than fail when another worker holds the write lock
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class CacheBackend:
+    """Interface of the cache backends. Values are strings, typically JSON."""
+
+    async def get(self, namespace: str, key: str) -> Optional[str]:
+        """Returns the value stored under key, or None if missing or expired."""
+        raise NotImplementedError
+
+    async def set(self, namespace: str, key: str, value: str, ttl_seconds: float,
+                  max_entries: Optional[int] = None) -> None:
+        """
+        Stores value under key for ttl_seconds. When max_entries is given, the namespace's
+        least recently used entries beyond it are evicted.
+        """
+        raise NotImplementedError
+
+    async def add(self, namespace: str, key: str, value: str, ttl_seconds: float) -> bool:
+        """
+        Stores value under key for ttl_seconds unless the key holds a value that hasn't
+        expired, atomically across workers. Returns whether value was stored.
+        """
+        raise NotImplementedError
+
+    async def increment(self, namespace: str, key: str, amount: float, ttl_seconds: float,
+                        max_entries: Optional[int] = None) -> None:
+        """
+        Adds amount to the score of key, which expires ttl_seconds after its last increment.
+        When max_entries is given, the namespace's lowest scores beyond it are dropped.
+        """
+        raise NotImplementedError
+
+    async def top(self, namespace: str, count: int) -> List[Tuple[str, float]]:
+        """The count highest scores in namespace as (key, score), highest first."""
+        raise NotImplementedError
+
+    def purge_expired(self) -> int:
+        """Deletes expired entries, where the backend doesn't do so itself, and returns how many."""
+        return 0
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """
+    Per-process LRU per namespace; workers don't share it.
+
+    Args:
+        maxsize: Entries kept per namespace that has no max_entries of its own.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._namespaces: Dict[str, LRUCache[str]] = {}
+        # namespace -> key -> (score, expires_at)
+        self._scores: Dict[str, Dict[str, Tuple[float, float]]] = {}
+
+    async def get(self, namespace: str, key: str) -> Optional[str]:
+        entries = self._namespaces.get(namespace)
+        return entries.get(key) if entries is not None else None
+
+    async def set(self, namespace: str, key: str, value: str, ttl_seconds: float,
+                  max_entries: Optional[int] = None) -> None:
+        entries = self._namespaces.get(namespace)
+        if entries is None:
+            entries = self._namespaces[namespace] = LRUCache(maxsize=max_entries or self.maxsize)
+        entries.set(key, value, ttl_seconds=ttl_seconds)
+
+    async def add(self, namespace: str, key: str, value: str, ttl_seconds: float) -> bool:
+        if await self.get(namespace, key) is not None:
+            return False
+        await self.set(namespace, key, value, ttl_seconds)
+        return True
+
+    async def increment(self, namespace: str, key: str, amount: float, ttl_seconds: float,
+                        max_entries: Optional[int] = None) -> None:
+        now = time.time()
+        scores = self._scores.setdefault(namespace, {})
+        score, expires_at = scores.get(key, (0.0, now))
+        scores[key] = ((score if expires_at > now else 0.0) + amount, now + ttl_seconds)
+        if len(scores) > (max_entries or self.maxsize):
+            del scores[min(scores, key=lambda k: scores[k][0])]
+
+    async def top(self, namespace: str, count: int) -> List[Tuple[str, float]]:
+        now = time.time()
+        scores = [(key, score) for key, (score, expires_at) in self._scores.get(namespace, {}).items() if expires_at > now]
+        return sorted(scores, key=lambda item: item[1], reverse=True)[:count]
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    One SQLite table shared by the workers on a node. WAL mode lets them read concurrently
+    while one writes.
+
+    Reads are primary key lookups on a connection of their own, which in WAL mode never
+    waits for a writer. Writes are buffered and committed in batches by a background thread,
+    so requests don't wait on the write lock or a commit; reads see this process's
+    buffered writes. Reads record when an entry was last used, in the same batches, and
+    namespaces with max_entries are trimmed to their most recently used entries after
+    each batch. Increments are summed into the same batches too; add() alone commits
+    right away, off the event loop, since its result depends on the other workers.
+
+    Args:
+        path: Database file; its directory is created if missing.
+        flush_interval_seconds: How long writes are collected into a batch before committing.
+    """
+
+    def __init__(self, path: str, flush_interval_seconds: float = DEFAULT_FLUSH_INTERVAL_SECONDS):
+        self.path = path
+        self.flush_interval_seconds = flush_interval_seconds
+        self._writer = connect_sqlite(path)
+        self._writer.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        if "accessed_at" not in {row[1] for row in self._writer.execute("PRAGMA table_info(cache)")}:
+            # Created before entries had access times
+            try:
+                self._writer.execute("ALTER TABLE cache ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0")
+            except sqlite3.OperationalError:
+                pass  # Another worker added it first
+        self._writer.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (namespace, accessed_at)")
+        self._writer.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " score REAL NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        self._writer.execute("CREATE INDEX IF NOT EXISTS scores_rank ON scores (namespace, score)")
+        self._writer.commit()
+        self._write_lock = threading.Lock()
+        self._reader = connect_sqlite(path)
+        self._read_lock = threading.Lock()
+        # Writes not yet committed, by (namespace, key): (value, expires_at, written_at)
+        self._pending: Dict[Tuple[str, str], Tuple[str, float, float]] = {}
+        self._flushing: Dict[Tuple[str, str], Tuple[str, float, float]] = {}
+        # Access times not yet committed, by (namespace, key)
+        self._touched: Dict[Tuple[str, str], float] = {}
+        # Increments not yet committed, by (namespace, key): [amount, expires_at]
+        self._increments: Dict[Tuple[str, str], List[float]] = {}
+        self._max_entries: Dict[str, int] = {}
+        self._closing = False
+        self._changed = threading.Condition()
+        self._flusher = threading.Thread(target=self._flush_loop, name="sqlite-cache-writer", daemon=True)
+        self._flusher.start()
+
+    async def get(self, namespace: str, key: str) -> Optional[str]:
+        with self._changed:
+            item = self._pending.get((namespace, key)) or self._flushing.get((namespace, key))
+        if item is not None:
+            value, expires_at, _ = item
+            return value if expires_at > time.time() else None
+        now = time.time()
+        try:
+            with self._read_lock:
+                row = self._reader.execute(
+                    "SELECT value, accessed_at FROM cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+                    (namespace, key, now),
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Error reading {namespace} cache: {e}")
+            return None
+        if row is None:
+            return None
+        if now - row[1] > ACCESS_RESOLUTION_SECONDS:
+            with self._changed:
+                self._notify_if_idle()
+                self._touched[(namespace, key)] = now
+        return row[0]
+
+    def _has_writes(self) -> bool:
+        return bool(self._pending or self._touched or self._increments)
+
+    def _notify_if_idle(self):
+        # Wakes the writer thread for the first write of a batch; call holding self._changed
+        if not self._has_writes():
+            self._changed.notify()
+
+    async def set(self, namespace: str, key: str, value: str, ttl_seconds: float,
+                  max_entries: Optional[int] = None) -> None:
+        with self._changed:
+            if max_entries is not None:
+                self._max_entries[namespace] = max_entries
+            self._notify_if_idle()
+            now = time.time()
+            self._pending[(namespace, key)] = (value, now + ttl_seconds, now)
+
+    async def add(self, namespace: str, key: str, value: str, ttl_seconds: float) -> bool:
+        return await asyncio.to_thread(self._add, namespace, key, value, ttl_seconds)
+
+    def _add(self, namespace: str, key: str, value: str, ttl_seconds: float) -> bool:
+        now = time.time()
+        try:
+            with self._write_lock, self._writer:
+                cursor = self._writer.execute(
+                    "INSERT INTO cache (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT (namespace, key) DO UPDATE SET"
+                    " value = excluded.value, expires_at = excluded.expires_at, accessed_at = excluded.accessed_at"
+                    " WHERE cache.expires_at <= ?",
+                    (namespace, key, value, now + ttl_seconds, now, now),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Error writing {namespace} cache: {e}")
+            return False
+        return cursor.rowcount > 0
+
+    async def increment(self, namespace: str, key: str, amount: float, ttl_seconds: float,
+                        max_entries: Optional[int] = None) -> None:
+        with self._changed:
+            if max_entries is not None:
+                self._max_entries[namespace] = max_entries
+            self._notify_if_idle()
+            increment = self._increments.setdefault((namespace, key), [0.0, 0.0])
+            increment[0] += amount
+            increment[1] = time.time() + ttl_seconds
+
+    async def top(self, namespace: str, count: int) -> List[Tuple[str, float]]:
+        try:
+            with self._read_lock:
+                return self._reader.execute(
+                    "SELECT key, score FROM scores WHERE namespace = ? AND expires_at > ? ORDER BY score DESC LIMIT ?",
+                    (namespace, time.time(), count),
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Error reading {namespace} scores: {e}")
+            return []
+
+    def _flush_loop(self):
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._has_writes() or self._closing)
+                if not self._closing:
+                    # Let more writes join the batch
+                    self._changed.wait(self.flush_interval_seconds)
+                self._flushing, self._pending = self._pending, {}
+                touched, self._touched = self._touched, {}
+                increments, self._increments = self._increments, {}
+                max_entries = dict(self._max_entries)
+                closing = self._closing
+            self._write(self._flushing, touched, increments, max_entries)
+            with self._changed:
+                self._flushing = {}
+                if closing and not self._has_writes():
+                    return
+
+    def _write(self, batch: Dict[Tuple[str, str], Tuple[str, float, float]], touched: Dict[Tuple[str, str], float],
+               increments: Dict[Tuple[str, str], List[float]], max_entries: Dict[str, int]):
+        now = time.time()
+        try:
+            with self._write_lock, self._writer:
+                self._writer.executemany(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    [(namespace, key, *entry) for (namespace, key), entry in batch.items()],
+                )
+                self._writer.executemany(
+                    "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                    [(accessed_at, namespace, key) for (namespace, key), accessed_at in touched.items()],
+                )
+                # Keep the most recently used entries of the namespaces written to
+                for namespace in {namespace for namespace, _ in batch} & max_entries.keys():
+                    self._writer.execute(
+                        "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                        " SELECT key FROM cache WHERE namespace = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                        (namespace, namespace, max_entries[namespace]),
+                    )
+                self._writer.executemany(
+                    "INSERT INTO scores (namespace, key, score, expires_at) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT (namespace, key) DO UPDATE SET"
+                    " score = CASE WHEN scores.expires_at > ? THEN scores.score ELSE 0 END + excluded.score,"
+                    " expires_at = excluded.expires_at",
+                    [(namespace, key, amount, expires_at, now) for (namespace, key), (amount, expires_at) in increments.items()],
+                )
+                # Keep the highest scores of the namespaces incremented
+                for namespace in {namespace for namespace, _ in increments} & max_entries.keys():
+                    self._writer.execute(
+                        "DELETE FROM scores WHERE namespace = ? AND key IN ("
+                        " SELECT key FROM scores WHERE namespace = ? ORDER BY score DESC LIMIT -1 OFFSET ?)",
+                        (namespace, namespace, max_entries[namespace]),
+                    )
+        except sqlite3.Error as e:
+            logger.warning(f"Error writing {len(batch) + len(touched) + len(increments)} cache entries: {e}")
+
+    def purge_expired(self) -> int:
+        try:
+            with self._write_lock, self._writer:
+                now = time.time()
+                removed = self._writer.execute("DELETE FROM cache WHERE expires_at <= ?", (now,)).rowcount
+                removed += self._writer.execute("DELETE FROM scores WHERE expires_at <= ?", (now,)).rowcount
+        except sqlite3.Error as e:
+            logger.warning(f"Error purging cache: {e}")
+            return 0
+        return removed
+
+    async def close(self) -> None:
+        # Commit what is still buffered before closing
+        with self._changed:
+            self._closing = True
+            self._changed.notify()
+        await asyncio.to_thread(self._flusher.join)
+        self._writer.close()
+        with self._read_lock:
+            self._reader.close()
+
+
+class RedisBackend(CacheBackend):
+    """
+    Any server speaking the Redis protocol (Redis, Valkey, KeyDB, ...), through the asyncio
+    client. Keys are "<prefix>:<namespace>:<key>" and expire on the server. max_entries isn't
+    enforced per namespace; bound the server's memory with maxmemory and an LRU
+    maxmemory-policy (e.g. allkeys-lru) instead.
+
+    Args:
+        url: Server URL, e.g. "redis://localhost:6379/0".
+        prefix: Prepended to every key, so several deployments can share a server.
+    """
+
+    def __init__(self, url: str, prefix: str = "travel-agent"):
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package (pip install redis)") from e
+        self._errors = redis.RedisError
+        self._client = redis.asyncio.Redis.from_url(url, decode_responses=True, socket_timeout=1.0)
+        self.prefix = prefix
+
+    async def get(self, namespace: str, key: str) -> Optional[str]:
+        try:
+            return await self._client.get(f"{self.prefix}:{namespace}:{key}")
+        except self._errors as e:
+            logger.warning(f"Error reading {namespace} cache: {e}")
+            return None
+
+    async def set(self, namespace: str, key: str, value: str, ttl_seconds: float,
+                  max_entries: Optional[int] = None) -> None:
+        try:
+            await self._client.set(f"{self.prefix}:{namespace}:{key}", value, px=max(int(ttl_seconds * 1000), 1))
+        except self._errors as e:
+            logger.warning(f"Error writing {namespace} cache: {e}")
+
+    async def add(self, namespace: str, key: str, value: str, ttl_seconds: float) -> bool:
+        try:
+            return bool(await self._client.set(f"{self.prefix}:{namespace}:{key}", value, nx=True,
+                                               px=max(int(ttl_seconds * 1000), 1)))
+        except self._errors as e:
+            logger.warning(f"Error writing {namespace} cache: {e}")
+            return False
+
+    async def increment(self, namespace: str, key: str, amount: float, ttl_seconds: float,
+                        max_entries: Optional[int] = None) -> None:
+        # A namespace's scores are one sorted set, which expires as a whole
+        name = f"{self.prefix}:{namespace}"
+        try:
+            async with self._client.pipeline(transaction=True) as pipe:
+                pipe.zincrby(name, amount, key)
+                pipe.pexpire(name, max(int(ttl_seconds * 1000), 1))
+                if max_entries is not None:
+                    pipe.zremrangebyrank(name, 0, -max_entries - 1)
+                await pipe.execute()
+        except self._errors as e:
+            logger.warning(f"Error writing {namespace} scores: {e}")
+
+    async def top(self, namespace: str, count: int) -> List[Tuple[str, float]]:
+        try:
+            return await self._client.zrevrange(f"{self.prefix}:{namespace}", 0, count - 1, withscores=True)
+        except self._errors as e:
+            logger.warning(f"Error reading {namespace} scores: {e}")
+            return []
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+_cache_backend: Optional[CacheBackend] = None
+
+
+def get_cache_backend() -> CacheBackend:
+    """The process-wide cache backend, opened on first use with settings from the environment."""
+    global _cache_backend
+    if _cache_backend is None:
+        kind = os.getenv("CACHE_BACKEND", "sqlite").lower()
+        if kind == "redis":
+            _cache_backend = RedisBackend(
+                os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0"),
+                os.getenv("CACHE_REDIS_PREFIX", "travel-agent"),
+            )
+        elif kind == "memory":
+            _cache_backend = MemoryBackend(int(os.getenv("CACHE_MEMORY_SIZE", "4096")))
+        elif kind == "sqlite":
+            cache_dir = os.getenv("TRAVEL_AGENT_CACHE_DIR", ".cache")
+            _cache_backend = SQLiteBackend(os.getenv("CACHE_SQLITE_PATH", os.path.join(cache_dir, "cache.sqlite")))
+        else:
+            raise ValueError(f"Unknown CACHE_BACKEND {kind!r}; expected sqlite, redis or memory")
+    return _cache_backend
+
+
+async def close_cache_backend() -> None:
+    """Closes the process-wide cache backend, committing buffered writes. It is reopened on next use."""
+    global _cache_backend
+    if _cache_backend is not None:
+        backend, _cache_backend = _cache_backend, None
+        await backend.close()
+
+
+class SharedCache:
+    """
+    One namespace of the shared cache, with a default lifetime for its entries. The backend
+    is looked up on each call, so these can be created at import time.
+
+    Args:
+        namespace: e.g. "directions".
+        ttl_seconds: Default lifetime of an entry.
+        max_entries: Most entries kept, evicting the least recently used; None for no limit
+            besides expiry.
+    """
+
+    def __init__(self, namespace: str, ttl_seconds: float, max_entries: Optional[int] = None):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+    async def get(self, key: str) -> Optional[str]:
+        return await get_cache_backend().get(self.namespace, key)
+
+    async def set(self, key: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        await get_cache_backend().set(self.namespace, key, value, ttl_seconds if ttl_seconds is not None else self.ttl_seconds,
+                                      self.max_entries)
+
+    async def add(self, key: str, value: str, ttl_seconds: Optional[float] = None) -> bool:
+        return await get_cache_backend().add(self.namespace, key, value, ttl_seconds if ttl_seconds is not None else self.ttl_seconds)
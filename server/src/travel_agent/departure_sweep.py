@@ -0,0 +1,152 @@
+"""
+Vectorized departure-time sweep over the OpenWeatherMap 5-day forecast horizon.
+
+Each sampled point's forecast is held as columnar arrays so every candidate departure
+can be scored in a single batched pass instead of re-walking the forecast lists.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .hazards import NONE, classify
+
+# OpenWeatherMap's 5-day forecast is published in 3-hour slots
+FORECAST_SLOT_SECONDS = 3 * 3600
+
+
+def to_timestamp(time: datetime) -> float:
+    """Epoch seconds for a datetime, treating naive datetimes as UTC like get_weather_forecast does."""
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=timezone.utc)
+    return time.timestamp()
+
+
+class ForecastSeries:
+    """
+    Columnar view of one point's 5-day forecast.
+
+    Attributes:
+        dt: Slot timestamps in epoch seconds, sorted ascending.
+        condition_id: OpenWeatherMap weather condition ids.
+        temp: Temperatures in °C.
+        wind: Wind speeds in m/s.
+        hazard_type: Hazard type of each slot (see hazards.classify), NONE where there is none.
+        hazard: 1 where the slot counts as a driving hazard, else 0.
+        entries: The raw forecast entries, in the same order as the arrays.
+    """
+    __slots__ = ('dt', 'condition_id', 'temp', 'wind', 'hazard_type', 'hazard', 'entries')
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        entries = sorted(entries, key=lambda entry: entry['dt'])
+        self.entries = entries
+        self.dt = np.fromiter((entry['dt'] for entry in entries), dtype=np.float64, count=len(entries))
+        self.condition_id = np.fromiter(
+            ((entry.get('weather') or [{}])[0].get('id', 0) for entry in entries), dtype=np.int32, count=len(entries))
+        self.temp = np.fromiter(
+            (entry.get('main', {}).get('temp', 0) for entry in entries), dtype=np.float64, count=len(entries))
+        self.wind = np.fromiter(
+            (entry.get('wind', {}).get('speed', 0) for entry in entries), dtype=np.float64, count=len(entries))
+        self.hazard_type = classify(self.condition_id, self.temp, self.wind)
+        self.hazard = (self.hazard_type != NONE).astype(np.int32)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def closest_slot(self, timestamps: np.ndarray) -> np.ndarray:
+        """Indices of the slots closest to each timestamp; ties go to the earlier slot."""
+        return _closest(self.dt, np.asarray(timestamps, dtype=np.float64))
+
+    def closest_entry(self, time: datetime) -> Optional[Dict[str, Any]]:
+        """The raw forecast entry closest to a time, or None for an empty series."""
+        if not self.entries:
+            return None
+        return self.entries[int(self.closest_slot(np.array([to_timestamp(time)]))[0])]
+
+
+def _closest(sorted_times: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    right = np.clip(np.searchsorted(sorted_times, queries), 1, len(sorted_times) - 1)
+    left = right - 1
+    if len(sorted_times) == 1:
+        return np.zeros(queries.shape, dtype=np.intp)
+    take_right = np.abs(sorted_times[right] - queries) < np.abs(queries - sorted_times[left])
+    return np.where(take_right, right, left)
+
+
+class DepartureCurve:
+    """
+    Hazard count along the route for each candidate departure time.
+
+    Attributes:
+        departure_time: The requested departure time; candidates are offsets from it.
+        offsets: Candidate offsets from departure_time in seconds.
+        hazards: Number of hazardous forecasts along the route for each candidate.
+    """
+    __slots__ = ('departure_time', 'offsets', 'hazards')
+
+    def __init__(self, departure_time: datetime, offsets: np.ndarray, hazards: np.ndarray):
+        self.departure_time = departure_time
+        self.offsets = offsets
+        self.hazards = hazards
+
+    def best(self) -> datetime:
+        """Earliest departure with the fewest hazards."""
+        if not len(self.offsets):
+            return self.departure_time
+        return self.departure_time + timedelta(seconds=float(self.offsets[int(np.argmin(self.hazards))]))
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """The curve as [{'departure_time': iso string, 'hazards': count}, ...]."""
+        return [
+            {
+                'departure_time': (self.departure_time + timedelta(seconds=float(offset))).isoformat(),
+                'hazards': int(count),
+            }
+            for offset, count in zip(self.offsets, self.hazards)
+        ]
+
+
+def sweep_departures(series: Sequence[ForecastSeries], arrival_offsets: Sequence[float],
+                     departure_time: datetime, resolution_seconds: int = 3600) -> DepartureCurve:
+    """
+    Scores every departure from departure_time to the end of the forecast horizon.
+
+    Args:
+        series: Forecast series for each sampled point along the route.
+        arrival_offsets: Seconds from departure until each sampled point is reached.
+        departure_time: The departure time the user wants; earlier times aren't forecast.
+        resolution_seconds: Spacing between candidate departures.
+
+    Returns:
+        A DepartureCurve with one entry per candidate departure. Candidates stop once any
+        point would be reached after its last forecast slot.
+    """
+    points = [(s, float(o)) for s, o in zip(series, arrival_offsets) if len(s)]
+    if not points:
+        return DepartureCurve(departure_time, np.zeros(1), np.zeros(1, dtype=np.int64))
+
+    start = to_timestamp(departure_time)
+    offsets = np.array([offset for _, offset in points])
+    last_slots = np.array([s.dt[-1] for s, _ in points])
+    window = float(np.min(last_slots - offsets)) + FORECAST_SLOT_SECONDS / 2 - start
+    num_candidates = max(int(window // resolution_seconds), 0) + 1
+    candidates = np.arange(num_candidates, dtype=np.float64) * resolution_seconds
+
+    # Pad the series into one matrix and shift each row into its own disjoint time band, so one
+    # searchsorted over the flattened matrix finds the closest slot for every (candidate, point).
+    width = max(len(s) for s, _ in points)
+    times = np.empty((len(points), width))
+    hazard = np.zeros((len(points), width), dtype=np.int64)
+    for row, (s, _) in enumerate(points):
+        times[row, :len(s)] = s.dt
+        times[row, len(s):] = s.dt[-1] + FORECAST_SLOT_SECONDS * 1e3
+        hazard[row, :len(s)] = s.hazard
+    arrivals = start + candidates[:, None] + offsets[None, :]
+    band = max(times.max(), arrivals.max()) - min(times.min(), arrivals.min()) + FORECAST_SLOT_SECONDS * 1e4
+    rows = np.arange(len(points))
+    flat_times = (times + (rows * band)[:, None]).ravel()
+    flat_queries = arrivals + rows * band
+    slots = _closest(flat_times, flat_queries.ravel()).reshape(arrivals.shape)
+
+    hazards = hazard.ravel()[slots].sum(axis=1)
+    return DepartureCurve(departure_time, candidates, hazards)
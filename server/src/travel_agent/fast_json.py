@@ -0,0 +1,42 @@
+"""
+Fast JSON serialization of API responses.
+
+FastAPI normally validates an endpoint's return value against its response_model and then
+serializes it through Pydantic, which walks every element of every coordinate list twice.
+FastJSONResponse skips both: endpoints build the response from their internal structures,
+with coordinates left as numpy arrays, and orjson serializes it in one native pass.
+Pydantic models found in the content are serialized field by field, as they are, without
+being validated again.
+"""
+from typing import Any
+
+import numpy as np
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return dict(value)
+    # orjson only serializes C-contiguous arrays natively, not views like RouteGeometry.latlon
+    if isinstance(value, np.ndarray):
+        return np.ascontiguousarray(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    # Anything else is sent as its string form, like json.dumps(default=str)
+    return str(value)
+
+
+def dumps(content: Any) -> bytes:
+    """content as compact UTF-8 JSON."""
+    return orjson.dumps(content, default=_default, option=OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse serialized with dumps(). Return it from an endpoint to bypass response_model validation."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
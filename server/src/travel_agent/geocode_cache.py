@@ -0,0 +1,302 @@
+"""
+Persistent caches of geocoding results.
+
+GeocodeCache maps addresses to coordinates, in the shared cache backend. Addresses are
+normalized before lookup so "Toronto, Canada" and " toronto  canada " share an entry.
+
+ReverseGeocodeCache maps coordinates to place names in a SQLite file, indexed by geohash
+so any point within a radius of a known place reuses its name. The radius search needs
+range queries, so it keeps its own database, which the workers on a node share.
+
+Entries expire after a TTL so moved or corrected places are eventually refreshed.
+"""
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Generic, List, Optional, Tuple, TypeVar
+
+from .cache_backend import SharedCache, connect_sqlite
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+DEFAULT_REVERSE_TTL_SECONDS = 90 * 24 * 3600
+DEFAULT_REVERSE_RADIUS_METERS = 2000.0
+
+METERS_PER_DEGREE = 111320.0
+GEOHASH_PRECISION = 9
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+V = TypeVar("V")
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_address(address: str) -> str:
+    """Canonical cache key for an address: case-folded, punctuation stripped, whitespace collapsed."""
+    text = unicodedata.normalize("NFKC", address).casefold()
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def geohash_encode(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Standard base32 geohash of a point."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_ALPHABET[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def geohash_cell_size(precision: int) -> Tuple[float, float]:
+    """(height, width) in degrees of a geohash cell at the given precision."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def geohash_neighborhood(latitude: float, longitude: float, precision: int) -> List[str]:
+    """The geohash of the cell containing a point plus its (up to) 8 neighbours."""
+    height, width = geohash_cell_size(precision)
+    cells = set()
+    for dlat in (-height, 0.0, height):
+        lat = latitude + dlat
+        if not -90.0 <= lat <= 90.0:
+            continue
+        for dlon in (-width, 0.0, width):
+            lon = (longitude + dlon + 180.0) % 360.0 - 180.0
+            cells.add(geohash_encode(lat, lon, precision))
+    return sorted(cells)
+
+
+def _search_precision(radius_meters: float) -> int:
+    """Finest geohash precision whose cells are at least radius_meters on each side (at the equator)."""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = geohash_cell_size(precision)
+        if min(height, width) * METERS_PER_DEGREE >= radius_meters:
+            return precision
+    return 1
+
+
+def haversine_meters(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(min(a, 1.0)))
+
+
+class PointIndex(Generic[V]):
+    """
+    In-memory values by location, bucketed by geohash like ReverseGeocodeCache, so finding
+    the one nearest a point only compares it with the points in the surrounding cells.
+
+    Args:
+        radius_meters: nearest() only returns values within this distance.
+    """
+
+    def __init__(self, radius_meters: float):
+        self.radius_meters = radius_meters
+        self._precision = _search_precision(radius_meters)
+        self._cells: Dict[str, List[Tuple[float, float, V]]] = {}
+
+    def nearest(self, latitude: float, longitude: float) -> Optional[V]:
+        """The value of the closest point within the radius, or None."""
+        best_value = None
+        best_distance = self.radius_meters
+        for cell in geohash_neighborhood(latitude, longitude, self._precision):
+            for lat, lon, value in self._cells.get(cell, ()):
+                distance = haversine_meters(latitude, longitude, lat, lon)
+                if distance <= best_distance:
+                    best_value, best_distance = value, distance
+        return best_value
+
+    def add(self, latitude: float, longitude: float, value: V) -> None:
+        self._cells.setdefault(geohash_encode(latitude, longitude, self._precision), []).append((latitude, longitude, value))
+
+
+class GeocodeCache:
+    """
+    Map from normalized address to [longitude, latitude], kept in the "geocode" namespace
+    of the shared cache backend so every worker sees every lookup.
+
+    Args:
+        ttl_seconds: How long an entry stays valid after it was stored.
+    """
+
+    def __init__(self, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._cache = SharedCache("geocode", ttl_seconds)
+
+    async def get(self, address: str) -> Optional[List[float]]:
+        """Returns [longitude, latitude] for an address, or None if unknown or expired."""
+        value = await self._cache.get(normalize_address(address))
+        return json.loads(value) if value else None
+
+    async def set(self, address: str, coordinates: List[float]) -> None:
+        """Stores [longitude, latitude] for an address."""
+        await self._cache.set(normalize_address(address), json.dumps([coordinates[0], coordinates[1]]))
+
+
+_geocode_cache: Optional[GeocodeCache] = None
+
+
+def get_geocode_cache() -> GeocodeCache:
+    """The process-wide geocode cache, created on first use with settings from the environment."""
+    global _geocode_cache
+    if _geocode_cache is None:
+        _geocode_cache = GeocodeCache(int(os.getenv("GEOCODE_CACHE_TTL_SECONDS", str(DEFAULT_TTL_SECONDS))))
+    return _geocode_cache
+
+
+class ReverseGeocodeCache:
+    """
+    SQLite-backed store of place names by location, indexed by geohash.
+
+    Args:
+        path: Database file; its directory is created if missing.
+        radius_meters: A point within this distance of a stored place reuses its name.
+        ttl_seconds: How long an entry stays valid after it was stored.
+
+    Lookups search the geohash cell containing the point and its neighbours, with cells
+    sized to the radius at the equator; cells narrow towards the poles, so at high
+    latitudes some places just inside the radius can be missed.
+
+    Lookups use a connection of their own, which in WAL mode never waits for a writer, but
+    still block on disk; async callers should run them in a thread. Writes are committed by
+    a background thread so callers never wait on the write lock. Database errors count as
+    misses and skipped writes.
+    """
+
+    def __init__(self, path: str, radius_meters: float = DEFAULT_REVERSE_RADIUS_METERS,
+                 ttl_seconds: int = DEFAULT_REVERSE_TTL_SECONDS):
+        self.path = path
+        self.radius_meters = radius_meters
+        self.ttl_seconds = ttl_seconds
+        self._precision = _search_precision(radius_meters)
+        self._conn = connect_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS places ("
+            " geohash TEXT NOT NULL,"
+            " latitude REAL NOT NULL,"
+            " longitude REAL NOT NULL,"
+            " name TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS places_geohash ON places (geohash)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._reader = connect_sqlite(path)
+        self._read_lock = threading.Lock()
+        self._writes = ThreadPoolExecutor(max_workers=1, thread_name_prefix="places-cache-writer")
+
+    def nearest(self, latitude: float, longitude: float) -> Optional[str]:
+        """Name of the closest stored place within the radius, or None."""
+        return self.nearest_many([(latitude, longitude)])[0]
+
+    def nearest_many(self, points: List[Tuple[float, float]]) -> List[Optional[str]]:
+        """nearest() for each (latitude, longitude) point, with one pass over the database."""
+        now = time.time()
+        try:
+            with self._read_lock:
+                return [self._nearest(latitude, longitude, now) for latitude, longitude in points]
+        except sqlite3.Error as e:
+            logger.warning(f"Error reading reverse geocode cache: {e}")
+            return [None] * len(points)
+
+    def _nearest(self, latitude: float, longitude: float, now: float) -> Optional[str]:
+        cells = geohash_neighborhood(latitude, longitude, self._precision)
+        query = " OR ".join("(geohash >= ? AND geohash < ?)" for _ in cells)
+        params: List[object] = []
+        for cell in cells:
+            params += [cell, cell + "~"]
+        rows = self._reader.execute(
+            f"SELECT latitude, longitude, name FROM places WHERE ({query}) AND expires_at > ?",
+            (*params, now),
+        ).fetchall()
+        best_name = None
+        best_distance = self.radius_meters
+        for lat, lon, name in rows:
+            distance = haversine_meters(latitude, longitude, lat, lon)
+            if distance <= best_distance:
+                best_name, best_distance = name, distance
+        return best_name
+
+    def set(self, latitude: float, longitude: float, name: str) -> "Future[None]":
+        """Stores the place name for a location in the background; the returned future completes once written."""
+        return self._writes.submit(self._insert, latitude, longitude, name, time.time() + self.ttl_seconds)
+
+    def _insert(self, latitude: float, longitude: float, name: str, expires_at: float) -> None:
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT INTO places (geohash, latitude, longitude, name, expires_at) VALUES (?, ?, ?, ?, ?)",
+                    (geohash_encode(latitude, longitude), latitude, longitude, name, expires_at),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Error writing reverse geocode cache: {e}")
+
+    def purge_expired(self) -> int:
+        """Deletes expired entries and returns how many were removed."""
+        try:
+            with self._lock, self._conn:
+                cursor = self._conn.execute("DELETE FROM places WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            logger.warning(f"Error purging reverse geocode cache: {e}")
+            return 0
+        return cursor.rowcount
+
+    def close(self) -> None:
+        """Waits for pending writes, then closes the database."""
+        self._writes.shutdown(wait=True)
+        with self._lock:
+            self._conn.close()
+        with self._read_lock:
+            self._reader.close()
+
+
+_reverse_geocode_cache: Optional[ReverseGeocodeCache] = None
+
+
+def get_reverse_geocode_cache() -> ReverseGeocodeCache:
+    """The process-wide reverse geocode cache, opened on first use with settings from the environment."""
+    global _reverse_geocode_cache
+    if _reverse_geocode_cache is None:
+        cache_dir = os.getenv("TRAVEL_AGENT_CACHE_DIR", ".cache")
+        _reverse_geocode_cache = ReverseGeocodeCache(
+            os.getenv("REVERSE_GEOCODE_CACHE_PATH", os.path.join(cache_dir, "places.sqlite")),
+            float(os.getenv("REVERSE_GEOCODE_RADIUS_METERS", str(DEFAULT_REVERSE_RADIUS_METERS))),
+            int(os.getenv("REVERSE_GEOCODE_CACHE_TTL_SECONDS", str(DEFAULT_REVERSE_TTL_SECONDS))),
+        )
+    return _reverse_geocode_cache
+
+
+def close_reverse_geocode_cache() -> None:
+    """Closes the process-wide reverse geocode cache, committing pending writes. It is reopened on next use."""
+    global _reverse_geocode_cache
+    if _reverse_geocode_cache is not None:
+        cache, _reverse_geocode_cache = _reverse_geocode_cache, None
+        cache.close()
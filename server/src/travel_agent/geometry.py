@@ -0,0 +1,202 @@
+"""
+Decode-once route geometry.
+
+OpenRoute Service returns route geometry as an encoded polyline. RouteGeometry decodes it
+once into a compact float64 array and hands out [lon, lat], [lat, lon] and GeoJSON views
+of that buffer, so the route, weather sampler and API responses share one decode.
+
+Compact API responses instead send the geometry re-encoded as a polyline, simplified with
+Douglas-Peucker to what can be told apart at the map zoom level the client asks for.
+"""
+from functools import lru_cache
+from typing import Any, Dict
+
+import numpy as np
+
+# Polylines from OpenRoute Service use 5 decimal places; elevation uses 2
+POLYLINE_PRECISION = 1e5
+ELEVATION_PRECISION = 1e2
+
+# Web map tiles are 256 pixels wide; zoom level z spans 360 degrees of longitude in 256 * 2**z pixels
+TILE_SIZE = 256
+MAX_ZOOM = 22
+
+
+def decode_polyline(polyline: str, is3d: bool = False) -> np.ndarray:
+    """
+    Decodes an encoded polyline in one vectorized pass.
+
+    Args:
+        polyline: An encoded polyline, only the geometry.
+        is3d: Whether the geometry carries an elevation component.
+
+    Returns:
+        An (n, 2) array of [longitude, latitude], or (n, 3) with elevation when is3d.
+    """
+    dims = 3 if is3d else 2
+    if not polyline:
+        return np.empty((0, dims))
+    chunks = np.frombuffer(polyline.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    # Each value is a run of 5-bit chunks; the 0x20 bit marks that another chunk follows
+    last_chunk = (chunks & 0x20) == 0
+    value_index = np.concatenate(([0], np.cumsum(last_chunk)[:-1]))
+    value_starts = np.flatnonzero(np.concatenate(([True], last_chunk[:-1])))
+    shifts = 5 * (np.arange(len(chunks)) - value_starts[value_index])
+    values = np.add.reduceat((chunks & 0x1F) << shifts, value_starts)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+
+    points = np.cumsum(deltas[: len(deltas) // dims * dims].reshape(-1, dims), axis=0).astype(np.float64)
+    coordinates = np.empty_like(points)
+    # Encoded order is lat, lon[, elevation]; stored order is lon, lat[, elevation]
+    coordinates[:, 0] = points[:, 1] / POLYLINE_PRECISION
+    coordinates[:, 1] = points[:, 0] / POLYLINE_PRECISION
+    if is3d:
+        coordinates[:, 2] = points[:, 2] / ELEVATION_PRECISION
+    return coordinates
+
+
+def encode_polyline(coordinates: np.ndarray) -> str:
+    """
+    Encodes [longitude, latitude] coordinates as a polyline with 5 decimal places, the
+    inverse of decode_polyline, in one vectorized pass.
+    """
+    if not len(coordinates):
+        return ""
+    # Encoded order is lat, lon
+    points = np.round(np.asarray(coordinates)[:, 1::-1] * POLYLINE_PRECISION).astype(np.int64)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    # Split each value into 5-bit chunks, lowest first; all but its last chunk get the 0x20 bit
+    shifts = np.arange(8) * 5
+    shifted = values[:, None] >> shifts
+    num_chunks = np.maximum((shifted > 0).sum(axis=1), 1)
+    chunk_index = np.arange(len(shifts))
+    chunks = (shifted & 0x1F) | np.where(chunk_index < (num_chunks - 1)[:, None], 0x20, 0)
+    return (chunks[chunk_index < num_chunks[:, None]] + 63).astype(np.uint8).tobytes().decode("ascii")
+
+
+def zoom_tolerance(zoom: int) -> float:
+    """The width of one map pixel at a zoom level, in degrees of longitude."""
+    return 360.0 / (TILE_SIZE * 2.0 ** min(max(zoom, 0), MAX_ZOOM))
+
+
+def simplify(coordinates: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Douglas-Peucker simplification: drops the vertices that lie within tolerance of the
+    line kept in their place. The endpoints are always kept.
+
+    Args:
+        coordinates: (n, 2) array of [longitude, latitude].
+        tolerance: Largest allowed deviation, in degrees of latitude. Longitudes are scaled
+            by the cosine of the mean latitude so the tolerance is the same in both directions.
+
+    Returns:
+        The kept rows of coordinates, in order.
+    """
+    if len(coordinates) < 3:
+        return coordinates
+    points = np.array(coordinates[:, :2], dtype=np.float64)
+    points[:, 0] *= np.cos(np.radians(points[:, 1].mean()))
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    # Vertices not yet kept whose span may still split. Every span is split at once per pass,
+    # so the number of passes is the depth of the recursion rather than the number of splits.
+    pending = ~keep
+    while pending.any():
+        candidates = np.flatnonzero(pending)
+        kept = np.flatnonzero(keep)
+        span = np.searchsorted(kept, candidates) - 1
+        start = points[kept[span]]
+        direction = points[kept[span + 1]] - start
+        offsets = points[candidates] - start
+        length = np.hypot(direction[:, 0], direction[:, 1])
+        distances = np.where(
+            length > 0,
+            np.abs(direction[:, 0] * offsets[:, 1] - direction[:, 1] * offsets[:, 0]) / np.where(length > 0, length, 1),
+            np.hypot(offsets[:, 0], offsets[:, 1]),
+        )
+        # Candidates are in order, so each span's candidates are one run; find each run's farthest
+        run_starts = np.flatnonzero(np.diff(span, prepend=-1))
+        run = np.cumsum(np.diff(span, prepend=-1) != 0) - 1
+        farthest_distance = np.maximum.reduceat(distances, run_starts)
+        at_farthest = np.flatnonzero(distances == farthest_distance[run])
+        farthest = at_farthest[np.diff(run[at_farthest], prepend=-1) != 0]
+        split = farthest[distances[farthest] > tolerance]
+        if not len(split):
+            break
+        keep[candidates[split]] = True
+        splits = np.zeros(len(run_starts), dtype=bool)
+        splits[run[split]] = True
+        pending[candidates[~splits[run]]] = False
+        pending[candidates[split]] = False
+    return coordinates[keep]
+
+
+class RouteGeometry:
+    """
+    A route's decoded coordinates held in a single contiguous [longitude, latitude] buffer.
+
+    The lonlat, latlon and geojson views share that buffer. Convert with tolist() only
+    at the point where plain lists are needed, e.g. JSON responses.
+    """
+    __slots__ = ('_coordinates',)
+
+    def __init__(self, coordinates: np.ndarray):
+        self._coordinates = np.ascontiguousarray(coordinates, dtype=np.float64)[:, :2]
+        self._coordinates.flags.writeable = False
+
+    @classmethod
+    def from_polyline(cls, polyline: str) -> "RouteGeometry":
+        return cls(decode_polyline(polyline))
+
+    def __len__(self) -> int:
+        return len(self._coordinates)
+
+    @property
+    def lonlat(self) -> np.ndarray:
+        """(n, 2) view of [longitude, latitude] pairs, the OpenRoute Service order."""
+        return self._coordinates
+
+    @property
+    def latlon(self) -> np.ndarray:
+        """(n, 2) view of [latitude, longitude] pairs, the order the map client expects."""
+        return self._coordinates[:, ::-1]
+
+    @property
+    def geojson(self) -> Dict[str, Any]:
+        """GeoJSON LineString whose coordinates are the lonlat view."""
+        return {"type": "LineString", "coordinates": self._coordinates}
+
+    def simplified(self, zoom: int) -> "RouteGeometry":
+        """The geometry without the vertices that can't be told apart at a map zoom level."""
+        return RouteGeometry(simplify(self._coordinates, zoom_tolerance(zoom)))
+
+    def polyline(self) -> str:
+        """The coordinates as an encoded polyline with 5 decimal places."""
+        return encode_polyline(self._coordinates)
+
+
+@lru_cache(maxsize=128)
+def _geometry_for_polyline(polyline: str) -> RouteGeometry:
+    return RouteGeometry.from_polyline(polyline)
+
+
+def route_geometry(route: Dict[str, Any]) -> RouteGeometry:
+    """
+    The decoded geometry of an OpenRoute Service route. Decoded once per distinct polyline
+    and shared by every caller.
+    """
+    return _geometry_for_polyline(route.get('geometry', ''))
+
+
+@lru_cache(maxsize=256)
+def _simplified_polyline(polyline: str, zoom: int) -> str:
+    return _geometry_for_polyline(polyline).simplified(zoom).polyline()
+
+
+def simplified_polyline(route: Dict[str, Any], zoom: int) -> str:
+    """
+    The geometry of an OpenRoute Service route as an encoded polyline, simplified for a map
+    zoom level. Computed once per distinct polyline and zoom level.
+    """
+    return _simplified_polyline(route.get('geometry', ''), zoom)
@@ -0,0 +1,120 @@
+"""
+Driving hazard classification of OpenWeatherMap forecasts.
+
+Each forecast is classified from its numeric weather condition id through a lookup table,
+then from its temperature and wind speed, into at most one hazard type. classify() does so
+in bulk over columnar arrays, so the departure sweep never builds or parses strings;
+hazards_in() turns weather samples into structured Hazard records, whose severity feeds
+risk scoring, and describe() renders a record as text only where text is needed.
+
+Condition ids: https://openweathermap.org/weather-conditions
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+NONE = 0
+SNOW_SLEET = 1
+HEAVY_RAIN = 2
+FOG = 3
+FREEZING = 4
+STRONG_WIND = 5
+
+HAZARD_NAMES = {
+    SNOW_SLEET: "Snow/Sleet",
+    HEAVY_RAIN: "Heavy Rain",
+    FOG: "Fog",
+    FREEZING: "Freezing Temperatures",
+    STRONG_WIND: "Strong Winds",
+}
+
+# Severe hazards weigh more in the weather risk of a route
+SEVERE = 2
+MODERATE = 1
+HAZARD_SEVERITY = np.array([0, SEVERE, SEVERE, MODERATE, MODERATE, SEVERE], dtype=np.int8)
+
+FREEZING_CELSIUS = 0.0
+STRONG_WIND_MPS = 15.0
+
+# Hazard type by condition id. Ids not listed aren't hazards by themselves.
+CONDITION_HAZARDS = np.zeros(1000, dtype=np.int8)
+CONDITION_HAZARDS[600:623] = SNOW_SLEET  # snow, sleet, rain and snow, shower snow
+CONDITION_HAZARDS[[202, 232]] = HEAVY_RAIN  # thunderstorm with heavy rain / heavy drizzle
+CONDITION_HAZARDS[[502, 503, 504, 522]] = HEAVY_RAIN  # heavy, very heavy, extreme, heavy shower rain
+CONDITION_HAZARDS[741] = FOG
+
+
+def classify(condition_id: np.ndarray, temp: np.ndarray, wind: np.ndarray) -> np.ndarray:
+    """
+    Hazard type of each forecast, NONE where there is none. A hazardous condition takes
+    precedence over freezing temperatures, which take precedence over strong wind.
+
+    Args:
+        condition_id: OpenWeatherMap weather condition ids.
+        temp: Temperatures in °C.
+        wind: Wind speeds in m/s.
+    """
+    # Both ends of the table are NONE, so out-of-range ids clip to no hazard
+    by_condition = CONDITION_HAZARDS[np.clip(condition_id, 0, len(CONDITION_HAZARDS) - 1)]
+    return np.where(
+        by_condition != NONE, by_condition,
+        np.where(np.asarray(temp) < FREEZING_CELSIUS, FREEZING,
+                 np.where(np.asarray(wind) > STRONG_WIND_MPS, STRONG_WIND, NONE)),
+    ).astype(np.int8)
+
+
+class Hazard:
+    """
+    One hazardous forecast.
+
+    Attributes:
+        type: Hazard type, e.g. SNOW_SLEET.
+        severity: SEVERE or MODERATE.
+        dt: Forecast slot timestamp in epoch seconds.
+        temp: Temperature in °C.
+        wind: Wind speed in m/s.
+        point: (latitude, longitude) of the sample, if the forecast came with a location.
+    """
+    __slots__ = ('type', 'severity', 'dt', 'temp', 'wind', 'point')
+
+    def __init__(self, type: int, dt: int, temp: float, wind: float, point: Optional[tuple] = None):
+        self.type = type
+        self.severity = int(HAZARD_SEVERITY[type])
+        self.dt = dt
+        self.temp = temp
+        self.wind = wind
+        self.point = point
+
+    @property
+    def name(self) -> str:
+        return HAZARD_NAMES[self.type]
+
+
+def hazards_in(weather_data: List[Dict[str, Any]]) -> List[Hazard]:
+    """The hazards among forecast entries or weather samples, in their order. Entries without weather are skipped."""
+    entries = [data for data in weather_data if data.get('weather')]
+    if not entries:
+        return []
+    condition_id = np.fromiter((entry['weather'][0].get('id', 0) for entry in entries), dtype=np.int32, count=len(entries))
+    temp = np.fromiter((entry.get('main', {}).get('temp', 0) for entry in entries), dtype=np.float64, count=len(entries))
+    wind = np.fromiter((entry.get('wind', {}).get('speed', 0) for entry in entries), dtype=np.float64, count=len(entries))
+    types = classify(condition_id, temp, wind)
+    hazards = []
+    for i in np.flatnonzero(types):
+        entry = entries[i]
+        location = entry.get('location')
+        point = (location['latitude'], location['longitude']) if location else None
+        hazards.append(Hazard(int(types[i]), entry['dt'], entry.get('main', {}).get('temp', 0),
+                              entry.get('wind', {}).get('speed', 0), point))
+    return hazards
+
+
+def describe(hazard: Hazard) -> str:
+    """A hazard as text, e.g. "Strong Winds (16 m/s) at 2025-04-14 12:00"."""
+    time = datetime.fromtimestamp(hazard.dt, tz=timezone.utc).strftime('%Y-%m-%d %H:%M')
+    if hazard.type == FREEZING:
+        return f"{hazard.name} ({hazard.temp}°C) at {time}"
+    if hazard.type == STRONG_WIND:
+        return f"{hazard.name} ({hazard.wind} m/s) at {time}"
+    return f"{hazard.name} at {time}"
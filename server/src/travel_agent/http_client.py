@@ -0,0 +1,86 @@
+"""
+Shared async HTTP client for the outbound calls to OpenRoute Service, OpenWeatherMap
+and the geotime reverse geocoder.
+
+A single keep-alive connection pool is reused across requests, every call has a timeout,
+and concurrent calls to each upstream host are capped so one large trip can't exhaust
+an API's rate limit for everyone else on the worker.
+"""
+import asyncio
+import os
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from .metrics import record_outbound_call
+
+DEFAULT_TIMEOUT_SECONDS = 10.0
+LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=40, keepalive_expiry=30.0)
+
+# Maximum in-flight requests per upstream host
+HOST_LIMITS = {
+    "api.openrouteservice.org": 10,
+    "api.openweathermap.org": 20,
+    "geoservices.geotime.com": 10,
+}
+DEFAULT_HOST_LIMIT = 10
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+def get_client() -> httpx.AsyncClient:
+    """Returns the shared client, creating it for the running event loop if needed."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        # Connections and semaphores are bound to the loop that created them
+        timeout = httpx.Timeout(float(os.getenv("HTTP_TIMEOUT_SECONDS", DEFAULT_TIMEOUT_SECONDS)), connect=5.0)
+        _client = httpx.AsyncClient(timeout=timeout, limits=LIMITS)
+        _client_loop = loop
+        _host_semaphores.clear()
+    return _client
+
+
+async def request(method: str, url: str, **kwargs: Any) -> httpx.Response:
+    """
+    Sends a request through the shared client, waiting for a free slot on the target host.
+
+    Args:
+        method: HTTP method, e.g. "GET".
+        url: Absolute URL to request.
+        **kwargs: Passed through to httpx.AsyncClient.request (params, json, headers, ...).
+
+    Returns:
+        The httpx response. Status codes aren't checked; call raise_for_status() as needed.
+    """
+    client = get_client()
+    parts = urlsplit(url)
+    # Keyed by host and port, so local stand-ins on one host get a limit each
+    host = parts.netloc
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = _host_semaphores[host] = asyncio.Semaphore(HOST_LIMITS.get(parts.hostname or "", DEFAULT_HOST_LIMIT))
+    async with semaphore:
+        record_outbound_call(host)
+        return await client.request(method, url, **kwargs)
+
+
+async def get(url: str, **kwargs: Any) -> httpx.Response:
+    return await request("GET", url, **kwargs)
+
+
+async def post(url: str, **kwargs: Any) -> httpx.Response:
+    return await request("POST", url, **kwargs)
+
+
+async def aclose() -> None:
+    """Closes the shared client; called on application shutdown."""
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+    _host_semaphores.clear()
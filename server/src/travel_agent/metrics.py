@@ -0,0 +1,130 @@
+"""
+Stage timings, outbound-call and cache counters.
+
+Everything is exported as Prometheus metrics. Each request also collects its own totals
+in a RequestMetrics, which main.py turns into a Server-Timing header and per-request
+histograms; tasks spawned while handling the request add to the same totals.
+"""
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from prometheus_client import Counter, Histogram
+
+T = TypeVar("T")
+
+STAGE_SECONDS = Histogram(
+    "travel_agent_stage_seconds",
+    "Time spent in each stage of trip planning, per call.",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+OUTBOUND_CALLS = Counter(
+    "travel_agent_outbound_calls_total",
+    "HTTP calls made to upstream APIs.",
+    ["host"],
+)
+CACHE_LOOKUPS = Counter(
+    "travel_agent_cache_lookups_total",
+    "Cache lookups by cache and result (hit or miss).",
+    ["cache", "result"],
+)
+REQUEST_OUTBOUND_CALLS = Histogram(
+    "travel_agent_request_outbound_calls",
+    "Upstream HTTP calls made per API request.",
+    ["endpoint"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250),
+)
+REQUEST_CACHE_HITS = Histogram(
+    "travel_agent_request_cache_hits",
+    "Cache hits per API request.",
+    ["endpoint"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250),
+)
+
+
+class RequestMetrics:
+    """Totals for one API request: seconds and calls per stage, outbound calls and cache hits."""
+    __slots__ = ('stage_seconds', 'stage_calls', 'outbound_calls', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.stage_seconds: Dict[str, float] = {}
+        self.stage_calls: Dict[str, int] = {}
+        self.outbound_calls = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def server_timing(self) -> str:
+        """The totals as a Server-Timing header value. Durations of concurrent calls add up."""
+        entries = [
+            f'{stage};dur={seconds * 1000:.1f};desc="{self.stage_calls[stage]} calls"'
+            for stage, seconds in self.stage_seconds.items()
+        ]
+        entries.append(f'outbound;desc="{self.outbound_calls} calls"')
+        entries.append(f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"')
+        return ", ".join(entries)
+
+
+_request_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+
+@contextmanager
+def track_request():
+    """Collects a RequestMetrics for everything run inside it and yields it."""
+    metrics = RequestMetrics()
+    token = _request_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _request_metrics.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    """Times the enclosed block as one call of the named stage, e.g. "geocode" or "llm"."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        metrics = _request_metrics.get()
+        if metrics is not None:
+            metrics.stage_seconds[name] = metrics.stage_seconds.get(name, 0.0) + elapsed
+            metrics.stage_calls[name] = metrics.stage_calls.get(name, 0) + 1
+
+
+def timed(name: str) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Decorator that times each call of an async function as one call of the named stage."""
+    def decorator(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            with stage(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_outbound_call(host: str):
+    OUTBOUND_CALLS.labels(host).inc()
+    metrics = _request_metrics.get()
+    if metrics is not None:
+        metrics.outbound_calls += 1
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+    metrics = _request_metrics.get()
+    if metrics is not None:
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+
+
+def observe_request(endpoint: str, metrics: RequestMetrics):
+    """Records a finished request's totals in the per-request histograms."""
+    REQUEST_OUTBOUND_CALLS.labels(endpoint).observe(metrics.outbound_calls)
+    REQUEST_CACHE_HITS.labels(endpoint).observe(metrics.cache_hits)
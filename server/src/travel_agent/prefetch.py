@@ -0,0 +1,171 @@
+"""
+Background pre-warming of forecasts for popular routes.
+
+CorridorTracker remembers which trips (origin to destination corridors) are planned most,
+with older plans counting for less, and where along each one the weather was sampled. It
+keeps both in the shared cache backend, so the ranking covers the plans of every worker.
+ForecastPrefetcher wakes shortly after each 3-hour forecast update and fetches the
+forecasts for the top corridors' sample points into the shared cache, within a call
+budget, so the next plan on a common route finds them there instead of fetching cold.
+Every worker runs a prefetcher, but only the one that takes the update's lease prefetches.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import socket
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+
+from .cache_backend import SharedCache, get_cache_backend
+from .departure_sweep import FORECAST_SLOT_SECONDS
+from .geocode_cache import normalize_address
+from .sampling import forecast_cell
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HALF_LIFE_SECONDS = 24 * 3600
+DEFAULT_MAX_CORRIDORS = 500
+# Length of a scoring era, in half-lives; see CorridorTracker
+ERA_HALF_LIVES = 32
+
+# Holder of each forecast update's prefetch, so only one worker prefetches it
+_prefetch_leases = SharedCache("prefetch_lease", FORECAST_SLOT_SECONDS)
+
+
+class CorridorTracker:
+    """
+    Decaying request counts per corridor, with the forecast cells last sampled along each,
+    kept in the shared cache backend.
+
+    Scores decay forward so they never have to be rewritten: a plan at time t adds
+    2 ** ((t - start of era) / half-life) to its corridor's score in the current era, so
+    later plans weigh exponentially more. Eras last ERA_HALF_LIVES half-lives, which keeps
+    weights within float range; the previous era's scores are scaled down into the current
+    one's units when ranking, and older eras no longer matter.
+
+    Args:
+        half_life_seconds: Time after which a plan counts half as much.
+        max_corridors: Most corridors remembered per era; the least popular are forgotten first.
+    """
+
+    def __init__(self, half_life_seconds: float = DEFAULT_HALF_LIFE_SECONDS, max_corridors: int = DEFAULT_MAX_CORRIDORS):
+        self.half_life_seconds = half_life_seconds
+        self.max_corridors = max_corridors
+        self._era_seconds = ERA_HALF_LIVES * half_life_seconds
+        # Sample points of each corridor, as a JSON list of [latitude, longitude]. Evicted by
+        # recency rather than popularity, so kept for more corridors than are ranked.
+        self._points = SharedCache("corridor_points", 2 * self._era_seconds, 4 * max_corridors)
+
+    def _era(self, now: float) -> int:
+        return int(now // self._era_seconds)
+
+    async def record(self, origin: str, destination: str, points: Iterable[Tuple[float, float]]):
+        """Counts a plan from origin to destination whose weather was sampled at points (latitude, longitude)."""
+        corridor = json.dumps([normalize_address(origin), normalize_address(destination)])
+        cells = {forecast_cell(lat, lon): [lat, lon] for lat, lon in points}
+        now = time.time()
+        era = self._era(now)
+        weight = math.exp2((now - era * self._era_seconds) / self.half_life_seconds)
+        await get_cache_backend().increment(f"corridors:{era}", corridor, weight, 2 * self._era_seconds, self.max_corridors)
+        await self._points.set(corridor, json.dumps(list(cells.values())))
+
+    async def top(self, count: int) -> List[Tuple[Tuple[str, str], List[Tuple[float, float]]]]:
+        """The count most popular corridors, most popular first, each with its sample points."""
+        era = self._era(time.time())
+        scores = defaultdict(float)
+        for scores_era, scale in ((era, 1.0), (era - 1, math.exp2(-ERA_HALF_LIVES))):
+            # Twice as many from each era, as a corridor can rank higher once both are added
+            for corridor, score in await get_cache_backend().top(f"corridors:{scores_era}", 2 * count):
+                scores[corridor] += score * scale
+        ranked = []
+        for corridor in sorted(scores, key=scores.get, reverse=True)[:count]:
+            points = await self._points.get(corridor)
+            if points is not None:
+                ranked.append((tuple(json.loads(corridor)), [tuple(point) for point in json.loads(points)]))
+        return ranked
+
+
+class ForecastPrefetcher:
+    """
+    Re-warms the forecasts of the most popular corridors after every forecast update.
+
+    Args:
+        tracker: Where popular corridors come from.
+        warm: Fetches one point's forecast into the shared cache unless it is already
+            cached; returns whether it made an upstream call.
+        corridors: How many of the top corridors to warm.
+        call_budget: Most upstream calls per update.
+        delay_seconds: How long after each 3-hour slot boundary to run, giving the new
+            forecast time to be published.
+    """
+
+    def __init__(self, tracker: CorridorTracker, warm: Callable[[float, float], Awaitable[bool]],
+                 corridors: int = 20, call_budget: int = 50, delay_seconds: float = 300.0):
+        self.tracker = tracker
+        self.warm = warm
+        self.corridors = corridors
+        self.call_budget = call_budget
+        self.delay_seconds = delay_seconds
+
+    async def prefetch(self) -> int:
+        """Warms the top corridors once, most popular first, and returns the number of upstream calls made."""
+        calls = 0
+        seen = set()
+        for _, points in await self.tracker.top(self.corridors):
+            for lat, lon in points:
+                cell = forecast_cell(lat, lon)
+                if cell in seen:
+                    continue
+                seen.add(cell)
+                if calls >= self.call_budget:
+                    return calls
+                try:
+                    if await self.warm(lat, lon):
+                        calls += 1
+                except Exception as e:
+                    logger.warning(f"Error prefetching forecast at ({lat:.2f}, {lon:.2f}): {e}")
+        return calls
+
+    async def run(self):
+        """
+        Prefetches after every forecast slot boundary until cancelled. The workers all wake at
+        the same time; whichever takes the slot's lease in the shared cache prefetches, so the
+        call budget holds however many workers there are.
+        """
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        while True:
+            now = time.time()
+            await asyncio.sleep(FORECAST_SLOT_SECONDS - now % FORECAST_SLOT_SECONDS + self.delay_seconds)
+            slot = int(time.time() // FORECAST_SLOT_SECONDS)
+            if not await _prefetch_leases.add(str(slot), worker):
+                continue
+            calls = await self.prefetch()
+            logger.debug(f"Prefetched {calls} forecasts for popular routes")
+
+
+_corridor_tracker: Optional[CorridorTracker] = None
+
+
+def get_corridor_tracker() -> CorridorTracker:
+    """The process-wide corridor tracker, created on first use with settings from the environment."""
+    global _corridor_tracker
+    if _corridor_tracker is None:
+        _corridor_tracker = CorridorTracker(
+            float(os.getenv("PREFETCH_HALF_LIFE_SECONDS", str(DEFAULT_HALF_LIFE_SECONDS))),
+            int(os.getenv("PREFETCH_MAX_CORRIDORS", str(DEFAULT_MAX_CORRIDORS))),
+        )
+    return _corridor_tracker
+
+
+def create_prefetcher(warm: Callable[[float, float], Awaitable[bool]]) -> ForecastPrefetcher:
+    """A prefetcher over the process-wide tracker, with settings from the environment."""
+    return ForecastPrefetcher(
+        get_corridor_tracker(),
+        warm,
+        corridors=int(os.getenv("PREFETCH_CORRIDORS", "20")),
+        call_budget=int(os.getenv("PREFETCH_CALL_BUDGET", "50")),
+        delay_seconds=float(os.getenv("PREFETCH_DELAY_SECONDS", "300")),
+    )
@@ -0,0 +1,148 @@
+"""
+Compact, token-budgeted route descriptions for LLM prompts.
+
+A long trip has hundreds of turn-by-turn steps, most of them a few hundred metres of
+local road. The digest merges consecutive steps on the same road, then repeatedly folds
+the shortest leg into its neighbour until the text fits a token budget, so what is left
+are the highway-level legs with their start and end points and arrival times.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from .timeline import route_timeline
+
+# Default prompt budget for a digest, in estimated tokens
+DEFAULT_TOKEN_BUDGET = 400
+# Rough characters per token for English text and numbers; good enough for budgeting
+CHARS_PER_TOKEN = 4
+# ORS uses "-" for steps on unnamed roads
+UNNAMED_ROAD = "-"
+
+
+def get_token_budget() -> int:
+    return int(os.getenv("ROUTE_DIGEST_TOKEN_BUDGET", str(DEFAULT_TOKEN_BUDGET)))
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimated number of LLM tokens in text."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def route_legs(route: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    The route's steps merged into legs, one per run of consecutive steps on the same road.
+    Unnamed steps join the leg before them.
+
+    Returns:
+        Legs in route order, each with 'road', 'distance' (m), 'start' and 'end' vertex
+        indexes into the route geometry.
+    """
+    legs: List[Dict[str, Any]] = []
+    for segment in route.get('segments', []):
+        for step in segment.get('steps', []):
+            way_points = step.get('way_points', [])
+            if len(way_points) < 2 or way_points[1] <= way_points[0]:
+                continue
+            road = step.get('name') or UNNAMED_ROAD
+            if legs and road in (legs[-1]['road'], UNNAMED_ROAD):
+                legs[-1]['distance'] += step.get('distance', 0)
+                legs[-1]['end'] = way_points[1]
+                continue
+            if legs and legs[-1]['road'] == UNNAMED_ROAD:
+                # A named road after an unnamed start takes over that stretch
+                legs[-1].update(road=road, distance=legs[-1]['distance'] + step.get('distance', 0), end=way_points[1])
+                continue
+            legs.append({'road': road, 'distance': step.get('distance', 0), 'start': way_points[0], 'end': way_points[1]})
+    return legs
+
+
+def merge_shortest_leg(legs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Folds the shortest leg into its shorter neighbour. The merged leg keeps the road name
+    of the longer of the two, so minor connectors disappear into the highways around them,
+    and joins it with a neighbour on the same road.
+    """
+    shortest = min(range(len(legs)), key=lambda i: legs[i]['distance'])
+    if shortest == 0:
+        neighbour = 1
+    elif shortest == len(legs) - 1:
+        neighbour = shortest - 1
+    else:
+        neighbour = min(shortest - 1, shortest + 1, key=lambda i: legs[i]['distance'])
+    first, second = sorted((shortest, neighbour))
+    longer = legs[first] if legs[first]['distance'] >= legs[second]['distance'] else legs[second]
+    merged = {
+        'road': longer['road'],
+        'distance': legs[first]['distance'] + legs[second]['distance'],
+        'start': legs[first]['start'],
+        'end': legs[second]['end'],
+    }
+    before, after = legs[:first], legs[second + 1:]
+    if before and before[-1]['road'] == merged['road']:
+        merged.update(distance=before[-1]['distance'] + merged['distance'], start=before[-1]['start'])
+        before = before[:-1]
+    if after and after[0]['road'] == merged['road']:
+        merged.update(distance=merged['distance'] + after[0]['distance'], end=after[0]['end'])
+        after = after[1:]
+    return before + [merged] + after
+
+
+def format_route_digest(route: Dict[str, Any], legs: List[Dict[str, Any]], departure_time: datetime) -> str:
+    """One line for the whole trip, then one line per leg with where it ends and when it gets there."""
+    timeline = route_timeline(route)
+    lonlat = timeline.geometry.lonlat
+    summary = route.get('summary', {})
+    total_distance = summary.get('distance', timeline.total_distance)
+    total_duration = summary.get('duration', timeline.total_duration)
+    lines = [
+        f"Total {total_distance / 1000:.0f} km, {_format_duration(total_duration)}, "
+        f"from ({lonlat[0, 1]:.2f}, {lonlat[0, 0]:.2f}) at {departure_time.strftime('%Y-%m-%d %H:%M')}."
+    ]
+    for number, leg in enumerate(legs, start=1):
+        duration = timeline.time_at_vertex(leg['end']) - timeline.time_at_vertex(leg['start'])
+        arrival = departure_time + timedelta(seconds=float(timeline.time_at_vertex(leg['end'])))
+        road = "local roads" if leg['road'] == UNNAMED_ROAD else leg['road']
+        lines.append(
+            f"{number}. {road}: {leg['distance'] / 1000:.0f} km, {_format_duration(duration)}, "
+            f"to ({lonlat[leg['end'], 1]:.2f}, {lonlat[leg['end'], 0]:.2f}) by {_format_arrival(arrival, departure_time)}"
+        )
+    return "\n".join(lines)
+
+
+def route_digest(route: Dict[str, Any], departure_time: datetime, token_budget: Optional[int] = None) -> str:
+    """
+    A compact text description of an OpenRoute Service route for LLM prompts.
+
+    Args:
+        route: The route, as returned in get_driving_route's 'route'.
+        departure_time: The departure time, used for the arrival time of each leg.
+        token_budget: Most estimated tokens the digest may use; defaults to
+            ROUTE_DIGEST_TOKEN_BUDGET. A route that can't fit is described as one leg.
+
+    Returns:
+        The digest text, one line per leg.
+    """
+    budget = token_budget if token_budget is not None else get_token_budget()
+    legs = route_legs(route)
+    digest = format_route_digest(route, legs, departure_time)
+    while len(legs) > 1 and estimate_tokens(digest) > budget:
+        # Merge away as many legs as the overshoot accounts for before formatting again
+        tokens = estimate_tokens(digest)
+        target = max(len(legs) - max(1, (tokens - budget) * len(legs) // tokens), 1)
+        while len(legs) > target:
+            legs = merge_shortest_leg(legs)
+        digest = format_route_digest(route, legs, departure_time)
+    return digest
+
+
+def _format_arrival(arrival: datetime, departure_time: datetime) -> str:
+    # Arrivals on a later day than departure get their date, so overnight legs aren't read as same-day
+    if arrival.date() == departure_time.date():
+        return arrival.strftime('%H:%M')
+    return arrival.strftime('%Y-%m-%d %H:%M')
+
+
+def _format_duration(seconds: float) -> str:
+    minutes = int(round(seconds / 60))
+    return f"{minutes // 60}h{minutes % 60:02d}m"
@@ -0,0 +1,95 @@
+"""
+Choosing where along a route to sample the weather.
+
+Fixed sampling takes evenly spaced points. Adaptive sampling places a point wherever the
+route enters a new forecast grid cell or 3-hour forecast slot, merges points that share
+a cell and slot, and thins the result to a call budget. Short trips then need only a
+few forecast calls while long trips get their budget spread over where the forecast
+actually changes.
+"""
+import math
+from typing import Tuple
+
+import numpy as np
+
+from .departure_sweep import FORECAST_SLOT_SECONDS
+from .timeline import RouteTimeline
+
+# Size of the grid cell within which one forecast series is assumed to hold
+FORECAST_CELL_DEGREES = 0.25
+# Most points adaptive sampling returns, including start and end
+DEFAULT_SAMPLE_BUDGET = 10
+# Spacing of the probes used to detect cell and slot changes
+PROBE_SPACING_METERS = 2000.0
+
+
+def forecast_cell(latitude: float, longitude: float, cell_degrees: float = FORECAST_CELL_DEGREES) -> Tuple[int, int]:
+    """The (row, column) of the forecast grid cell containing a point."""
+    return math.floor(latitude / cell_degrees), math.floor(longitude / cell_degrees)
+
+
+def fixed_sample_distances(timeline: RouteTimeline, num_points: int = 5) -> np.ndarray:
+    """num_points equally spaced distances between the start and end, plus both endpoints."""
+    return np.linspace(0, timeline.total_distance, num_points + 2)
+
+
+def adaptive_sample_distances(timeline: RouteTimeline, departure_timestamp: float,
+                              max_points: int = DEFAULT_SAMPLE_BUDGET,
+                              cell_degrees: float = FORECAST_CELL_DEGREES,
+                              slot_seconds: int = FORECAST_SLOT_SECONDS,
+                              probe_spacing: float = PROBE_SPACING_METERS) -> np.ndarray:
+    """
+    Distances along the route at which it enters a new forecast cell or forecast slot.
+
+    Args:
+        timeline: The route's timeline.
+        departure_timestamp: Departure time in epoch seconds; slots are aligned to the epoch.
+        max_points: Forecast call budget, i.e. the most distinct cells sampled. When the route
+            crosses more cells, the ones entered closest to an even spread along the route
+            are kept, always including the start and end cells.
+        cell_degrees: Forecast grid cell size.
+        slot_seconds: Forecast slot length.
+        probe_spacing: Distance between the probes used to detect changes.
+
+    Returns:
+        Sorted distances in metres, starting at 0 and ending at the route's length.
+    """
+    total = timeline.total_distance
+    if total <= 0:
+        return np.zeros(1)
+
+    probes = np.append(np.arange(0, total, probe_spacing), total)
+    lonlat = timeline.position_at_distance(probes)
+    rows = np.floor(lonlat[:, 1] / cell_degrees).astype(np.int64)
+    cols = np.floor(lonlat[:, 0] / cell_degrees).astype(np.int64)
+    slots = np.floor((departure_timestamp + timeline.time_at_distance(probes)) / slot_seconds).astype(np.int64)
+
+    # Cells are chosen from the geometry alone, so re-sampling the same route for another
+    # departure time reuses the forecast series already fetched for it.
+    _, cell_ids = np.unique(np.stack([rows, cols], axis=1), axis=0, return_inverse=True)
+    cell_ids = cell_ids.ravel()
+    entries = np.flatnonzero(np.concatenate(([True], cell_ids[1:] != cell_ids[:-1])))
+    _, first_entry = np.unique(cell_ids[entries], return_index=True)
+    entries = np.sort(entries[first_entry])
+    if len(entries) > max_points:
+        entry_distances = probes[entries]
+        targets = np.linspace(0, total, max(max_points, 2))
+        right = np.clip(np.searchsorted(entry_distances, targets), 1, len(entries) - 1)
+        left = right - 1
+        nearest = np.where(entry_distances[right] - targets < targets - entry_distances[left], right, left)
+        entries = entries[np.unique(nearest)]
+        # The destination's cell always counts against the budget
+        entries = np.union1d(entries[:max(max_points - 1, 1)], np.flatnonzero(cell_ids == cell_ids[-1])[:1])
+    selected = np.zeros(cell_ids.max() + 1, dtype=bool)
+    selected[cell_ids[entries]] = True
+
+    # Add a point wherever a new forecast slot starts inside a sampled cell
+    slot_changes = np.flatnonzero(np.concatenate(([False], slots[1:] != slots[:-1])))
+    slot_changes = slot_changes[selected[cell_ids[slot_changes]]]
+    candidates = np.union1d(np.union1d(entries, slot_changes), [len(probes) - 1])
+
+    # Drop points that repeat an earlier point's cell and slot; the destination is always kept
+    keys = np.stack([cell_ids[candidates], slots[candidates]], axis=1)
+    _, first = np.unique(keys, axis=0, return_index=True)
+    candidates = np.union1d(candidates[first], [len(probes) - 1])
+    return probes[candidates]
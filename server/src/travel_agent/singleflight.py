@@ -0,0 +1,117 @@
+"""
+Coalescing of identical concurrent work.
+
+When several requests need the same thing at the same moment (the same trip plan, the
+same upstream call) only the first one does the work; the others wait for its result.
+Nothing is kept once the work finishes, so this complements the caches rather than
+replacing them.
+"""
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time and shares its outcome with every caller that
+    asks for the same key while it is in flight.
+
+    Callers all receive the same result object, so results must be treated as read-only
+    or copied by the caller.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, "asyncio.Future"] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Awaits fn() for key, or the call already in flight for key.
+
+        The shared call is shielded: a caller that is cancelled stops waiting, but the call
+        carries on for the others.
+        """
+        future = self._in_flight.get(key)
+        # A finished call may not have been forgotten yet, as done callbacks run later
+        if future is None or future.done() or future.get_loop() is not asyncio.get_running_loop():
+            future = asyncio.ensure_future(fn())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: "asyncio.Future") -> None:
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        # Mark any exception as retrieved in case every caller was cancelled
+        if not future.cancelled():
+            future.exception()
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+
+class SingleFlightStream:
+    """
+    SingleFlight for async iterators: runs at most one iteration per key at a time, and every
+    caller that asks for the same key while it is in flight receives all of its items, from
+    the first, as they are produced.
+
+    A caller that stops iterating leaves the iteration running for the others.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, "_Broadcast"] = {}
+
+    async def stream(self, key: Hashable, fn: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """Yields the items of fn() for key, or of the iteration already in flight for key."""
+        broadcast = self._in_flight.get(key)
+        if (broadcast is None or broadcast.task.done()
+                or broadcast.task.get_loop() is not asyncio.get_running_loop()):
+            broadcast = _Broadcast(fn())
+            self._in_flight[key] = broadcast
+            broadcast.task.add_done_callback(lambda done: self._forget(key, broadcast))
+        async for item in broadcast.subscribe():
+            yield item
+
+    def _forget(self, key: Hashable, broadcast: "_Broadcast") -> None:
+        if self._in_flight.get(key) is broadcast:
+            del self._in_flight[key]
+        # Mark any exception as retrieved in case every caller stopped iterating
+        if not broadcast.task.cancelled():
+            broadcast.task.exception()
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+
+class _Broadcast:
+    """Iterates items in a task of its own, keeping them for every subscriber to replay."""
+
+    def __init__(self, items: AsyncIterator):
+        self.items: List = []
+        self._updated = asyncio.Event()
+        self.task = asyncio.ensure_future(self._run(items))
+
+    async def _run(self, items: AsyncIterator):
+        try:
+            async for item in items:
+                self.items.append(item)
+                self._notify()
+        finally:
+            self._notify()
+
+    def _notify(self):
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator:
+        index = 0
+        while True:
+            while index < len(self.items):
+                yield self.items[index]
+                index += 1
+            if self.task.done():
+                # Raises the iteration's error, if it failed
+                self.task.result()
+                return
+            await self._updated.wait()
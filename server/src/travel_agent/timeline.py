@@ -0,0 +1,105 @@
+"""
+Distance and travel-time index over a route's geometry.
+
+RouteTimeline holds cumulative distance and cumulative duration at every vertex, so
+"where am I after d metres" and "when do I reach that point" are binary searches
+instead of walks over the polyline.
+"""
+from typing import Any, Dict, List, Union
+
+import numpy as np
+
+from .cache import LRUCache
+from .geometry import RouteGeometry, route_geometry
+
+EARTH_RADIUS_METERS = 6371000
+
+ArrayLike = Union[float, np.ndarray, List[float]]
+
+
+def haversine_distances(lonlat: np.ndarray) -> np.ndarray:
+    """Great-circle length in metres of each edge of an (n, 2) [longitude, latitude] polyline."""
+    lon = np.radians(lonlat[:, 0])
+    lat = np.radians(lonlat[:, 1])
+    a = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class RouteTimeline:
+    """
+    Cumulative distance (metres) and duration (seconds from departure) at each route vertex.
+
+    Durations come from the per-step durations in the route's segments, spread over each
+    step's vertices in proportion to distance. Routes without steps fall back to spreading
+    the segment durations evenly by distance.
+    """
+    __slots__ = ('geometry', 'cumulative_distance', 'cumulative_duration')
+
+    def __init__(self, geometry: RouteGeometry, segments: List[Dict[str, Any]]):
+        self.geometry = geometry
+        lonlat = geometry.lonlat
+        edge_distance = haversine_distances(lonlat) if len(lonlat) > 1 else np.zeros(0)
+        self.cumulative_distance = np.concatenate(([0.0], np.cumsum(edge_distance)))
+        self.cumulative_duration = np.concatenate(([0.0], np.cumsum(_edge_durations(edge_distance, segments))))
+
+    @property
+    def total_distance(self) -> float:
+        return float(self.cumulative_distance[-1])
+
+    @property
+    def total_duration(self) -> float:
+        return float(self.cumulative_duration[-1])
+
+    def position_at_distance(self, distance: ArrayLike) -> np.ndarray:
+        """[longitude, latitude] of the point(s) the given distance(s) along the route."""
+        distance = np.asarray(distance, dtype=np.float64)
+        lonlat = self.geometry.lonlat
+        return np.stack([
+            np.interp(distance, self.cumulative_distance, lonlat[:, 0]),
+            np.interp(distance, self.cumulative_distance, lonlat[:, 1]),
+        ], axis=-1)
+
+    def time_at_distance(self, distance: ArrayLike) -> np.ndarray:
+        """Seconds from departure until the given distance(s) along the route are reached."""
+        return np.interp(distance, self.cumulative_distance, self.cumulative_duration)
+
+    def time_at_vertex(self, index: Union[int, np.ndarray]) -> Union[float, np.ndarray]:
+        """Seconds from departure until the given vertex index(es) are reached."""
+        return self.cumulative_duration[index]
+
+
+def _edge_durations(edge_distance: np.ndarray, segments: List[Dict[str, Any]]) -> np.ndarray:
+    durations = np.zeros(len(edge_distance))
+    steps = [step for segment in segments for step in segment.get('steps', [])]
+    if not steps:
+        total = sum(segment.get('duration', 0) for segment in segments)
+        total_distance = edge_distance.sum()
+        if total_distance > 0:
+            durations = edge_distance * (total / total_distance)
+        return durations
+
+    for step in steps:
+        way_points = step.get('way_points', [])
+        if len(way_points) < 2 or way_points[1] <= way_points[0]:
+            continue
+        start, end = way_points[0], min(way_points[1], len(edge_distance))
+        step_distance = edge_distance[start:end]
+        length = step_distance.sum()
+        if length > 0:
+            durations[start:end] += step_distance * (step.get('duration', 0) / length)
+        else:
+            durations[start:end] += step.get('duration', 0) / (end - start)
+    return durations
+
+
+_timelines: LRUCache[RouteTimeline] = LRUCache(maxsize=128)
+
+
+def route_timeline(route: Dict[str, Any]) -> RouteTimeline:
+    """The timeline for an OpenRoute Service route, built once per distinct polyline."""
+    key = route.get('geometry', '')
+    timeline = _timelines.get(key)
+    if timeline is None:
+        timeline = RouteTimeline(route_geometry(route), route.get('segments', []))
+        _timelines.set(key, timeline)
+    return timeline
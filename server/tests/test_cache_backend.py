@@ -0,0 +1,194 @@
+import asyncio
+
+import pytest
+
+from src.travel_agent import cache_backend
+from src.travel_agent.cache_backend import MemoryBackend, SQLiteBackend, SharedCache
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def open_backend(request, tmp_path):
+    """Opens a backend of each kind; call it inside the test's event loop."""
+    if request.param == "memory":
+        return MemoryBackend
+    return lambda: SQLiteBackend(str(tmp_path / "cache.sqlite"), flush_interval_seconds=0.01)
+
+
+def run(open_backend, scenario):
+    async def main():
+        backend = open_backend()
+        try:
+            await scenario(backend)
+        finally:
+            await backend.close()
+
+    asyncio.run(main())
+
+
+async def eventually(read, expected, timeout=2.0):
+    """Polls read() until it returns expected, as the SQLite backend commits in the background."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while (value := await read()) != expected and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.01)
+    assert value == expected
+
+
+def test_get_and_set(open_backend):
+    async def scenario(backend):
+        assert await backend.get("directions", "a") is None
+        await backend.set("directions", "a", '{"x": 1}', 60)
+        await backend.set("weather", "a", "other", 60)
+        assert await backend.get("directions", "a") == '{"x": 1}'
+        assert await backend.get("weather", "a") == "other"
+        await backend.set("directions", "a", "replaced", 60)
+        assert await backend.get("directions", "a") == "replaced"
+        # Still readable once committed
+        await asyncio.sleep(0.05)
+        assert await backend.get("directions", "a") == "replaced"
+
+    run(open_backend, scenario)
+
+
+def test_entries_expire(open_backend):
+    async def scenario(backend):
+        await backend.set("directions", "a", "value", 0.05)
+        assert await backend.get("directions", "a") == "value"
+        await asyncio.sleep(0.1)
+        assert await backend.get("directions", "a") is None
+
+    run(open_backend, scenario)
+
+
+def test_add_only_stores_missing_or_expired_keys(open_backend):
+    async def scenario(backend):
+        assert await backend.add("claims", "a", "first", 0.1)
+        assert not await backend.add("claims", "a", "second", 0.1)
+        assert await backend.get("claims", "a") == "first"
+        assert await backend.add("claims", "b", "other", 0.1)
+        await asyncio.sleep(0.15)
+        assert await backend.add("claims", "a", "third", 60)
+        assert await backend.get("claims", "a") == "third"
+
+    run(open_backend, scenario)
+
+
+def test_add_from_concurrent_callers_stores_once(open_backend):
+    async def scenario(backend):
+        results = await asyncio.gather(*(backend.add("claims", "a", str(i), 60) for i in range(10)))
+        assert sum(results) == 1
+
+    run(open_backend, scenario)
+
+
+def test_max_entries_evicts_least_recently_used(open_backend):
+    async def scenario(backend):
+        for i in range(5):
+            await backend.set("plans", f"k{i}", str(i), 60, max_entries=3)
+        await eventually(lambda: backend.get("plans", "k0"), None)
+        await eventually(lambda: backend.get("plans", "k1"), None)
+        for i in range(2, 5):
+            assert await backend.get("plans", f"k{i}") == str(i)
+
+    run(open_backend, scenario)
+
+
+def test_increment_and_top(open_backend):
+    async def scenario(backend):
+        await backend.increment("popular", "a", 1, 60)
+        await backend.increment("popular", "b", 3, 60)
+        await backend.increment("popular", "a", 4, 60)
+        await backend.increment("other", "c", 10, 60)
+        await eventually(lambda: backend.top("popular", 10), [("a", 5.0), ("b", 3.0)])
+        assert await backend.top("popular", 1) == [("a", 5.0)]
+        assert await backend.top("missing", 10) == []
+
+    run(open_backend, scenario)
+
+
+def test_increment_keeps_the_highest_scores(open_backend):
+    async def scenario(backend):
+        await backend.increment("popular", "a", 5, 60, max_entries=2)
+        await backend.increment("popular", "b", 3, 60, max_entries=2)
+        await eventually(lambda: backend.top("popular", 10), [("a", 5.0), ("b", 3.0)])
+        await backend.increment("popular", "c", 1, 60, max_entries=2)
+        await asyncio.sleep(0.05)
+        await eventually(lambda: backend.top("popular", 10), [("a", 5.0), ("b", 3.0)])
+
+    run(open_backend, scenario)
+
+
+def test_scores_expire_and_restart_from_zero(open_backend):
+    async def scenario(backend):
+        await backend.increment("popular", "a", 5, 0.1)
+        await eventually(lambda: backend.top("popular", 10), [("a", 5.0)])
+        await asyncio.sleep(0.15)
+        assert await backend.top("popular", 10) == []
+        await backend.increment("popular", "a", 1, 60)
+        await eventually(lambda: backend.top("popular", 10), [("a", 1.0)])
+
+    run(open_backend, scenario)
+
+
+def test_sqlite_commits_buffered_writes_on_close(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+
+    async def scenario():
+        backend = SQLiteBackend(path, flush_interval_seconds=60)
+        await backend.set("directions", "a", "value", 60)
+        await backend.increment("popular", "a", 2, 60)
+        await backend.close()
+
+        backend = SQLiteBackend(path)
+        try:
+            assert await backend.get("directions", "a") == "value"
+            assert await backend.top("popular", 10) == [("a", 2.0)]
+            assert backend.purge_expired() == 0
+        finally:
+            await backend.close()
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_purges_expired_entries(tmp_path):
+    async def scenario():
+        backend = SQLiteBackend(str(tmp_path / "cache.sqlite"), flush_interval_seconds=0.01)
+        try:
+            await backend.set("directions", "a", "value", 0.05)
+            await backend.set("directions", "b", "value", 60)
+            await backend.increment("popular", "a", 1, 0.05)
+            await asyncio.sleep(0.1)
+            assert backend.purge_expired() == 2
+            assert await backend.get("directions", "b") == "value"
+        finally:
+            await backend.close()
+
+    asyncio.run(scenario())
+
+
+def test_shared_cache(monkeypatch):
+    monkeypatch.setenv("CACHE_BACKEND", "memory")
+
+    async def scenario():
+        plans = SharedCache("plans", ttl_seconds=0.05, max_entries=2)
+        try:
+            await plans.set("a", "default")
+            await plans.set("b", "longer", ttl_seconds=60)
+            assert not await plans.add("b", "ignored")
+            assert await cache_backend.get_cache_backend().get("plans", "b") == "longer"
+            await asyncio.sleep(0.1)
+            assert await plans.get("a") is None
+            assert await plans.get("b") == "longer"
+            assert await plans.add("a", "claimed")
+            await plans.set("c", "third")
+            # Over max_entries, the least recently used entry goes
+            assert await plans.get("b") is None
+        finally:
+            await cache_backend.close_cache_backend()
+
+    asyncio.run(scenario())
+
+
+def test_unknown_backend(monkeypatch):
+    monkeypatch.setenv("CACHE_BACKEND", "nope")
+    with pytest.raises(ValueError):
+        cache_backend.get_cache_backend()
@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from src.travel_agent.departure_sweep import (
+    FORECAST_SLOT_SECONDS,
+    DepartureCurve,
+    ForecastSeries,
+    sweep_departures,
+    to_timestamp,
+)
+
+DEPARTURE = datetime(2025, 4, 14, 8, 0)
+CLEAR = 800
+HEAVY_RAIN = 502
+
+
+def series(conditions, start=DEPARTURE, temp=10.0, wind=3.0):
+    """A forecast series with one 3-hour slot per condition id, from start."""
+    first = to_timestamp(start)
+    return ForecastSeries([
+        {
+            "dt": int(first + i * FORECAST_SLOT_SECONDS),
+            "weather": [{"id": condition}],
+            "main": {"temp": temp},
+            "wind": {"speed": wind},
+        }
+        for i, condition in enumerate(conditions)
+    ])
+
+
+def reference_hazards(point_series, arrival_offsets, departure_time, offsets):
+    """Hazard count per candidate offset, picking each point's closest slot by a linear scan."""
+    start = to_timestamp(departure_time)
+    counts = []
+    for offset in offsets:
+        count = 0
+        for s, arrival in zip(point_series, arrival_offsets):
+            if not len(s):
+                continue
+            query = start + offset + arrival
+            # Ties go to the earlier slot
+            slot = min(range(len(s)), key=lambda i: (abs(s.dt[i] - query), i))
+            count += int(s.hazard[slot])
+        counts.append(count)
+    return counts
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("resolution_minutes", [15, 60, 180])
+def test_sweep_matches_linear_scan(seed, resolution_minutes):
+    rng = np.random.default_rng(seed)
+    point_series = [
+        series(rng.choice([CLEAR, HEAVY_RAIN, 601, 741], size=rng.integers(20, 41)).tolist(),
+               start=DEPARTURE - timedelta(hours=int(rng.integers(0, 3))))
+        for _ in range(rng.integers(1, 8))
+    ]
+    arrival_offsets = np.sort(rng.uniform(0, 12 * 3600, size=len(point_series))).tolist()
+    curve = sweep_departures(point_series, arrival_offsets, DEPARTURE, resolution_minutes * 60)
+
+    assert curve.offsets[0] == 0
+    np.testing.assert_array_equal(np.diff(curve.offsets), resolution_minutes * 60)
+    assert curve.hazards.tolist() == reference_hazards(point_series, arrival_offsets, DEPARTURE, curve.offsets)
+
+
+def test_sweep_stops_at_the_forecast_horizon():
+    point_series = [series([CLEAR] * 40), series([CLEAR] * 30)]
+    arrival_offsets = [0.0, 6 * 3600.0]
+    curve = sweep_departures(point_series, arrival_offsets, DEPARTURE, 3600)
+    start = to_timestamp(DEPARTURE)
+    last_arrivals = start + curve.offsets[-1] + np.array(arrival_offsets)
+    ends = np.array([s.dt[-1] for s in point_series]) + FORECAST_SLOT_SECONDS / 2
+    # Every point of the last candidate is still within its forecast; one step later one isn't
+    assert (last_arrivals <= ends).all()
+    assert (last_arrivals + 3600 > ends).any()
+
+
+def test_ties_pick_the_earliest_departure():
+    # Rain in the first two slots, then clear: every departure closest to a later slot is hazard free
+    point_series = [series([HEAVY_RAIN, HEAVY_RAIN] + [CLEAR] * 20)]
+    curve = sweep_departures(point_series, [0.0], DEPARTURE, 3600)
+    assert curve.hazards[:5].tolist() == [1, 1, 1, 1, 1]
+    assert curve.hazards[5:].max() == 0
+    assert curve.best() == DEPARTURE + timedelta(hours=5)
+    # Half-hourly, 4h30 is exactly between the second and third slots and takes the earlier one
+    curve = sweep_departures(point_series, [0.0], DEPARTURE, 1800)
+    assert curve.hazards[9] == 1
+    assert curve.best() == DEPARTURE + timedelta(hours=5)
+
+
+def test_closest_slot_ties_go_to_the_earlier_slot():
+    s = series([CLEAR, CLEAR, CLEAR])
+    midpoint = to_timestamp(DEPARTURE) + FORECAST_SLOT_SECONDS / 2
+    assert s.closest_slot(np.array([midpoint, midpoint + 1, -1e12, 1e12])).tolist() == [0, 1, 0, 2]
+
+
+def test_single_slot_series():
+    s = series([HEAVY_RAIN])
+    assert s.closest_slot(np.array([0.0, 1e12])).tolist() == [0, 0]
+    curve = sweep_departures([s], [0.0], DEPARTURE, 3600)
+    assert curve.hazards.tolist() == [1, 1]
+
+
+def test_sweep_without_forecasts_keeps_the_departure():
+    curve = sweep_departures([], [], DEPARTURE)
+    assert curve.best() == DEPARTURE
+    curve = sweep_departures([ForecastSeries([])], [0.0], DEPARTURE)
+    assert curve.best() == DEPARTURE
+    assert DepartureCurve(DEPARTURE, np.zeros(0), np.zeros(0)).best() == DEPARTURE
+
+
+def test_freezing_and_wind_count_as_hazards():
+    assert series([CLEAR], temp=-5.0).hazard.tolist() == [1]
+    assert series([CLEAR], wind=20.0).hazard.tolist() == [1]
+    assert series([CLEAR]).hazard.tolist() == [0]
+
+
+def test_curve_to_list():
+    curve = sweep_departures([series([HEAVY_RAIN, CLEAR, CLEAR])], [0.0], DEPARTURE, 3 * 3600)
+    assert curve.to_list() == [
+        {"departure_time": "2025-04-14T08:00:00", "hazards": 1},
+        {"departure_time": "2025-04-14T11:00:00", "hazards": 0},
+        {"departure_time": "2025-04-14T14:00:00", "hazards": 0},
+    ]
@@ -0,0 +1,176 @@
+import numpy as np
+import pytest
+
+from src.travel_agent.geometry import (
+    RouteGeometry,
+    decode_polyline,
+    encode_polyline,
+    simplify,
+    zoom_tolerance,
+)
+
+
+def reference_encode(points, precisions=(1e5, 1e5)):
+    """The polyline algorithm one value at a time, over [latitude, longitude, ...] rows."""
+    encoded = []
+    previous = [0] * len(precisions)
+    for point in points:
+        for dim, coordinate in enumerate(point):
+            value = int(round(coordinate * precisions[dim]))
+            delta, previous[dim] = value - previous[dim], value
+            delta = ~(delta << 1) if delta < 0 else delta << 1
+            while delta >= 0x20:
+                encoded.append(chr((0x20 | (delta & 0x1F)) + 63))
+                delta >>= 5
+            encoded.append(chr(delta + 63))
+    return "".join(encoded)
+
+
+def reference_decode(polyline, dims=2):
+    """The polyline algorithm one character at a time; returns integer [latitude, longitude, ...] rows."""
+    values = []
+    index = 0
+    while index < len(polyline):
+        result, shift = 0, 0
+        while True:
+            chunk = ord(polyline[index]) - 63
+            index += 1
+            result |= (chunk & 0x1F) << shift
+            shift += 5
+            if chunk < 0x20:
+                break
+        values.append(~(result >> 1) if result & 1 else result >> 1)
+    rows = []
+    current = [0] * dims
+    for start in range(0, len(values) // dims * dims, dims):
+        current = [c + d for c, d in zip(current, values[start:start + dims])]
+        rows.append(current)
+    return rows
+
+
+def reference_simplify(points, tolerance):
+    """Recursive Douglas-Peucker on already scaled points; returns the kept indices."""
+    keep = {0, len(points) - 1}
+
+    def split(first, last):
+        if last - first < 2:
+            return
+        start, end = points[first], points[last]
+        direction = end - start
+        length = np.hypot(*direction)
+        best, best_distance = None, -1.0
+        for i in range(first + 1, last):
+            offset = points[i] - start
+            if length > 0:
+                distance = abs(direction[0] * offset[1] - direction[1] * offset[0]) / length
+            else:
+                distance = np.hypot(*offset)
+            if distance > best_distance:
+                best, best_distance = i, distance
+        if best_distance > tolerance:
+            keep.add(best)
+            split(first, best)
+            split(best, last)
+
+    split(0, len(points) - 1)
+    return sorted(keep)
+
+
+def random_route(n, seed=0):
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(scale=0.01, size=(n, 2))
+    steps[0] = [-79.38, 43.65]
+    return np.round(np.cumsum(steps, axis=0), 5)
+
+
+@pytest.mark.parametrize("n", [1, 2, 50, 2000])
+def test_polyline_round_trip(n):
+    lonlat = random_route(n, seed=n)
+    polyline = encode_polyline(lonlat)
+    assert polyline == reference_encode(lonlat[:, ::-1].tolist())
+    np.testing.assert_allclose(decode_polyline(polyline), lonlat, atol=1e-9)
+
+
+def test_decode_matches_reference():
+    polyline = reference_encode([[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]])
+    assert polyline == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    expected = np.array(reference_decode(polyline))[:, ::-1] / 1e5
+    np.testing.assert_allclose(decode_polyline(polyline), expected)
+
+
+def test_polyline_extremes():
+    lonlat = np.array([[-179.99999, -89.99999], [179.99999, 89.99999], [0.0, 0.0], [0.00001, -0.00001]])
+    np.testing.assert_allclose(decode_polyline(encode_polyline(lonlat)), lonlat, atol=1e-9)
+
+
+def test_polyline_repeated_points():
+    lonlat = np.array([[-79.38, 43.65]] * 3)
+    assert encode_polyline(lonlat).endswith("????")
+    np.testing.assert_allclose(decode_polyline(encode_polyline(lonlat)), lonlat)
+
+
+def test_polyline_empty():
+    assert encode_polyline(np.empty((0, 2))) == ""
+    assert decode_polyline("").shape == (0, 2)
+    assert decode_polyline("", is3d=True).shape == (0, 3)
+
+
+def test_decode_3d():
+    # Elevation follows latitude and longitude, with 2 decimal places
+    polyline = reference_encode([[43.65, -79.38, 76.5], [43.7, -79.4, 120.25]], (1e5, 1e5, 1e2))
+    np.testing.assert_allclose(decode_polyline(polyline, is3d=True), [[-79.38, 43.65, 76.5], [-79.4, 43.7, 120.25]])
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("zoom", [4, 8, 12, 16])
+def test_simplify_matches_recursive_douglas_peucker(seed, zoom):
+    lonlat = random_route(300, seed=seed)
+    tolerance = zoom_tolerance(zoom)
+    scaled = lonlat.copy()
+    scaled[:, 0] *= np.cos(np.radians(lonlat[:, 1].mean()))
+    expected = lonlat[reference_simplify(scaled, tolerance)]
+    np.testing.assert_array_equal(simplify(lonlat, tolerance), expected)
+
+
+def test_simplify_short_and_degenerate_routes():
+    for n in (0, 1, 2):
+        lonlat = random_route(max(n, 1))[:n]
+        assert simplify(lonlat, 1.0) is lonlat
+    line = np.stack([np.linspace(-80, -79, 50), np.linspace(43, 44, 50)], axis=1)
+    np.testing.assert_array_equal(simplify(line, 1e-6), line[[0, -1]])
+    # A loop back to the start has a zero-length span; vertices are then measured from the start
+    loop = np.array([[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 0.0]])
+    np.testing.assert_array_equal(simplify(loop, 0.1), loop)
+
+
+def test_simplify_keeps_endpoints_and_order():
+    lonlat = random_route(500, seed=7)
+    simplified = simplify(lonlat, zoom_tolerance(6))
+    np.testing.assert_array_equal(simplified[[0, -1]], lonlat[[0, -1]])
+    indexes = [int(np.flatnonzero((lonlat == row).all(axis=1))[0]) for row in simplified]
+    assert indexes == sorted(indexes)
+
+
+def test_zoom_tolerance_is_clamped():
+    assert zoom_tolerance(-3) == zoom_tolerance(0) == 360.0 / 256
+    assert zoom_tolerance(40) == zoom_tolerance(22)
+    assert zoom_tolerance(10) == pytest.approx(zoom_tolerance(9) / 2)
+
+
+def test_route_geometry_views_share_one_buffer():
+    lonlat = random_route(20)
+    geometry = RouteGeometry.from_polyline(encode_polyline(lonlat))
+    assert len(geometry) == 20
+    assert np.shares_memory(geometry.lonlat, geometry.latlon)
+    assert geometry.geojson["coordinates"] is geometry.lonlat
+    np.testing.assert_allclose(geometry.latlon, lonlat[:, ::-1])
+    with pytest.raises(ValueError):
+        geometry.lonlat[0, 0] = 0.0
+    assert geometry.polyline() == encode_polyline(lonlat)
+
+
+def test_route_geometry_empty():
+    geometry = RouteGeometry.from_polyline("")
+    assert len(geometry) == 0
+    assert geometry.polyline() == ""
+    assert len(geometry.simplified(10)) == 0
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from src.travel_agent.departure_sweep import FORECAST_SLOT_SECONDS
+from src.travel_agent.geometry import RouteGeometry
+from src.travel_agent.sampling import (
+    FORECAST_CELL_DEGREES,
+    PROBE_SPACING_METERS,
+    adaptive_sample_distances,
+    fixed_sample_distances,
+    forecast_cell,
+)
+from src.travel_agent.timeline import RouteTimeline
+
+DEPARTURE_TIMESTAMP = 1744617600.0  # 2025-04-14 08:00 UTC, on a forecast slot boundary
+
+
+def straight_route(start, end, hours, vertices=200):
+    """A timeline along a straight [longitude, latitude] line driven in the given number of hours."""
+    lonlat = np.linspace(start, end, vertices)
+    return RouteTimeline(RouteGeometry(lonlat), [{"duration": hours * 3600}])
+
+
+def cells_at(timeline, distances):
+    return [forecast_cell(lat, lon) for lon, lat in timeline.position_at_distance(distances)]
+
+
+def slots_at(timeline, distances):
+    return np.floor((DEPARTURE_TIMESTAMP + timeline.time_at_distance(distances)) / FORECAST_SLOT_SECONDS).astype(int)
+
+
+def test_forecast_cell():
+    assert forecast_cell(43.65, -79.38) == (174, -318)
+    assert forecast_cell(0.0, 0.0) == (0, 0)
+    # Cells include their lower edges and floor towards negative infinity
+    assert forecast_cell(0.25, 0.25) == (1, 1)
+    assert forecast_cell(-0.01, -0.24999) == (-1, -1)
+    assert forecast_cell(-0.25, -0.25) == (-1, -1)
+    assert forecast_cell(43.65, -79.38, cell_degrees=1.0) == (43, -80)
+
+
+def test_fixed_sampling_spreads_points_evenly():
+    timeline = straight_route([-79.4, 43.6], [-80.4, 43.6], 1)
+    distances = fixed_sample_distances(timeline, 5)
+    assert len(distances) == 7
+    assert distances[0] == 0 and distances[-1] == pytest.approx(timeline.total_distance)
+    np.testing.assert_allclose(np.diff(distances), timeline.total_distance / 6)
+
+
+def test_adaptive_sampling_covers_every_cell_within_budget():
+    # About 4 cells west and 2 slots long
+    timeline = straight_route([-79.4, 43.6], [-80.4, 43.6], 5)
+    distances = adaptive_sample_distances(timeline, DEPARTURE_TIMESTAMP, max_points=10)
+
+    assert distances[0] == 0
+    assert distances[-1] == pytest.approx(timeline.total_distance)
+    assert (np.diff(distances) > 0).all()
+    probes = np.append(np.arange(0, timeline.total_distance, PROBE_SPACING_METERS), timeline.total_distance)
+    assert set(cells_at(timeline, distances)) == set(cells_at(timeline, probes))
+
+
+def test_adaptive_sampling_adds_a_point_per_slot_change_and_no_repeats():
+    # Within one cell column for 30 hours: the slot changes every 3 hours
+    timeline = straight_route([-79.38, 43.51], [-79.38, 43.74], 30)
+    distances = adaptive_sample_distances(timeline, DEPARTURE_TIMESTAMP)
+    cells = cells_at(timeline, distances)
+    slots = slots_at(timeline, distances)
+    probes = np.append(np.arange(0, timeline.total_distance, PROBE_SPACING_METERS), timeline.total_distance)
+    expected = set(zip(cells_at(timeline, probes), slots_at(timeline, probes)))
+    keys = list(zip(cells, slots))
+    assert set(keys) == expected
+    # Only the destination may repeat an earlier point's cell and slot
+    assert len(set(keys[:-1])) == len(keys) - 1
+
+
+@pytest.mark.parametrize("budget", [2, 3, 5, 10])
+def test_adaptive_sampling_budget_overflow(budget):
+    # Toronto to Chicago crosses far more cells than the budget
+    timeline = straight_route([-79.38, 43.65], [-87.63, 41.88], 8)
+    distances = adaptive_sample_distances(timeline, DEPARTURE_TIMESTAMP, max_points=budget)
+    cells = cells_at(timeline, distances)
+
+    assert len(set(cells)) <= budget
+    assert cells[0] == forecast_cell(43.65, -79.38)
+    assert cells[-1] == forecast_cell(41.88, -87.63)
+    assert distances[0] == 0
+    assert distances[-1] == pytest.approx(timeline.total_distance)
+    assert (np.diff(distances) > 0).all()
+
+
+def test_adaptive_sampling_budget_spreads_points_along_the_route():
+    timeline = straight_route([-79.38, 43.65], [-87.63, 41.88], 8)
+    distances = adaptive_sample_distances(timeline, DEPARTURE_TIMESTAMP, max_points=5,
+                                          slot_seconds=10 ** 9)
+    # Largest gap is no more than twice an even spread, give or take a cell
+    cell_meters = FORECAST_CELL_DEGREES * 111320
+    assert np.diff(distances).max() <= 2 * timeline.total_distance / 4 + cell_meters
+
+
+def test_adaptive_sampling_short_and_empty_routes():
+    point = RouteTimeline(RouteGeometry(np.array([[-79.38, 43.65]])), [])
+    np.testing.assert_array_equal(adaptive_sample_distances(point, DEPARTURE_TIMESTAMP), [0.0])
+    empty = RouteTimeline(RouteGeometry(np.empty((0, 2))), [])
+    np.testing.assert_array_equal(adaptive_sample_distances(empty, DEPARTURE_TIMESTAMP), [0.0])
+    # Shorter than one probe spacing, inside one cell: the start and the end
+    short = straight_route([-79.38, 43.65], [-79.379, 43.651], 0.01, vertices=3)
+    distances = adaptive_sample_distances(short, DEPARTURE_TIMESTAMP)
+    np.testing.assert_allclose(distances, [0.0, short.total_distance])
@@ -0,0 +1,177 @@
+import asyncio
+
+import pytest
+
+from src.travel_agent.singleflight import SingleFlight, SingleFlightStream
+
+
+class Work:
+    """An async call that counts its runs and finishes when released."""
+
+    def __init__(self, result="done", error=None):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_concurrent_calls_share_one_run():
+    async def scenario():
+        flight = SingleFlight()
+        work = Work(result={"plan": 1})
+        callers = [asyncio.ensure_future(flight.do("trip", work)) for _ in range(5)]
+        await asyncio.sleep(0)
+        assert len(flight) == 1
+        work.release.set()
+        results = await asyncio.gather(*callers)
+        assert work.calls == 1
+        assert all(result is results[0] for result in results)
+        assert len(flight) == 0
+
+    asyncio.run(scenario())
+
+
+def test_different_keys_run_separately():
+    async def scenario():
+        flight = SingleFlight()
+        first, second = Work("a"), Work("b")
+        first.release.set()
+        second.release.set()
+        assert await asyncio.gather(flight.do("a", first), flight.do("b", second)) == ["a", "b"]
+        assert (first.calls, second.calls) == (1, 1)
+
+    asyncio.run(scenario())
+
+
+def test_nothing_is_kept_after_a_call_finishes():
+    async def scenario():
+        flight = SingleFlight()
+        work = Work()
+        work.release.set()
+        await flight.do("trip", work)
+        await flight.do("trip", work)
+        assert work.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_errors_reach_every_caller_and_are_not_kept():
+    async def scenario():
+        flight = SingleFlight()
+        work = Work(error=ValueError("no route"))
+        callers = [asyncio.ensure_future(flight.do("trip", work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        work.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert work.calls == 1
+        assert len(flight) == 0
+
+        work.error = None
+        assert await flight.do("trip", work) == "done"
+        assert work.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_a_cancelled_caller_leaves_the_call_running():
+    async def scenario():
+        flight = SingleFlight()
+        work = Work()
+        cancelled = asyncio.ensure_future(flight.do("trip", work))
+        waiting = asyncio.ensure_future(flight.do("trip", work))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        work.release.set()
+        assert await waiting == "done"
+        assert cancelled.cancelled()
+        assert work.calls == 1
+
+    asyncio.run(scenario())
+
+
+async def events(log, items, release=None, error=None):
+    log.append("started")
+    for item in items:
+        if release is not None:
+            await release.wait()
+            release.clear()
+        yield item
+    if error is not None:
+        raise error
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+def test_stream_subscribers_all_receive_every_item():
+    async def scenario():
+        flight = SingleFlightStream()
+        log = []
+        release = asyncio.Event()
+        first = asyncio.ensure_future(collect(flight.stream("trip", lambda: events(log, [1, 2, 3], release))))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.sleep(0.01)
+        # Joins after the first item was produced, and gets it replayed
+        late = asyncio.ensure_future(collect(flight.stream("trip", lambda: events(log, [9], release))))
+        while not first.done():
+            release.set()
+            await asyncio.sleep(0.01)
+        assert await first == [1, 2, 3]
+        assert await late == [1, 2, 3]
+        assert log == ["started"]
+        assert len(flight) == 0
+
+    asyncio.run(scenario())
+
+
+def test_stream_errors_reach_every_subscriber():
+    async def scenario():
+        flight = SingleFlightStream()
+        log = []
+        make = lambda: events(log, [1], error=RuntimeError("agent failed"))
+        subscribers = [collect(flight.stream("trip", make)) for _ in range(2)]
+        results = await asyncio.gather(*subscribers, return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert log == ["started"]
+
+    asyncio.run(scenario())
+
+
+def test_stream_subscriber_that_stops_leaves_the_others_running():
+    async def scenario():
+        flight = SingleFlightStream()
+        log = []
+        make = lambda: events(log, [1, 2, 3])
+
+        async def first_only():
+            async for item in flight.stream("trip", make):
+                return item
+
+        assert await asyncio.gather(first_only(), collect(flight.stream("trip", make))) == [1, [1, 2, 3]]
+        assert log == ["started"]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("count", [0, 1])
+def test_stream_runs_again_once_finished(count):
+    async def scenario():
+        flight = SingleFlightStream()
+        log = []
+        make = lambda: events(log, list(range(count)))
+        assert await collect(flight.stream("trip", make)) == list(range(count))
+        assert await collect(flight.stream("trip", make)) == list(range(count))
+        assert log == ["started", "started"]
+
+    asyncio.run(scenario())